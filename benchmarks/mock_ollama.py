@@ -0,0 +1,157 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+TOKEN_PATTERN = re.compile(r'\s*\w+|\s*[^\w\s]|\s+')
+
+
+def load_stream(path):
+    """Read a recorded /api/generate NDJSON stream into a list of chunks"""
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def text_to_chunks(text, model="mock-model:latest"):
+    """Split text into token-sized chunks shaped like an Ollama stream"""
+    tokens = TOKEN_PATTERN.findall(text)
+    chunks = [{"model": model, "response": token, "done": False} for token in tokens]
+    chunks.append({
+        "model": model,
+        "response": "",
+        "done": True,
+        "done_reason": "stop",
+        "prompt_eval_count": 600,
+        "eval_count": len(tokens),
+    })
+    return chunks
+
+
+class MockOllamaServer:
+    """Local stand-in for the Ollama HTTP API that replays a recorded stream
+
+    /api/generate sends the chunks of the stream at tokens_per_second after
+    first_token_delay, as chunked NDJSON over a keep-alive connection like
+    Ollama does. The final chunk gets durations that match the replay.
+    /api/tags lists models and /api/embed returns deterministic vectors.
+    """
+
+    def __init__(self, chunks, tokens_per_second=50.0, first_token_delay=0.0,
+                 models=("mock-model:latest",), embedding_size=64):
+        self.chunks = chunks
+        self.tokens_per_second = tokens_per_second
+        self.first_token_delay = first_token_delay
+        self.models = list(models)
+        self.embedding_size = embedding_size
+        self.requests = []
+        self.server = None
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start serving on a free local port"""
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self.send_json({"models": [{"name": name} for name in mock.models]})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                mock.requests.append((self.path, payload))
+                if self.path == "/api/generate":
+                    if payload.get("stream", True) and payload.get("prompt"):
+                        self.send_stream()
+                    else:
+                        self.send_json({"model": payload.get("model"), "response": "",
+                                        "done": True, "load_duration": 0})
+                elif self.path == "/api/embed":
+                    self.send_json({"embeddings": [mock.embedding(text) for text in payload["input"]]})
+                else:
+                    self.send_error(404)
+
+            def send_json(self, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                interval = 1.0 / mock.tokens_per_second if mock.tokens_per_second else 0.0
+                start = time.perf_counter()
+                count = 0
+                for index, chunk in enumerate(mock.chunks):
+                    if chunk.get("done"):
+                        elapsed = time.perf_counter() - start
+                        chunk = dict(chunk)
+                        chunk.setdefault("eval_count", count)
+                        chunk["eval_duration"] = int(max(elapsed - mock.first_token_delay, 0) * 1e9)
+                        chunk["prompt_eval_duration"] = int(mock.first_token_delay * 1e9)
+                        chunk["total_duration"] = int(elapsed * 1e9)
+                        chunk["load_duration"] = 0
+                    else:
+                        # Absolute schedule, so delays do not add up over the stream
+                        delay = start + mock.first_token_delay + index * interval - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                        count += 1
+                    data = (json.dumps(chunk) + "\n").encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                    self.wfile.flush()
+                    if chunk.get("done"):
+                        break
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="MockOllama", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server and close its socket"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def embedding(self, text):
+        """Deterministic unit-free vector for a text"""
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [(digest[i % len(digest)] - 128) / 128.0 for i in range(self.embedding_size)]
+
+    def expected_duration(self):
+        """Seconds the replay of one stream takes at the configured rate"""
+        tokens = sum(1 for chunk in self.chunks if not chunk.get("done"))
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        return self.first_token_delay + max(tokens - 1, 0) * interval
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
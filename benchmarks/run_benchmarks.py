@@ -0,0 +1,378 @@
+"""Offline performance benchmarks of the OllamaChat plugin
+
+Runs without Ollama, PostgreSQL or a network: a local mock server replays a
+recorded Ollama stream and catalogs of 10, 1,000 and 50,000 tables are
+served by a fake DB-API connection. Benchmarks that need QGIS widgets are
+skipped when qgis cannot be imported.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --only schema --output results.json
+    python benchmarks/run_benchmarks.py --check benchmarks/baseline.json
+
+With --check the run fails when a benchmark takes longer than the
+max_seconds given for it in the baseline file.
+"""
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCHMARK_DIR)
+PACKAGE = "ollama_chat"
+
+sys.path.insert(0, BENCHMARK_DIR)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from mock_ollama import MockOllamaServer, load_stream  # noqa: E402
+from synthetic_catalog import FakeConnection, generate_catalog_rows  # noqa: E402
+
+
+STREAM_PATH = os.path.join(BENCHMARK_DIR, "streams", "sql_answer.ndjson")
+CATALOG_SIZES = (10, 1000, 50000)
+MODEL_NAME = "llama3:8b"
+
+BENCHMARKS = []
+
+
+def benchmark(name, needs_qgis=False):
+    """Register a benchmark function under name"""
+    def register(function):
+        BENCHMARKS.append((name, needs_qgis, function))
+        return function
+    return register
+
+
+def load_plugin():
+    """Import the plugin directory as the package ollama_chat"""
+    if PACKAGE in sys.modules:
+        return sys.modules[PACKAGE]
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE, os.path.join(PLUGIN_DIR, "__init__.py"), submodule_search_locations=[PLUGIN_DIR]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+def plugin(module_name):
+    """Return a module of the plugin package"""
+    load_plugin()
+    return importlib.import_module(f"{PACKAGE}.{module_name}")
+
+
+def qgis_available():
+    """Return True if the QGIS Python bindings can be imported"""
+    try:
+        importlib.import_module("qgis.PyQt.QtWidgets")
+        return True
+    except ImportError:
+        return False
+
+
+def measure(function, repeat=5, warmup=1):
+    """Run function warmup + repeat times, return the timings in seconds"""
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings, **metrics):
+    """Result dict with the median as seconds, plus extra metrics"""
+    result = {"seconds": statistics.median(timings), "min_seconds": min(timings), "runs": len(timings)}
+    result.update(metrics)
+    return result
+
+
+def response_text():
+    """Text of the recorded answer"""
+    return "".join(chunk.get("response", "") for chunk in load_stream(STREAM_PATH))
+
+
+@benchmark("extract_sql")
+def bench_extract_sql(options):
+    """extract_sql_from_text on the full recorded answer"""
+    extraction = plugin("sql_extraction")
+    text = response_text()
+    calls = 200
+
+    def run():
+        for _ in range(calls):
+            assert extraction.extract_sql_from_text(text)
+
+    timings = [timing / calls for timing in measure(run, repeat=options.repeat)]
+    return summarize(timings, mb_per_second=len(text) / statistics.median(timings) / 1e6)
+
+
+@benchmark("extract_sql_incremental")
+def bench_extract_sql_incremental(options):
+    """IncrementalSqlExtractor fed the recorded answer token by token"""
+    extraction = plugin("sql_extraction")
+    tokens = [chunk.get("response", "") for chunk in load_stream(STREAM_PATH)]
+    calls = 200
+
+    def run():
+        for _ in range(calls):
+            extractor = extraction.IncrementalSqlExtractor()
+            for token in tokens:
+                extractor.feed(token)
+            assert extractor.sql
+
+    timings = [timing / calls for timing in measure(run, repeat=options.repeat)]
+    return summarize(timings, tokens_per_second=len(tokens) / statistics.median(timings))
+
+
+def schema_benchmark(table_count):
+    """Benchmark of the schema text build for a catalog of table_count tables"""
+    def run_benchmark(options):
+        schema_cache = plugin("schema_cache")
+        schema_budget = plugin("schema_budget")
+
+        connection = FakeConnection(generate_catalog_rows(table_count))
+        budget = schema_budget.schema_budget(8192, "Find all buildings within 500 m of main roads")
+
+        # The function build_postgres_schema_text of the plugin calls
+        def build(cache):
+            return schema_budget.build_schema_text(cache, "bench", connection, "bench", [], "compact", budget)
+
+        cold = measure(lambda: build(schema_cache.SchemaCache()), repeat=options.repeat)
+        cache = schema_cache.SchemaCache()
+        build(cache)
+        warm = measure(lambda: build(cache), repeat=options.repeat)
+        text, _ = build(cache)
+        return summarize(
+            cold,
+            warm_seconds=statistics.median(warm),
+            schema_tokens=schema_budget.estimate_tokens(text),
+            budget_tokens=budget
+        )
+    return run_benchmark
+
+
+for size in CATALOG_SIZES:
+    benchmark(f"schema_build_{size}")(schema_benchmark(size))
+
+
+def stream_prompt(client, extraction):
+    """Model check, request and OllamaClient.read_generation, the client calls of the worker"""
+    available, error = client.check_model(MODEL_NAME)
+    assert available, error
+
+    start = time.perf_counter()
+    first_token = []
+
+    def on_token(text):
+        if not first_token:
+            first_token.append(time.perf_counter() - start)
+
+    extractor = extraction.IncrementalSqlExtractor()
+    response = client.generate({"model": MODEL_NAME, "prompt": "benchmark", "stream": True})
+    response.raise_for_status()
+    try:
+        text, final_chunk, _ = client.read_generation(response, on_token=on_token, sql_extractor=extractor)
+    finally:
+        response.close()
+    assert text and extractor.sql and final_chunk.get("done")
+    return first_token[0]
+
+
+@benchmark("ollama_stream")
+def bench_ollama_stream(options):
+    """Client overhead of a streamed prompt on top of the mock server's replay time"""
+    client_module = plugin("ollama_client")
+    extraction = plugin("sql_extraction")
+
+    with MockOllamaServer(load_stream(STREAM_PATH), options.token_rate,
+                          options.first_token_delay, models=[MODEL_NAME]) as server:
+        client = client_module.OllamaClient(server.base_url)
+        try:
+            first_tokens = []
+            timings = measure(lambda: first_tokens.append(stream_prompt(client, extraction)),
+                              repeat=options.repeat)
+        finally:
+            client.close()
+        expected = server.expected_duration()
+
+    overheads = [max(timing - expected, 0.0) for timing in timings]
+    return summarize(
+        overheads,
+        wall_seconds=statistics.median(timings),
+        replay_seconds=expected,
+        first_token_seconds=statistics.median(first_tokens),
+        token_rate=options.token_rate
+    )
+
+
+def qt_application():
+    """Return the QApplication, creating it for widget benchmarks"""
+    from qgis.PyQt.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+@benchmark("worker_stream", needs_qgis=True)
+def bench_worker_stream(options):
+    """OllamaGenerateWorker.run against the mock server, overhead over the replay"""
+    qt_application()
+    client_module = plugin("ollama_client")
+    extraction = plugin("sql_extraction")
+    worker_module = plugin("ollama_worker")
+
+    with MockOllamaServer(load_stream(STREAM_PATH), options.token_rate,
+                          options.first_token_delay, models=[MODEL_NAME]) as server:
+        client = client_module.OllamaClient(server.base_url)
+
+        def run():
+            finished = []
+            worker = worker_module.OllamaGenerateWorker(
+                client,
+                MODEL_NAME,
+                "benchmark",
+                model_checker=client.check_model,
+                sql_extractor=extraction.IncrementalSqlExtractor()
+            )
+            worker.generation_finished.connect(lambda text, chunk: finished.append(text))
+            # Run on this thread, the signals are then delivered directly
+            worker.run()
+            assert finished and finished[0]
+
+        try:
+            timings = measure(run, repeat=options.repeat)
+        finally:
+            client.close()
+        expected = server.expected_duration()
+
+    overheads = [max(timing - expected, 0.0) for timing in timings]
+    return summarize(overheads, wall_seconds=statistics.median(timings), replay_seconds=expected)
+
+
+@benchmark("render_stream", needs_qgis=True)
+def bench_render_stream(options):
+    """StreamRenderer inserting the recorded answer into a QTextEdit"""
+    qt_application()
+    from qgis.PyQt.QtWidgets import QTextEdit
+    renderer_module = plugin("stream_renderer")
+
+    # A long answer, so the cost of appending to a large document shows
+    tokens = [chunk.get("response", "") for chunk in load_stream(STREAM_PATH)] * 20
+    text_edit = QTextEdit()
+    renderer = renderer_module.StreamRenderer(text_edit)
+
+    def run():
+        renderer.reset()
+        for index, token in enumerate(tokens):
+            renderer.append(token)
+            # About one frame per eight tokens, as at 240 tokens/s and 30 fps
+            if index % 8 == 7:
+                renderer.flush()
+        renderer.finish()
+
+    timings = measure(run, repeat=options.repeat)
+    return summarize(timings, tokens=len(tokens), render_seconds=renderer.render_time)
+
+
+@benchmark("render_result_grid", needs_qgis=True)
+def bench_render_result_grid(options):
+    """LazyResultModel paging and formatting while scrolling 100,000 rows"""
+    from qgis.PyQt.QtCore import Qt
+    result_model = plugin("result_model")
+    sql_execution = plugin("sql_execution")
+
+    description = [(name, None, None, None, None, None, None)
+                   for name in ("id", "name", "kind", "area", "created", "note", "flag", "geom")]
+    rows = [
+        (number, f"feature {number}", "parcel", number * 1.5, "2024-05-14", "x" * (number % 300),
+         number % 2 == 0, b"\x01\x01\x00\x00\x00" + bytes(16))
+        for number in range(100000)
+    ]
+    visible_rows = 40
+
+    def run():
+        model = result_model.LazyResultModel(sql_execution.MaterializedResult(description, rows))
+        while model.canFetchMore():
+            model.fetchMore()
+        # Jump through the result a screen at a time, as dragging the scroll bar does
+        for top in range(0, model.rowCount(), 997):
+            for row in range(top, min(top + visible_rows, model.rowCount())):
+                for column in range(model.columnCount()):
+                    index = model.index(row, column)
+                    model.data(index, Qt.DisplayRole)
+                    model.data(index, Qt.ToolTipRole)
+        model.close()
+
+    return summarize(measure(run, repeat=options.repeat), rows=len(rows))
+
+
+def check_baseline(results, baseline):
+    """Return a message per benchmark slower than its max_seconds"""
+    failures = []
+    for name, limits in baseline.items():
+        result = results.get(name)
+        if not result or "seconds" not in result:
+            continue
+        if result["seconds"] > limits["max_seconds"]:
+            failures.append(
+                f"{name}: {result['seconds']:.6f} s is above the limit of {limits['max_seconds']} s"
+            )
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the OllamaChat plugin")
+    parser.add_argument("--only", action="append", default=[],
+                        help="Run the benchmarks whose name contains this text, may be repeated")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument("--token-rate", type=float, default=400.0,
+                        help="Tokens per second the mock Ollama server streams")
+    parser.add_argument("--first-token-delay", type=float, default=0.05,
+                        help="Seconds the mock server waits before the first token")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--check", help="Fail if a result exceeds max_seconds in this baseline JSON file")
+    options = parser.parse_args(argv)
+
+    has_qgis = qgis_available()
+    results = {}
+    for name, needs_qgis, function in BENCHMARKS:
+        if options.only and not any(text in name for text in options.only):
+            continue
+        if needs_qgis and not has_qgis:
+            results[name] = {"skipped": "qgis is not available"}
+            print(f"{name:28s} skipped, qgis is not available")
+            continue
+        results[name] = function(options)
+        extras = ", ".join(
+            f"{key} {value:.4g}" if isinstance(value, float) else f"{key} {value}"
+            for key, value in results[name].items()
+            if key not in ("seconds", "min_seconds", "runs")
+        )
+        print(f"{name:28s} {results[name]['seconds'] * 1000:10.3f} ms  {extras}")
+
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, file, indent=2)
+
+    if options.check:
+        with open(options.check, encoding="utf-8") as file:
+            failures = check_baseline(results, json.load(file))
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
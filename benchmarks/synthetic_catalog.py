@@ -0,0 +1,101 @@
+import random
+
+
+COLUMN_TYPES = [
+    "integer", "bigint", "text", "character varying(255)", "double precision", "boolean",
+    "date", "timestamp without time zone", "numeric(12,2)", "jsonb",
+]
+GEOMETRY_TYPES = [
+    "geometry(Point,4326)", "geometry(MultiPolygon,4326)", "geometry(LineString,3857)",
+    "geography(Point,4326)",
+]
+WORDS = [
+    "parcel", "road", "building", "river", "station", "zone", "permit", "owner", "sensor",
+    "survey", "tree", "address", "district", "bridge", "well", "lake", "route", "stop",
+]
+
+
+def generate_catalog_rows(table_count, seed=0):
+    """Rows shaped like the result of the plugin's pg_catalog query
+
+    Each row is (schema, relation, relkind, column names, column types).
+    Tables have 4 to 40 columns, some of them geometry columns or names
+    that need quotes. Every tenth relation is a view and 20% of them live
+    outside the public schema. The same seed always gives the same catalog.
+    """
+    generator = random.Random(seed)
+    rows = []
+    for number in range(table_count):
+        schema = "public" if generator.random() < 0.8 else generator.choice(["gis", "staging", "Archive"])
+        name = f"{generator.choice(WORDS)}_{generator.choice(WORDS)}_{number}"
+        if generator.random() < 0.05:
+            name = name.title()
+        kind = "v" if number % 10 == 9 else "r"
+
+        column_names = ["id"]
+        column_types = ["integer"]
+        for column in range(generator.randint(3, 39)):
+            column_name = f"{generator.choice(WORDS)}_{column}"
+            if generator.random() < 0.05:
+                column_name = column_name.upper()
+            column_names.append(column_name)
+            column_types.append(generator.choice(COLUMN_TYPES))
+        if generator.random() < 0.6:
+            column_names.append("geom")
+            column_types.append(generator.choice(GEOMETRY_TYPES))
+        rows.append((schema, name, kind, column_names, column_types))
+
+    rows.sort(key=lambda row: (row[0] != "public", row[0], row[1]))
+    return rows
+
+
+class FakeCursor:
+    """DB-API cursor that answers the catalog queries of the plugin"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.description = None
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        self.connection.queries.append(sql)
+        if "max(xmin" in sql:
+            # Catalog fingerprint of SchemaCache.validate
+            self.rows = [(len(self.connection.catalog_rows), self.connection.version, self.connection.version)]
+        elif "array_agg" in sql and "pg_attribute" in sql:
+            self.rows = list(self.connection.catalog_rows)
+        else:
+            raise Exception(f"The synthetic catalog cannot answer: {sql.strip()[:60]}")
+        self.rowcount = len(self.rows)
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Stand-in for a psycopg2 connection to a database with a synthetic catalog"""
+
+    def __init__(self, catalog_rows, version=1):
+        self.catalog_rows = catalog_rows
+        self.version = version
+        self.queries = []
+
+    def cursor(self, name=None, scrollable=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
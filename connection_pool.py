@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def ping_connection(connection):
+    """Return True if a DB-API connection still answers a trivial query"""
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        connection.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def close_connection(connection):
+    """Close a DB-API connection, ignoring errors of an already broken one"""
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def source_key(provider_type, source):
+    """Normalize a data source to the key its connections are pooled under
+
+    source is a QgsDataSourceUri for PostgreSQL, whose connection info
+    without the table part makes layers of the same database share a key,
+    and a file path for file based sources.
+    """
+    if provider_type == 'postgres':
+        return (provider_type, source.connectionInfo(False))
+    return (provider_type, os.path.normcase(os.path.abspath(source)))
+
+
+class PooledConnection:
+    """An open connection with the bookkeeping of its pool"""
+
+    def __init__(self, connection, ping, close):
+        self.connection = connection
+        self.ping = ping
+        self.close = close
+        self.last_used = time.monotonic()
+        self.last_checked = self.last_used
+
+
+class ConnectionPool:
+    """Open database connections reused per data source
+
+    At most max_size connections are open per key. A connection that sat
+    idle for more than check_interval seconds is pinged before it is handed
+    out again, and one idle for more than max_idle seconds is closed by
+    evict_idle().
+    """
+
+    def __init__(self, max_size=4, max_idle=300, check_interval=30, acquire_timeout=30):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.acquire_timeout = acquire_timeout
+        self.condition = threading.Condition()
+        self.idle = {}
+        self.open_counts = {}
+
+    def acquire(self, key, connect, ping=ping_connection, close=close_connection,
+                check_interval=None):
+        """Return a healthy PooledConnection for key, opening one if needed
+
+        check_interval overrides the pool setting, 0 pings on every use.
+        """
+        if check_interval is None:
+            check_interval = self.check_interval
+        deadline = time.monotonic() + self.acquire_timeout
+        with self.condition:
+            while True:
+                idle = self.idle.get(key)
+                if idle:
+                    pooled = idle.pop()
+                    break
+                if self.open_counts.get(key, 0) < self.max_size:
+                    self.open_counts[key] = self.open_counts.get(key, 0) + 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception(f"All {self.max_size} pooled connections are in use")
+                self.condition.wait(remaining)
+
+        if pooled is not None:
+            now = time.monotonic()
+            if now - pooled.last_checked < check_interval or pooled.ping(pooled.connection):
+                pooled.last_checked = now
+                return pooled
+            # Broken connection, replace it with a new one in the same slot
+            pooled.close(pooled.connection)
+
+        try:
+            return PooledConnection(connect(), ping, close)
+        except Exception:
+            self.forget(key)
+            raise
+
+    def release(self, key, pooled, discard=False):
+        """Return a connection to the pool, or close it if discard is set"""
+        if discard:
+            pooled.close(pooled.connection)
+            self.forget(key)
+            return
+        pooled.last_used = time.monotonic()
+        with self.condition:
+            self.idle.setdefault(key, []).append(pooled)
+            self.condition.notify()
+
+    def forget(self, key):
+        """Free the slot of a connection that was closed"""
+        with self.condition:
+            self.open_counts[key] = max(0, self.open_counts.get(key, 0) - 1)
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self, key, connect, ping=ping_connection, close=close_connection,
+                   check_interval=None):
+        """Borrow a connection for the duration of a with block"""
+        pooled = self.acquire(key, connect, ping, close, check_interval)
+        try:
+            yield pooled.connection
+        except Exception:
+            # Check the connection before it is used again
+            pooled.last_checked = float('-inf')
+            raise
+        finally:
+            # Also frees the slot when the block exits through a return,
+            # a GeneratorExit or a KeyboardInterrupt
+            self.release(key, pooled)
+
+    def close_idle(self, key):
+        """Close the idle connections of a key, for example after its source changed"""
+        with self.condition:
+            idle = self.idle.pop(key, [])
+        for pooled in idle:
+            pooled.close(pooled.connection)
+            self.forget(key)
+
+    def evict_idle(self):
+        """Close connections that have been idle for longer than max_idle"""
+        now = time.monotonic()
+        expired = []
+        with self.condition:
+            for key, idle in self.idle.items():
+                keep = []
+                for pooled in idle:
+                    if now - pooled.last_used > self.max_idle:
+                        expired.append((key, pooled))
+                    else:
+                        keep.append(pooled)
+                idle[:] = keep
+        for key, pooled in expired:
+            pooled.close(pooled.connection)
+            self.forget(key)
+
+    def close_all(self):
+        """Close every idle connection, used when the plugin is unloaded"""
+        with self.condition:
+            idle = [(key, pooled) for key, connections in self.idle.items() for pooled in connections]
+            self.idle.clear()
+        for key, pooled in idle:
+            pooled.close(pooled.connection)
+            self.forget(key)
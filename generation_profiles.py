@@ -0,0 +1,88 @@
+import json
+
+
+# Ollama options a profile may set and the type of their values
+PROFILE_OPTIONS = {
+    "num_ctx": int,
+    "num_predict": int,
+    "num_thread": int,
+    "num_batch": int,
+    "num_gpu": int,
+    "temperature": float,
+    "top_k": int,
+    "top_p": float,
+    "repeat_penalty": float,
+    "seed": int,
+}
+
+DEFAULT_PROFILE = "Default"
+
+# Profiles every model starts with. num_thread is left to Ollama, which
+# uses the physical cores; set it per workstation when that is wrong
+DEFAULT_PROFILES = {
+    DEFAULT_PROFILE: {"num_ctx": 4096},
+    "Fast SQL": {"num_ctx": 4096, "num_predict": 512, "num_batch": 512, "temperature": 0.1},
+    "Large schema": {"num_ctx": 16384, "num_batch": 512, "temperature": 0.1},
+    "Vision": {"num_ctx": 4096, "temperature": 0.4},
+}
+
+# Context window Ollama uses when a profile does not set num_ctx
+OLLAMA_DEFAULT_NUM_CTX = 2048
+
+
+def load_profiles(text):
+    """Parse the stored profiles, {model: {profile name: options}}"""
+    if not text:
+        return {}
+    try:
+        profiles = json.loads(text)
+    except ValueError:
+        return {}
+    return profiles if isinstance(profiles, dict) else {}
+
+
+def dump_profiles(profiles):
+    """Serialize profiles for QgsSettings"""
+    return json.dumps(profiles, sort_keys=True)
+
+
+def model_profiles(profiles, model_name, default_num_ctx=None):
+    """Return the profiles of a model, the built-in ones if it has none
+
+    default_num_ctx replaces num_ctx of the built-in Default profile, so a
+    context size configured before profiles existed is kept.
+    """
+    stored = profiles.get(model_name)
+    if stored:
+        return {name: dict(options) for name, options in stored.items()}
+    defaults = {name: dict(options) for name, options in DEFAULT_PROFILES.items()}
+    if default_num_ctx:
+        defaults[DEFAULT_PROFILE]["num_ctx"] = default_num_ctx
+    return defaults
+
+
+def parse_options(text):
+    """Parse "num_ctx=8192, temperature=0.2" into an options dict"""
+    options = {}
+    for part in text.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, separator, value = part.partition("=")
+        name = name.strip()
+        if not separator:
+            raise Exception(f"Missing value for '{name}', use name=value")
+        if name not in PROFILE_OPTIONS:
+            raise Exception(
+                f"Unknown option '{name}', use one of: {', '.join(PROFILE_OPTIONS)}"
+            )
+        try:
+            options[name] = PROFILE_OPTIONS[name](value.strip())
+        except ValueError:
+            raise Exception(f"Invalid value for {name}: {value.strip()}")
+    return options
+
+
+def format_options(options):
+    """Render options as the text parse_options reads"""
+    return ", ".join(f"{name}={value}" for name, value in options.items())
@@ -0,0 +1,177 @@
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+# Durations in Ollama responses are reported in nanoseconds
+OLLAMA_DURATIONS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+OLLAMA_COUNTS = ("prompt_eval_count", "eval_count")
+
+# Readable names of the stages shown in the History tab
+STAGE_LABELS = {
+    "model_check": "model check",
+    "schema": "schema",
+    "first_token": "first token",
+    "generation": "generation",
+    "render": "rendering",
+    "cache_lookup": "cache",
+    "guard": "plan check",
+    "connect": "connect",
+    "round_trip": "round trip",
+}
+
+MAX_TEXT_LENGTH = 2000
+
+
+class Trace:
+    """Wall-clock spans and metrics of one prompt or one SQL execution
+
+    Spans of the same name add up, so a stage that runs several times, such
+    as the plan check of each statement in a batch, is reported once.
+    """
+
+    def __init__(self, kind, **fields):
+        self.kind = kind
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans = OrderedDict()
+        self.fields = dict(fields)
+        self.open_spans = {}
+        self.recorded = False
+
+    @contextmanager
+    def span(self, name):
+        """Time the body of a with block as a span"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - start)
+
+    def begin(self, name):
+        """Start a span that ends in another callback with end()"""
+        self.open_spans[name] = time.perf_counter()
+
+    def end(self, name):
+        """End a span started with begin(), does nothing if it is not open"""
+        start = self.open_spans.pop(name, None)
+        if start is not None:
+            self.add_span(name, time.perf_counter() - start)
+
+    def add_span(self, name, seconds):
+        """Add seconds to the span called name"""
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        """Seconds since the trace started"""
+        return time.perf_counter() - self.start
+
+    def set(self, **fields):
+        """Set fields stored with the trace"""
+        self.fields.update(fields)
+
+    def record(self):
+        """Return the trace as a dict for the history log"""
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "host": socket.gethostname(),
+            "kind": self.kind,
+            "total": round(self.elapsed(), 4),
+            "spans": {name: round(seconds, 4) for name, seconds in self.spans.items()},
+        }
+        for key, value in self.fields.items():
+            if isinstance(value, str) and len(value) > MAX_TEXT_LENGTH:
+                value = value[:MAX_TEXT_LENGTH] + "..."
+            record[key] = value
+        return record
+
+
+def ollama_metrics(final_chunk):
+    """Return the timings Ollama reports in its last chunk, in seconds
+
+    Adds generation and prompt evaluation speeds in tokens per second when
+    the counts and durations are both present.
+    """
+    metrics = {}
+    for key in OLLAMA_DURATIONS:
+        if final_chunk.get(key) is not None:
+            metrics[key] = round(final_chunk[key] / 1e9, 4)
+    for key in OLLAMA_COUNTS:
+        if final_chunk.get(key) is not None:
+            metrics[key] = final_chunk[key]
+
+    if metrics.get("eval_count") and metrics.get("eval_duration"):
+        metrics["tokens_per_second"] = round(metrics["eval_count"] / metrics["eval_duration"], 2)
+    if metrics.get("prompt_eval_count") and metrics.get("prompt_eval_duration"):
+        metrics["prompt_tokens_per_second"] = round(
+            metrics["prompt_eval_count"] / metrics["prompt_eval_duration"], 2
+        )
+    return metrics
+
+
+def format_stages(record):
+    """One line summary of the spans and speeds of a history record"""
+    parts = [
+        f"{STAGE_LABELS.get(name, name)} {seconds:.2f} s"
+        for name, seconds in record.get("spans", {}).items()
+    ]
+    ollama = record.get("ollama") or {}
+    if ollama.get("prompt_eval_duration") is not None:
+        parts.append(f"prompt eval {ollama['prompt_eval_duration']:.2f} s")
+    if ollama.get("tokens_per_second"):
+        parts.append(f"{ollama['tokens_per_second']:.1f} tok/s")
+    if record.get("rows") is not None:
+        parts.append(f"{record['rows']} rows")
+    return ", ".join(parts)
+
+
+class HistoryLog:
+    """Append-only JSONL log of traces with the latest entries kept in memory
+
+    The file holds one JSON object per line, so logs of several workstations
+    can be concatenated and aggregated with any JSON tool. It is renamed to
+    <name>.1 once it grows past max_bytes.
+    """
+
+    def __init__(self, path, max_entries=200, max_bytes=10 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = deque(maxlen=max_entries)
+
+    def load(self):
+        """Read the latest entries of the log file into memory"""
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                lines = deque(file, maxlen=self.entries.maxlen)
+        except OSError:
+            return list(self.entries)
+
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        with self.lock:
+            self.entries.clear()
+            self.entries.extend(entries)
+            return list(self.entries)
+
+    def append(self, record):
+        """Store a record, returns False if the log file could not be written"""
+        with self.lock:
+            self.entries.append(record)
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(record, default=str) + "\n")
+            except OSError:
+                return False
+        return True
@@ -2,15 +2,56 @@ from qgis.PyQt.QtWidgets import (QDockWidget, QWidget, QVBoxLayout, QTextEdit,
                                  QPushButton, QFileDialog, QLabel, QMessageBox, 
                                  QCheckBox, QComboBox, QHBoxLayout, QListWidget,
                                  QTabWidget, QPlainTextEdit, QListWidgetItem, 
-                                 QApplication, QLineEdit, QGroupBox, QGridLayout)
-from qgis.PyQt.QtCore import Qt
-from qgis.core import Qgis, QgsProject, QgsVectorLayer, QgsDataSourceUri, QgsVectorLayerExporter
-import requests
+                                 QApplication, QLineEdit, QGroupBox, QGridLayout,
+                                 QSpinBox, QTableView, QProgressBar, QDoubleSpinBox,
+                                 QTableWidget, QTableWidgetItem, QInputDialog)
+from qgis.PyQt.QtCore import Qt, QTimer
+from qgis.core import (Qgis, QgsProject, QgsVectorLayer, QgsDataSourceUri, QgsVectorLayerExporter,
+                       QgsSettings, QgsApplication, QgsCoordinateTransform, QgsMessageLog)
 import base64
 import os
-import json
 import re
-import sqlite3
+import time
+
+from .connection_pool import ConnectionPool, source_key
+from .generation_profiles import (DEFAULT_PROFILE, OLLAMA_DEFAULT_NUM_CTX, dump_profiles,
+                                  format_options, load_profiles, model_profiles, parse_options)
+from .instrumentation import HistoryLog, Trace, format_stages
+from .ogr_sources import (DEFAULT_OGR_DIALECT, close_datasource, datasource_checker,
+                          ensure_spatial_index, execute_ogr_sql, extent_filter, ogr_dialect,
+                          open_datasource)
+from .ollama_client import OllamaClient
+from .ollama_worker import (OllamaGenerateWorker, ModelWarmupWorker, SchemaIndexWorker,
+                            SqlExecutionWorker, LayerQueryWorker, ExportWorker, RowCountWorker)
+from .query_guard import (PREVIEW_LIMIT, check_plan, explain_query, is_explainable_sql,
+                          preview_sql)
+from .result_cache import ResultCache
+from .result_export import (EXPORT_FORMATS, copy_query_to_file, export_format_for_filter,
+                            pg_connection_string, translate_query_to_gpkg, write_rows)
+from .result_layer import create_memory_layer, describe_query, set_query_data_source, unique_key_column
+from .result_model import LazyResultModel
+from .schema_cache import SchemaCache, is_schema_changing_sql
+from .schema_budget import build_schema_text, render_relations, schema_budget
+from .schema_catalog import load_catalog
+from .schema_retrieval import IndexNotReady, SchemaRetriever, retrieval_available
+from .sql_execution import (MaterializedResult, execute_statement,
+                            is_read_only_sql, split_statements)
+from .sql_extraction import (SQL_ONLY_NUM_PREDICT, SQL_ONLY_STOP, SQL_RESPONSE_SCHEMA,
+                             IncrementalSqlExtractor, extract_sql_from_text, format_sql_response,
+                             parse_sql_response, sql_only_prompt)
+from .sqlite_engine import connect_sqlite, rtree_extent
+from .stream_renderer import StreamRenderer
+
+
+# Layer providers whose data source execute_db_query can run SQL on
+LAYER_SQL_PROVIDERS = ('postgres', 'spatialite', 'ogr')
+
+# How long stop_worker waits for a cancelled worker to exit
+WORKER_STOP_TIMEOUT_MS = 10000
+
+# Workers that outlived stop_worker, referenced until their thread exits
+DETACHED_WORKERS = []
+
 
 class OllamaChat:
     def __init__(self, iface):
@@ -24,15 +65,79 @@ class OllamaChat:
         
         # PostgreSQL connection
         self.db_connection = None
+        self.result_connection = None
+        self.result_model = None
+        self.result_sql = None
+        self.result_layer_count = 0
+        self.export_worker = None
+        self.count_worker = None
+        # Total of the current result counted with SELECT count(*)
+        self.counted_rows = None
         self.db_host = ""
         self.db_port = "5432"
         self.db_name = ""
         self.db_user = ""
         self.db_password = ""
         
+        # Open connections of layer data sources, reused across queries
+        self.connection_pool = ConnectionPool()
+        self.pool_timer = None
+        
+        # Rows of recent read-only queries, dropped when the plugin writes
+        self.result_cache = ResultCache(
+            ttl=QgsSettings().value("OllamaChat/result_cache_ttl", 300, type=int)
+        )
+        
+        # Rendered schema text per (connection, selected tables)
+        self.schema_cache = SchemaCache()
+        self.schema_format = QgsSettings().value("OllamaChat/schema_format", "compact")
+        
         # Ollama model name
         self.ollama_model = "llava"
 
+        # Named Ollama option profiles per model and the last one used
+        self.generation_profiles = load_profiles(QgsSettings().value("OllamaChat/generation_profiles", ""))
+        self.active_profiles = load_profiles(QgsSettings().value("OllamaChat/active_profiles", ""))
+
+        # Pooled HTTP client shared by all Ollama calls
+        self.ollama_client = OllamaClient()
+
+        # Embedding index used to pick relevant tables when none are selected
+        self.schema_retriever = SchemaRetriever(
+            self.ollama_client,
+            os.path.join(QgsApplication.qgisSettingsDirPath(), "ollama_chat", "schema_index")
+        )
+        self.index_worker = None
+
+        # Model warm-up, so the first prompt does not pay the model load
+        self.warmup_worker = None
+        self.warmup_pending = False
+        self.warmed_model = None
+
+        # Conversation state: the token context of the last response lets
+        # follow-up prompts skip re-evaluating the schema prefix
+        self.conversation_context = None
+        self.conversation_key = None
+
+        # Background generation
+        self.ollama_worker = None
+
+        # Background SQL execution
+        self.sql_worker = None
+        self.execution_started_at = None
+        self.execution_phase = ""
+        self.execution_outcome = None
+        self.execution_plan = None
+        self.execution_timer = None
+        self.execution_trace = None
+        self.stream_renderer = None
+
+        # Timings of every prompt and execution, appended to a JSONL log
+        self.history_log = HistoryLog(QgsSettings().value(
+            "OllamaChat/history_log",
+            os.path.join(QgsApplication.qgisSettingsDirPath(), "ollama_chat", "history.jsonl")
+        ))
+
     def initGui(self):
         """Initialize the GUI when the plugin is loaded"""
         self.dock_widget = QDockWidget("Ollama Chat")
@@ -100,14 +205,72 @@ class OllamaChat:
 
         # Ollama Model Selection Group
         model_group = QGroupBox("Ollama Model Configuration")
-        model_layout = QHBoxLayout()
+        model_layout = QGridLayout()
         model_group.setLayout(model_layout)
         
-        model_layout.addWidget(QLabel("Model Name:"))
+        model_layout.addWidget(QLabel("Model Name:"), 0, 0)
         self.model_name_edit = QLineEdit()
         self.model_name_edit.setPlaceholderText("e.g., llava, llama2, mistral")
         self.model_name_edit.setText("llava")
-        model_layout.addWidget(self.model_name_edit)
+        self.model_name_edit.editingFinished.connect(self.on_model_name_changed)
+        model_layout.addWidget(self.model_name_edit, 0, 1)
+        
+        model_layout.addWidget(QLabel("Keep alive:"), 0, 2)
+        self.keep_alive_edit = QLineEdit()
+        self.keep_alive_edit.setPlaceholderText("30m")
+        self.keep_alive_edit.setToolTip(
+            "How long Ollama keeps the model loaded after a request "
+            "(e.g. 30m, 2h, -1 to keep it loaded)"
+        )
+        self.keep_alive_edit.setText(QgsSettings().value("OllamaChat/keep_alive", "30m"))
+        self.keep_alive_edit.setMaximumWidth(60)
+        self.keep_alive_edit.editingFinished.connect(self.on_model_settings_changed)
+        model_layout.addWidget(self.keep_alive_edit, 0, 3)
+        
+        self.model_status_label = QLabel("● Model not loaded")
+        self.model_status_label.setStyleSheet("color: gray;")
+        model_layout.addWidget(QLabel("Profile:"), 1, 0)
+        self.profile_combo = QComboBox()
+        self.profile_combo.setToolTip("Ollama options sent with every request, stored per model")
+        self.profile_combo.currentIndexChanged.connect(self.on_profile_changed)
+        model_layout.addWidget(self.profile_combo, 1, 1)
+        
+        model_layout.addWidget(QLabel("Answer:"), 1, 2)
+        self.response_mode_combo = QComboBox()
+        self.response_mode_combo.addItem("Explained", "explained")
+        self.response_mode_combo.addItem("SQL only", "sql_only")
+        self.response_mode_combo.setToolTip(
+            "SQL only asks for a JSON object with the SQL, the tables used and a short note,\n"
+            f"capped at the profile's num_predict or {SQL_ONLY_NUM_PREDICT} tokens,\n"
+            "instead of a free-form explanation"
+        )
+        self.response_mode_combo.setCurrentIndex(max(0, self.response_mode_combo.findData(
+            QgsSettings().value("OllamaChat/response_mode", "explained")
+        )))
+        self.response_mode_combo.currentIndexChanged.connect(
+            lambda index: QgsSettings().setValue(
+                "OllamaChat/response_mode", self.response_mode_combo.itemData(index)
+            )
+        )
+        model_layout.addWidget(self.response_mode_combo, 1, 3)
+        
+        model_layout.addWidget(QLabel("Options:"), 2, 0)
+        self.profile_options_edit = QLineEdit()
+        self.profile_options_edit.setToolTip(
+            "Options of the selected profile as name=value pairs, e.g.\n"
+            "num_ctx=8192, num_thread=8, num_batch=512, num_predict=512, temperature=0.1\n"
+            "num_ctx is the context window the schema is trimmed to fit into."
+        )
+        self.profile_options_edit.editingFinished.connect(self.on_profile_options_edited)
+        model_layout.addWidget(self.profile_options_edit, 2, 1, 1, 2)
+        
+        self.save_profile_btn = QPushButton("Save As...")
+        self.save_profile_btn.setToolTip("Save the options as a new profile of this model")
+        self.save_profile_btn.clicked.connect(self.save_profile_as)
+        model_layout.addWidget(self.save_profile_btn, 2, 3)
+        self.refresh_profiles()
+        
+        model_layout.addWidget(self.model_status_label, 3, 0, 1, 4)
         
         layout.addWidget(model_group)
 
@@ -141,6 +304,46 @@ class OllamaChat:
         self.refresh_tables_btn.setEnabled(False)
         layout.addWidget(self.refresh_tables_btn)
 
+        # Relevance-ranked retrieval for large databases
+        settings = QgsSettings()
+        retrieval_layout = QHBoxLayout()
+        self.retrieval_checkbox = QCheckBox("Rank tables by relevance")
+        self.retrieval_checkbox.setToolTip(
+            "When no tables are selected, include only the tables whose names and columns\n"
+            "are most similar to the prompt, using local Ollama embeddings"
+        )
+        self.retrieval_checkbox.setChecked(settings.value("OllamaChat/retrieval", False, type=bool))
+        self.retrieval_checkbox.stateChanged.connect(self.toggle_retrieval)
+        retrieval_layout.addWidget(self.retrieval_checkbox)
+        
+        self.embedding_model_edit = QLineEdit()
+        self.embedding_model_edit.setPlaceholderText("nomic-embed-text")
+        self.embedding_model_edit.setToolTip("Ollama embedding model")
+        self.embedding_model_edit.setText(settings.value("OllamaChat/embedding_model", "nomic-embed-text"))
+        self.embedding_model_edit.editingFinished.connect(self.on_retrieval_settings_changed)
+        retrieval_layout.addWidget(self.embedding_model_edit)
+        
+        retrieval_layout.addWidget(QLabel("Top:"))
+        self.retrieval_top_k_spin = QSpinBox()
+        self.retrieval_top_k_spin.setRange(1, 200)
+        self.retrieval_top_k_spin.setValue(settings.value("OllamaChat/retrieval_top_k", 10, type=int))
+        self.retrieval_top_k_spin.valueChanged.connect(
+            lambda value: QgsSettings().setValue("OllamaChat/retrieval_top_k", value)
+        )
+        retrieval_layout.addWidget(self.retrieval_top_k_spin)
+        layout.addLayout(retrieval_layout)
+
+        schema_format_layout = QHBoxLayout()
+        schema_format_layout.addWidget(QLabel("Schema format:"))
+        self.schema_format_combo = QComboBox()
+        self.schema_format_combo.addItem("Compact (one line per table)", "compact")
+        self.schema_format_combo.addItem("Verbose (one line per column)", "verbose")
+        self.schema_format_combo.setCurrentIndex(max(0, self.schema_format_combo.findData(self.schema_format)))
+        self.schema_format_combo.currentIndexChanged.connect(self.on_schema_format_changed)
+        schema_format_layout.addWidget(self.schema_format_combo)
+        schema_format_layout.addStretch()
+        layout.addLayout(schema_format_layout)
+
         # Attach image
         self.image_label = QLabel("No image attached")
         layout.addWidget(self.image_label)
@@ -149,6 +352,36 @@ class OllamaChat:
         self.attach_btn.clicked.connect(self.attach_image)
         layout.addWidget(self.attach_btn)
 
+        # Conversation mode
+        conversation_layout = QHBoxLayout()
+        self.conversation_checkbox = QCheckBox("Continue conversation (reuse schema context)")
+        self.conversation_checkbox.setToolTip(
+            "Follow-up prompts reuse the model's context from the previous response,\n"
+            "so the schema is not evaluated again while the selected tables stay the same"
+        )
+        self.conversation_checkbox.setChecked(QgsSettings().value("OllamaChat/conversation", False, type=bool))
+        self.conversation_checkbox.stateChanged.connect(self.toggle_conversation)
+        conversation_layout.addWidget(self.conversation_checkbox)
+        
+        self.new_conversation_btn = QPushButton("New Conversation")
+        self.new_conversation_btn.clicked.connect(self.reset_conversation)
+        self.new_conversation_btn.setEnabled(False)
+        conversation_layout.addWidget(self.new_conversation_btn)
+        layout.addLayout(conversation_layout)
+        
+        self.stop_at_sql_checkbox = QCheckBox("Stop generating once the SQL block is complete")
+        self.stop_at_sql_checkbox.setToolTip(
+            "End the response at the closing ``` of the first SQL block,\n"
+            "so the model does not spend time on the explanation after it"
+        )
+        self.stop_at_sql_checkbox.setChecked(QgsSettings().value("OllamaChat/stop_at_sql", False, type=bool))
+        self.stop_at_sql_checkbox.stateChanged.connect(
+            lambda state: QgsSettings().setValue("OllamaChat/stop_at_sql", state == Qt.Checked)
+        )
+        layout.addWidget(self.stop_at_sql_checkbox)
+        self.response_mode_combo.currentIndexChanged.connect(self.update_stop_at_sql_checkbox)
+        self.update_stop_at_sql_checkbox()
+
         # Send button
         self.send_btn = QPushButton("Send to Ollama")
         self.send_btn.clicked.connect(self.send_to_ollama)
@@ -162,6 +395,7 @@ class OllamaChat:
         self.output_edit = QTextEdit()
         self.output_edit.setReadOnly(True)
         self.tab_widget.addTab(self.output_edit, "Response")
+        self.stream_renderer = StreamRenderer(self.output_edit)
         
         # SQL tab
         sql_tab = QWidget()
@@ -173,6 +407,139 @@ class OllamaChat:
         self.sql_edit.setPlaceholderText("SQL code will appear here when detected in response...")
         sql_layout.addWidget(self.sql_edit)
         
+        # Statements running longer than this are cancelled by the server
+        timeout_layout = QHBoxLayout()
+        timeout_layout.addWidget(QLabel("Statement timeout:"))
+        self.statement_timeout_spin = QSpinBox()
+        self.statement_timeout_spin.setRange(0, 86400)
+        self.statement_timeout_spin.setSuffix(" s")
+        self.statement_timeout_spin.setSpecialValueText("No limit")
+        self.statement_timeout_spin.setToolTip(
+            "Maximum run time of an executed statement, 0 for no limit"
+        )
+        self.statement_timeout_spin.setValue(
+            int(QgsSettings().value("OllamaChat/statement_timeout", 0))
+        )
+        self.statement_timeout_spin.valueChanged.connect(
+            lambda value: QgsSettings().setValue("OllamaChat/statement_timeout", value)
+        )
+        timeout_layout.addWidget(self.statement_timeout_spin)
+        
+        timeout_layout.addWidget(QLabel("Cache results for:"))
+        self.result_cache_ttl_spin = QSpinBox()
+        self.result_cache_ttl_spin.setRange(0, 86400)
+        self.result_cache_ttl_spin.setSuffix(" s")
+        self.result_cache_ttl_spin.setSpecialValueText("Off")
+        self.result_cache_ttl_spin.setToolTip(
+            "Executing the same read-only query again within this time reuses its rows\n"
+            "instead of querying the database, 0 to always query the database"
+        )
+        self.result_cache_ttl_spin.setValue(self.result_cache.ttl)
+        self.result_cache_ttl_spin.valueChanged.connect(self.on_result_cache_ttl_changed)
+        timeout_layout.addWidget(self.result_cache_ttl_spin)
+        timeout_layout.addStretch()
+        sql_layout.addLayout(timeout_layout)
+        
+        # How SQL with several statements is run
+        batch_layout = QHBoxLayout()
+        batch_layout.addWidget(QLabel("Multiple statements:"))
+        self.batch_mode_combo = QComboBox()
+        self.batch_mode_combo.addItem("One transaction (stop at first error)", "transaction")
+        self.batch_mode_combo.addItem("Savepoints (continue after errors)", "savepoints")
+        self.batch_mode_combo.setCurrentIndex(
+            max(0, self.batch_mode_combo.findData(QgsSettings().value("OllamaChat/batch_mode", "transaction")))
+        )
+        self.batch_mode_combo.currentIndexChanged.connect(
+            lambda index: QgsSettings().setValue(
+                "OllamaChat/batch_mode", self.batch_mode_combo.itemData(index)
+            )
+        )
+        batch_layout.addWidget(self.batch_mode_combo)
+        batch_layout.addStretch()
+        sql_layout.addLayout(batch_layout)
+        
+        # How SQL runs on shapefiles, GeoJSON and other OGR files
+        ogr_layout = QHBoxLayout()
+        ogr_layout.addWidget(QLabel("File layers:"))
+        self.ogr_dialect_combo = QComboBox()
+        self.ogr_dialect_combo.addItem("OGR SQL", "OGRSQL")
+        self.ogr_dialect_combo.addItem("SQLite (spatial functions)", "SQLITE")
+        self.ogr_dialect_combo.setToolTip(
+            "SQL dialect of queries on OGR files; SQLite adds SpatiaLite functions\n"
+            "such as ST_Intersects or ST_Buffer"
+        )
+        self.ogr_dialect_combo.setCurrentIndex(max(0, self.ogr_dialect_combo.findData(
+            ogr_dialect(QgsSettings().value("OllamaChat/ogr_dialect", "OGRSQL"))
+        )))
+        self.ogr_dialect_combo.currentIndexChanged.connect(
+            lambda index: QgsSettings().setValue(
+                "OllamaChat/ogr_dialect", self.ogr_dialect_combo.itemData(index)
+            )
+        )
+        ogr_layout.addWidget(self.ogr_dialect_combo)
+        
+        self.ogr_extent_checkbox = QCheckBox("Only features in the map view")
+        self.ogr_extent_checkbox.setToolTip(
+            "Filter queries on file layers by the map extent; shapefiles get a .qix\n"
+            "spatial index the first time, GeoPackage and SpatiaLite tables use their\n"
+            "R-tree, so only the features in view are read"
+        )
+        self.ogr_extent_checkbox.setChecked(QgsSettings().value("OllamaChat/ogr_map_extent", False, type=bool))
+        self.ogr_extent_checkbox.stateChanged.connect(
+            lambda state: QgsSettings().setValue("OllamaChat/ogr_map_extent", state == Qt.Checked)
+        )
+        ogr_layout.addWidget(self.ogr_extent_checkbox)
+        
+        self.sqlite_wal_checkbox = QCheckBox("WAL journal")
+        self.sqlite_wal_checkbox.setToolTip(
+            "Switch GeoPackage and SQLite files to WAL when a statement writes to them,\n"
+            "so reads are not blocked; the file keeps -wal and -shm files next to it"
+        )
+        self.sqlite_wal_checkbox.setChecked(QgsSettings().value("OllamaChat/sqlite_wal", False, type=bool))
+        self.sqlite_wal_checkbox.stateChanged.connect(
+            lambda state: QgsSettings().setValue("OllamaChat/sqlite_wal", state == Qt.Checked)
+        )
+        ogr_layout.addWidget(self.sqlite_wal_checkbox)
+        ogr_layout.addStretch()
+        sql_layout.addLayout(ogr_layout)
+        
+        # Plan the statement with EXPLAIN before running it
+        settings = QgsSettings()
+        guard_group = QGroupBox("Query Guard")
+        guard_group.setCheckable(True)
+        guard_group.setToolTip(
+            "Check the estimated cost of a statement with EXPLAIN before executing it\n"
+            "and warn or block above the thresholds (0 disables a threshold)"
+        )
+        guard_group.setChecked(settings.value("OllamaChat/query_guard", False, type=bool))
+        guard_group.toggled.connect(
+            lambda checked: QgsSettings().setValue("OllamaChat/query_guard", checked)
+        )
+        self.guard_group = guard_group
+        guard_layout = QGridLayout()
+        guard_group.setLayout(guard_layout)
+        
+        self.guard_warn_cost_spin = self.create_guard_spin(
+            "OllamaChat/guard_warn_cost", 1000000
+        )
+        guard_layout.addWidget(QLabel("Warn above cost:"), 0, 0)
+        guard_layout.addWidget(self.guard_warn_cost_spin, 0, 1)
+        
+        self.guard_block_cost_spin = self.create_guard_spin(
+            "OllamaChat/guard_block_cost", 100000000
+        )
+        guard_layout.addWidget(QLabel("Block above cost:"), 0, 2)
+        guard_layout.addWidget(self.guard_block_cost_spin, 0, 3)
+        
+        self.guard_seq_scan_spin = self.create_guard_spin(
+            "OllamaChat/guard_seq_scan_rows", 1000000
+        )
+        self.guard_seq_scan_spin.setToolTip("Warn about sequential scans of tables with more rows")
+        guard_layout.addWidget(QLabel("Warn on seq scans of:"), 1, 0)
+        guard_layout.addWidget(self.guard_seq_scan_spin, 1, 1)
+        guard_layout.addWidget(QLabel("rows or more"), 1, 2)
+        sql_layout.addWidget(guard_group)
+        
         # SQL execution buttons
         sql_btn_layout = QHBoxLayout()
         self.execute_sql_btn = QPushButton("Execute SQL")
@@ -180,18 +547,137 @@ class OllamaChat:
         self.execute_sql_btn.setEnabled(False)
         sql_btn_layout.addWidget(self.execute_sql_btn)
         
+        self.cancel_sql_btn = QPushButton("Cancel")
+        self.cancel_sql_btn.setToolTip("Cancel the running statement on the server")
+        self.cancel_sql_btn.clicked.connect(self.cancel_sql_execution)
+        self.cancel_sql_btn.setEnabled(False)
+        sql_btn_layout.addWidget(self.cancel_sql_btn)
+        
         self.copy_sql_btn = QPushButton("Copy SQL")
         self.copy_sql_btn.clicked.connect(self.copy_sql)
         self.copy_sql_btn.setEnabled(False)
         sql_btn_layout.addWidget(self.copy_sql_btn)
         
         sql_layout.addLayout(sql_btn_layout)
+        
+        # Progress of the running statement
+        execution_layout = QHBoxLayout()
+        self.execution_progress = QProgressBar()
+        self.execution_progress.setRange(0, 0)
+        self.execution_progress.setMaximumHeight(12)
+        self.execution_progress.setTextVisible(False)
+        self.execution_progress.setVisible(False)
+        execution_layout.addWidget(self.execution_progress)
+        self.execution_status_label = QLabel("")
+        execution_layout.addWidget(self.execution_status_label)
+        sql_layout.addLayout(execution_layout)
+        
+        self.execution_timer = QTimer()
+        self.execution_timer.setInterval(100)
+        self.execution_timer.timeout.connect(self.update_execution_status)
+        
+        # Close pooled layer connections nobody used for a while
+        self.pool_timer = QTimer()
+        self.pool_timer.setInterval(60000)
+        self.pool_timer.timeout.connect(self.connection_pool.evict_idle)
+        self.pool_timer.start()
+        
         self.tab_widget.addTab(sql_tab, "SQL Code")
 
+        # Results tab, rows are fetched from the open cursor while scrolling
+        results_tab = QWidget()
+        results_layout = QVBoxLayout()
+        results_tab.setLayout(results_layout)
+        
+        results_header_layout = QHBoxLayout()
+        self.results_label = QLabel("Execute a query to browse its results here.")
+        results_header_layout.addWidget(self.results_label, 1)
+        
+        self.count_rows_btn = QPushButton("Count Rows")
+        self.count_rows_btn.setToolTip(
+            "Run the query again as SELECT count(*) to get its total number of rows"
+        )
+        self.count_rows_btn.clicked.connect(self.count_result_rows)
+        self.count_rows_btn.setEnabled(False)
+        results_header_layout.addWidget(self.count_rows_btn)
+        
+        self.add_layer_btn = QPushButton("Add as Layer")
+        self.add_layer_btn.setToolTip("Add the query result to the map")
+        self.add_layer_btn.clicked.connect(self.add_result_as_layer)
+        self.add_layer_btn.setEnabled(False)
+        results_header_layout.addWidget(self.add_layer_btn)
+        
+        self.export_btn = QPushButton("Export...")
+        self.export_btn.setToolTip("Export the whole result to CSV, GeoJSON sequence or GeoPackage")
+        self.export_btn.clicked.connect(self.export_result)
+        self.export_btn.setEnabled(False)
+        results_header_layout.addWidget(self.export_btn)
+        results_layout.addLayout(results_header_layout)
+        
+        self.results_view = QTableView()
+        self.results_view.setAlternatingRowColors(True)
+        self.results_view.verticalHeader().setDefaultSectionSize(
+            self.results_view.fontMetrics().height() + 6
+        )
+        results_layout.addWidget(self.results_view)
+        
+        self.export_status_label = QLabel("")
+        results_layout.addWidget(self.export_status_label)
+        self.tab_widget.addTab(results_tab, "Results")
+        
+        # History tab, stage timings of recent prompts and executions
+        history_tab = QWidget()
+        history_layout = QVBoxLayout()
+        history_tab.setLayout(history_layout)
+        
+        history_label = QLabel(f"Timings are also appended to {self.history_log.path}")
+        history_label.setWordWrap(True)
+        history_layout.addWidget(history_label)
+        
+        self.history_table = QTableWidget(0, 5)
+        self.history_table.setHorizontalHeaderLabels(["Time", "Type", "Details", "Total (s)", "Stages"])
+        self.history_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.history_table.setAlternatingRowColors(True)
+        self.history_table.verticalHeader().setVisible(False)
+        self.history_table.horizontalHeader().setStretchLastSection(True)
+        history_layout.addWidget(self.history_table)
+        self.tab_widget.addTab(history_tab, "History")
+        for record in self.history_log.load():
+            self.add_history_row(record)
+
         self.iface.addDockWidget(Qt.RightDockWidgetArea, self.dock_widget)
 
+        # Prime the model list cache so the first send does not wait for it
+        self.ollama_client.refresh_models_async()
+
+        # Load the model in the background before the user starts typing
+        self.warm_up_model()
+
     def unload(self):
         """Remove the plugin and clean up"""
+        # Stop every worker still running in the background; their threads
+        # must have exited before the objects they use are deleted
+        self.stop_generation()
+        self.stop_sql_execution()
+        if self.export_worker is not None:
+            self.stop_worker(self.export_worker, self.export_worker.cancel)
+        if self.count_worker is not None:
+            self.stop_worker(self.count_worker, self.count_worker.cancel)
+        if self.index_worker is not None:
+            self.stop_worker(self.index_worker, self.index_worker.cancel)
+        if self.warmup_worker is not None:
+            # A model load can not be interrupted, the wait is bounded by
+            # the warm-up read timeout and the load finishes in Ollama anyway
+            self.stop_worker(self.warmup_worker, None)
+        if self.execution_timer is not None:
+            self.execution_timer.stop()
+        if self.pool_timer is not None:
+            self.pool_timer.stop()
+        self.connection_pool.close_all()
+        if self.stream_renderer:
+            self.stream_renderer.reset()
+        self.ollama_client.close()
+
         # Disconnect from database if connected
         if self.db_connection:
             self.disconnect_from_database()
@@ -256,6 +742,7 @@ class OllamaChat:
             self.db_name = database
             self.db_user = user
             self.db_password = password
+            self.schema_cache.invalidate(self.get_connection_key())
             
             # Update UI
             self.connect_db_btn.setEnabled(False)
@@ -296,12 +783,27 @@ class OllamaChat:
 
     def disconnect_from_database(self):
         """Disconnect from PostgreSQL database"""
+        # A running statement needs the connection that is about to close
+        self.stop_sql_execution()
+        
         if self.db_connection:
             try:
                 self.db_connection.close()
-            except:
+            except Exception:
                 pass
             self.db_connection = None
+            self.schema_cache.invalidate(self.get_connection_key())
+            self.result_cache.invalidate(self.get_connection_key())
+        
+        # Results read from the result connection cannot be fetched any more
+        self.clear_result_grid()
+        
+        if self.result_connection:
+            try:
+                self.result_connection.close()
+            except Exception:
+                pass
+            self.result_connection = None
         
         # Update UI
         self.connect_db_btn.setEnabled(True)
@@ -316,6 +818,9 @@ class OllamaChat:
         self.db_user_edit.setEnabled(True)
         self.db_password_edit.setEnabled(True)
         
+        # The schema of the next connection will differ
+        self.reset_conversation()
+
         # Disable and clear table list
         self.refresh_tables_btn.setEnabled(False)
         self.table_list.clear()
@@ -329,6 +834,10 @@ class OllamaChat:
             duration=2
         )
 
+    def get_connection_key(self):
+        """Return the identity of the current PostgreSQL connection"""
+        return (self.db_host, self.db_port, self.db_name, self.db_user)
+
     def toggle_db_schema(self, state):
         """Enable/disable database schema inclusion"""
         self.include_db_schema = (state == Qt.Checked)
@@ -346,6 +855,94 @@ class OllamaChat:
                 duration=2
             )
     
+    def on_schema_format_changed(self, index):
+        """Switch between the compact and verbose schema format"""
+        self.schema_format = self.schema_format_combo.itemData(index)
+        QgsSettings().setValue("OllamaChat/schema_format", self.schema_format)
+
+    def toggle_retrieval(self, state):
+        """Enable/disable relevance-ranked table retrieval"""
+        if state == Qt.Checked and not retrieval_available():
+            QMessageBox.warning(
+                None,
+                "Missing Dependency",
+                "NumPy is required to rank tables by relevance.\n\n"
+                "Install it in the QGIS Python environment and restart QGIS."
+            )
+            self.retrieval_checkbox.setChecked(False)
+            return
+        self.on_retrieval_settings_changed()
+
+    def on_retrieval_settings_changed(self):
+        """Save the retrieval settings and index the tables if enabled"""
+        settings = QgsSettings()
+        settings.setValue("OllamaChat/retrieval", self.retrieval_checkbox.isChecked())
+        settings.setValue("OllamaChat/embedding_model", self.embedding_model_edit.text().strip())
+        self.build_schema_index()
+
+    def build_schema_index(self):
+        """Embed the tables of the connected database on a background thread"""
+        if not (self.retrieval_checkbox.isChecked() and retrieval_available()):
+            return
+        if not self.db_connection or self.index_worker is not None:
+            return
+
+        try:
+            catalog = self.get_catalog_snapshot()
+        except Exception:
+            return
+
+        model_name = self.embedding_model_edit.text().strip() or "nomic-embed-text"
+        if self.schema_retriever.is_ready(self.get_connection_key(), catalog, model_name):
+            return
+        self.index_worker = SchemaIndexWorker(
+            self.schema_retriever,
+            self.get_connection_key(),
+            catalog,
+            model_name
+        )
+        self.index_worker.indexed.connect(self.on_schema_indexed)
+        self.index_worker.index_failed.connect(self.on_schema_index_failed)
+        self.index_worker.finished.connect(self.on_index_worker_done)
+        self.index_worker.start()
+
+    def on_schema_indexed(self, count):
+        """Report that the tables are ready for relevance ranking"""
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat",
+            f"Indexed {count} tables for relevance ranking",
+            level=Qgis.Success,
+            duration=3
+        )
+
+    def on_schema_index_failed(self, error_msg):
+        """Report why the tables could not be embedded"""
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat",
+            f"Failed to index tables for relevance ranking: {error_msg}",
+            level=Qgis.Warning,
+            duration=5
+        )
+
+    def on_index_worker_done(self):
+        """Release the indexing worker"""
+        if self.index_worker is not None:
+            self.index_worker.deleteLater()
+            self.index_worker = None
+
+    def toggle_conversation(self, state):
+        """Enable/disable reuse of the model context between prompts"""
+        QgsSettings().setValue("OllamaChat/conversation", state == Qt.Checked)
+        if state != Qt.Checked:
+            self.reset_conversation()
+
+    def reset_conversation(self):
+        """Forget the model context so the next prompt starts a new conversation"""
+        self.conversation_context = None
+        self.conversation_key = None
+        if self.dock_widget:
+            self.new_conversation_btn.setEnabled(False)
+
     def on_table_selection_changed(self):
         """Handle table selection changes"""
         self.selected_tables = []
@@ -354,6 +951,9 @@ class OllamaChat:
             if table_name:
                 self.selected_tables.append(table_name)
 
+        # A different table set means a different schema prefix
+        self.reset_conversation()
+
     def fetch_tables(self):
         """Fetch list of tables from the connected PostgreSQL database"""
         if not self.db_connection:
@@ -372,29 +972,20 @@ class OllamaChat:
                 duration=2
             )
             
-            cursor = self.db_connection.cursor()
+            # An explicit refresh should also pick up schema changes made elsewhere
+            self.schema_cache.invalidate(self.get_connection_key())
             
-            # Query to get all tables from public schema
-            query = """
-                SELECT table_name 
-                FROM information_schema.tables 
-                WHERE table_schema = 'public' 
-                    AND table_type = 'BASE TABLE'
-                ORDER BY table_name
-            """
-            
-            cursor.execute(query)
-            results = cursor.fetchall()
-            cursor.close()
+            # Tables, views and materialized views of every schema in one query
+            catalog = self.get_catalog_snapshot()
             
             # Clear and populate table list
             self.table_list.clear()
             self.available_tables = []
             
-            for row in results:
-                table_name = row[0]
-                self.available_tables.append(table_name)
-                item = QListWidgetItem(table_name)
+            for relation in catalog.relations.values():
+                self.available_tables.append(relation.display_name)
+                item = QListWidgetItem(relation.display_name)
+                item.setToolTip(relation.kind_label)
                 self.table_list.addItem(item)
             
             if len(self.available_tables) == 0:
@@ -412,6 +1003,9 @@ class OllamaChat:
                     duration=3
                 )
                 
+                # Embed new or changed tables ahead of the first prompt
+                self.build_schema_index()
+                
         except Exception as e:
             QMessageBox.critical(
                 None,
@@ -454,116 +1048,9 @@ class OllamaChat:
         """Fetch PostgreSQL schema directly from the database connection"""
         if not self.db_connection:
             return ""
-        
+
         try:
-            cursor = self.db_connection.cursor()
-            
-            # Determine which tables to include
-            tables_to_include = self.selected_tables if self.selected_tables else None
-            
-            # Query to get tables and their columns from public schema
-            if tables_to_include:
-                # Only selected tables
-                placeholders = ','.join(['%s'] * len(tables_to_include))
-                query = f"""
-                    SELECT 
-                        t.table_name,
-                        c.column_name,
-                        c.data_type,
-                        c.character_maximum_length,
-                        c.numeric_precision
-                    FROM information_schema.tables t
-                    JOIN information_schema.columns c ON t.table_name = c.table_name
-                    WHERE t.table_schema = 'public' 
-                        AND t.table_type = 'BASE TABLE'
-                        AND t.table_name IN ({placeholders})
-                    ORDER BY t.table_name, c.ordinal_position
-                """
-                cursor.execute(query, tables_to_include)
-            else:
-                # All tables
-                query = """
-                    SELECT 
-                        t.table_name,
-                        c.column_name,
-                        c.data_type,
-                        c.character_maximum_length,
-                        c.numeric_precision
-                    FROM information_schema.tables t
-                    JOIN information_schema.columns c ON t.table_name = c.table_name
-                    WHERE t.table_schema = 'public' 
-                        AND t.table_type = 'BASE TABLE'
-                    ORDER BY t.table_name, c.ordinal_position
-                """
-                cursor.execute(query)
-            
-            results = cursor.fetchall()
-            cursor.close()
-            
-            if not results:
-                return ""
-            
-            # Organize results by table and track case-sensitive identifiers
-            tables = {}
-            has_uppercase_columns = False
-            has_uppercase_tables = False
-            
-            for row in results:
-                table_name, column_name, data_type, char_length, numeric_precision = row
-                
-                if table_name not in tables:
-                    tables[table_name] = []
-                
-                # Check if column or table name contains uppercase letters
-                if any(c.isupper() for c in column_name):
-                    has_uppercase_columns = True
-                if any(c.isupper() for c in table_name):
-                    has_uppercase_tables = True
-                
-                # Add quotes around identifiers that need them (contain uppercase)
-                quoted_column = f'"{column_name}"' if any(c.isupper() for c in column_name) else column_name
-                
-                col_info = f"{quoted_column} ({data_type}"
-                if char_length:
-                    col_info += f", length: {char_length}"
-                if numeric_precision:
-                    col_info += f", precision: {numeric_precision}"
-                col_info += ")"
-                
-                tables[table_name].append(col_info)
-            
-            # Build schema text
-            schema_text = "\n\n--- POSTGRESQL DATABASE SCHEMA ---\n"
-            schema_text += f"Database: {self.db_name}\n\n"
-            
-            # Add SQL syntax rules if there are case-sensitive identifiers
-            if has_uppercase_columns or has_uppercase_tables:
-                schema_text += "IMPORTANT SQL SYNTAX RULES:\n"
-                schema_text += "- Column and table names with uppercase letters MUST be enclosed in double quotes\n"
-                schema_text += "- Example: WHERE \"POPULATION\" > 10000 (NOT WHERE POPULATION > 10000)\n"
-                schema_text += "- Example: SELECT \"CityName\", \"POPULATION\" FROM \"MyTable\"\n"
-                schema_text += "- Column names shown with quotes below REQUIRE quotes in SQL queries\n"
-                schema_text += "- Column names without quotes can be used without quotes\n\n"
-            
-            if tables_to_include:
-                schema_text += f"Selected tables ({len(tables)}):\n\n"
-            else:
-                schema_text += f"All available tables ({len(tables)}):\n\n"
-            
-            for table_name, columns in tables.items():
-                # Quote table name if it contains uppercase
-                quoted_table = f'"{table_name}"' if any(c.isupper() for c in table_name) else table_name
-                schema_text += f"Table: {quoted_table}\n"
-                schema_text += "Columns:\n"
-                for col in columns:
-                    schema_text += f"  - {col}\n"
-                schema_text += "\n"
-            
-            schema_text += "--- END DATABASE SCHEMA ---\n\n"
-            schema_text += "Based on the schema above, please help with the following request:\n\n"
-            
-            return schema_text
-            
+            return self.build_postgres_schema_text(self.selected_tables)
         except Exception as e:
             self.iface.messageBar().pushMessage(
                 "Ollama Chat",
@@ -573,30 +1060,71 @@ class OllamaChat:
             )
             return ""
 
-    def extract_sql_from_text(self, text):
-        """Extract SQL code from response text"""
-        # Pattern to match SQL code blocks - more flexible with whitespace
-        # Matches ```sql or ```SQL followed by any whitespace, then content, then ```
-        sql_pattern = r'```[Ss][Qq][Ll]\s*\n?(.*?)```'
-        matches = re.findall(sql_pattern, text, re.DOTALL)
-        
-        if matches:
-            # Get the first non-empty match
-            for match in matches:
-                if match.strip():
-                    # Clean up the SQL - remove trailing/leading whitespace
-                    cleaned_sql = match.strip()
-                    # Don't add semicolon if already present
-                    return cleaned_sql
-        
-        # Fallback: look for SELECT, INSERT, UPDATE, DELETE, CREATE statements
-        fallback_pattern = r'((?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)\s+.+?;)'
-        fallback_matches = re.findall(fallback_pattern, text, re.DOTALL | re.IGNORECASE)
-        
-        if fallback_matches:
-            return '\n\n'.join(fallback_matches)
-        
-        return None
+    def build_postgres_schema_text(self, selected_tables, budget=None, report=None):
+        """Return the schema text for the given tables (all tables if empty)
+
+        Does not touch any widget, so it can run on the generation worker thread.
+        The text comes from the schema cache unless the catalog has changed.
+        With a token budget the text is trimmed to fit and a note about what
+        was left out is passed to report. Database errors are raised to the caller.
+        """
+        if not self.db_connection:
+            return ""
+
+        text, note = build_schema_text(
+            self.schema_cache,
+            self.get_connection_key(),
+            self.db_connection,
+            self.db_name,
+            selected_tables,
+            self.schema_format,
+            budget
+        )
+        if note and report:
+            report(note, Qgis.Warning)
+        return text
+
+    def build_relevant_schema_text(self, prompt, embedding_model, top_k, budget=None, report=None):
+        """Return the schema text of the top_k tables most relevant to the prompt"""
+        catalog = self.get_catalog_snapshot()
+        if len(catalog) <= top_k:
+            return self.build_postgres_schema_text([], budget, report)
+
+        if report:
+            report(f"Ranking {len(catalog)} tables by relevance...", Qgis.Info)
+        try:
+            tables = self.schema_retriever.rank(
+                self.get_connection_key(),
+                catalog,
+                embedding_model,
+                prompt,
+                top_k
+            )
+        except IndexNotReady:
+            # The prompt never waits for the index, SchemaIndexWorker builds it
+            if report:
+                report("Tables are still being indexed for relevance ranking, including all tables",
+                       Qgis.Info)
+            return self.build_postgres_schema_text([], budget, report)
+        text, note = render_relations(
+            catalog.select(tables),
+            self.db_name,
+            f"Most relevant of {len(catalog)} tables",
+            self.schema_format,
+            budget
+        )
+        if note and report:
+            report(note, Qgis.Warning)
+        return text
+
+    def get_catalog_snapshot(self):
+        """Return the cached pg_catalog snapshot of the connected database"""
+        connection = self.db_connection
+        return self.schema_cache.get_catalog(
+            self.get_connection_key(),
+            connection,
+            lambda: load_catalog(connection)
+        )
 
     def copy_sql(self):
         """Copy SQL to clipboard"""
@@ -611,20 +1139,33 @@ class OllamaChat:
             )
 
     def execute_sql(self):
-        """Execute the extracted SQL on the PostgreSQL database"""
+        """Execute the extracted SQL on the PostgreSQL database
+
+        The statement runs on a SqlExecutionWorker so it can be cancelled
+        while QGIS stays responsive. Without a database connection it runs
+        on the data source of the active layer instead.
+        """
+        if self.sql_worker is not None:
+            return
+        
         if not self.extracted_sql:
             QMessageBox.warning(None, "No SQL", "No SQL code to execute.")
             return
         
-        # Check if connected to database
+        # Check if connected to database, or a layer whose source can run SQL is active
+        layer = None
         if not self.db_connection:
-            QMessageBox.warning(
-                None,
-                "Not Connected",
-                "Please connect to a PostgreSQL database first.\n\n"
-                "Fill in the connection details at the top and click 'Connect'."
-            )
-            return
+            layer = self.get_sql_layer()
+            if layer is None:
+                QMessageBox.warning(
+                    None,
+                    "Not Connected",
+                    "Please connect to a PostgreSQL database first.\n\n"
+                    "Fill in the connection details at the top and click 'Connect', "
+                    "or select a PostGIS, SpatiaLite, GeoPackage or other file layer "
+                    "in the Layers panel to run the SQL on its data source."
+                )
+                return
         
         # Validate SQL before execution
         sql_upper = self.extracted_sql.strip().upper()
@@ -650,195 +1191,917 @@ class OllamaChat:
             )
             return
         
-        try:
-            # Show execution message
-            self.iface.messageBar().pushMessage(
-                "Ollama Chat", 
-                f"Executing SQL on database: {self.db_name}", 
-                level=Qgis.Info, 
-                duration=3
-            )
-            
-            # Execute SQL query on the database
-            result = self.execute_direct_sql(self.extracted_sql)
-            
-            # Check if it's a DDL statement for better messaging
-            sql_upper = self.extracted_sql.strip().upper()
-            is_ddl = any(sql_upper.startswith(cmd) for cmd in ['CREATE', 'ALTER', 'DROP'])
-            
-            if result:
-                self.iface.messageBar().pushMessage(
-                    "Ollama Chat", 
-                    f"SQL executed successfully! {len(result)} rows returned.", 
-                    level=Qgis.Success, 
-                    duration=4
+        if layer is not None:
+            self.execute_layer_sql(layer)
+            return
+        
+        trace = Trace("sql", sql=self.extracted_sql, database=self.db_name)
+        
+        # Identical read-only queries are answered from the result cache
+        if is_read_only_sql(self.extracted_sql):
+            with trace.span("cache_lookup"):
+                cached = self.result_cache.get(self.get_connection_key(), self.extracted_sql)
+            if cached is not None:
+                with trace.span("render"):
+                    self.show_query_result(cached)
+                self.result_sql = self.extracted_sql
+                self.execution_status_label.setText(
+                    f"Served {cached.row_count} rows from the result cache"
                 )
-                
-                # Show results in output tab
-                result_text = "SQL Execution Results:\n\n"
-                result_text += f"Rows returned: {len(result)}\n\n"
-                
-                if result:
-                    # Show first 10 rows
-                    for i, row in enumerate(result[:10]):
-                        result_text += f"Row {i+1}: {row}\n"
-                    
-                    if len(result) > 10:
-                        result_text += f"\n... and {len(result) - 10} more rows"
-                
-                self.output_edit.append("\n\n" + "="*50 + "\n" + result_text)
-                self.tab_widget.setCurrentIndex(0)  # Switch to Response tab
-            else:
-                # Different message for DDL vs DML
-                if is_ddl:
-                    ddl_type = "DDL statement"
-                    if sql_upper.startswith('CREATE VIEW'):
-                        ddl_type = "View created"
-                    elif sql_upper.startswith('CREATE TABLE'):
-                        ddl_type = "Table created"
-                    elif sql_upper.startswith('ALTER'):
-                        ddl_type = "Table altered"
-                    elif sql_upper.startswith('DROP'):
-                        ddl_type = "Object dropped"
-                    
-                    success_msg = f"{ddl_type} successfully!"
-                    self.iface.messageBar().pushMessage(
-                        "Ollama Chat", 
-                        success_msg, 
-                        level=Qgis.Success, 
-                        duration=4
-                    )
-                    
-                    # Add to output
-                    self.output_edit.append("\n\n" + "="*50 + f"\n{success_msg}\n" + "="*50)
-                    self.tab_widget.setCurrentIndex(0)
-                else:
-                    self.iface.messageBar().pushMessage(
-                        "Ollama Chat", 
-                        "SQL executed successfully (no rows returned)", 
-                        level=Qgis.Success, 
-                        duration=3
-                    )
-                
-        except Exception as e:
-            error_msg = f"SQL Execution Error: {str(e)}"
-            QMessageBox.critical(None, "SQL Error", error_msg)
-            self.iface.messageBar().pushMessage(
-                "Ollama Chat", 
-                error_msg, 
-                level=Qgis.Critical, 
-                duration=5
-            )
-
-    def execute_direct_sql(self, sql):
-        """Execute SQL directly on the connected PostgreSQL database"""
-        if not self.db_connection:
-            raise Exception("No database connection available")
+                trace.set(outcome="cached", rows=cached.row_count)
+                self.record_trace(trace)
+                return
+        
+        # Check the plan of model-generated SQL before it hits the database
+        self.execution_plan = None
+        statements = split_statements(self.extracted_sql)
+        if len(statements) > 1:
+            # Every statement of a batch is checked, a batch has no preview
+            sql = self.extracted_sql
+            for statement in statements:
+                if self.guard_query(statement, allow_preview=False, trace=trace) is None:
+                    sql = None
+                    break
+            self.execution_plan = f"{len(statements)} statements"
+        else:
+            statements = None
+            sql = self.guard_query(self.extracted_sql, trace=trace)
+        if sql is None:
+            trace.set(outcome="not run")
+            self.record_trace(trace)
+            return
         
         try:
-            cursor = self.db_connection.cursor()
-            
-            # Check if it's a DDL statement
-            sql_upper = sql.strip().upper()
-            is_ddl = any(sql_upper.startswith(cmd) for cmd in ['CREATE', 'ALTER', 'DROP', 'INSERT', 'UPDATE', 'DELETE'])
-            
-            cursor.execute(sql)
-            
-            # Try to fetch results only for SELECT queries
-            results = None
-            if not is_ddl:
-                try:
-                    results = cursor.fetchall()
-                except:
-                    results = None
-            
-            self.db_connection.commit()
-            
-            # For DDL statements, provide helpful feedback
-            if is_ddl and sql_upper.startswith('CREATE VIEW'):
-                view_name = "view"
-                # Try to extract view name
-                try:
-                    import re
-                    match = re.search(r'CREATE\s+(?:OR\s+REPLACE\s+)?VIEW\s+(\w+)', sql, re.IGNORECASE)
-                    if match:
-                        view_name = match.group(1)
-                except:
-                    pass
-                
-                self.iface.messageBar().pushMessage(
-                    "Ollama Chat", 
-                    f"View '{view_name}' created successfully in PostgreSQL database!", 
-                    level=Qgis.Success, 
-                    duration=5
-                )
-            
-            cursor.close()
-            
-            return results
-            
+            with trace.span("connect"):
+                connection = self.get_result_connection()
         except Exception as e:
-            self.db_connection.rollback()
-            raise Exception(f"PostgreSQL Error: {str(e)}")
+            self.on_sql_execution_failed(f"PostgreSQL Error: {str(e)}")
+            trace.set(outcome="failed")
+            self.record_trace(trace)
+            return
+        
+        # The cursor of the previous result lives on the same connection
+        self.clear_result_grid()
+        
+        # Row-returning statements are streamed through a server-side cursor
+        self.sql_worker = SqlExecutionWorker(
+            connection,
+            sql,
+            statement_timeout=self.statement_timeout_spin.value(),
+            stream=statements is None and is_read_only_sql(sql),
+            statements=statements,
+            batch_mode=self.batch_mode_combo.currentData()
+        )
+        self.sql_worker.execution_finished.connect(self.on_sql_executed)
+        self.sql_worker.batch_finished.connect(self.on_sql_batch_executed)
+        trace.set(statements=len(statements) if statements else 1)
+        self.start_sql_worker(trace)
+        
+        # Show execution message
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat", 
+            f"Executing SQL on database: {self.db_name}", 
+            level=Qgis.Info, 
+            duration=3
+        )
+
+    def start_sql_worker(self, trace):
+        """Connect the common signals of self.sql_worker and start it"""
+        self.sql_worker.progress.connect(self.on_sql_progress)
+        self.sql_worker.execution_failed.connect(self.on_sql_execution_failed)
+        self.sql_worker.execution_cancelled.connect(self.on_sql_execution_cancelled)
+        self.sql_worker.finished.connect(self.on_sql_worker_done)
+        
+        self.execute_sql_btn.setEnabled(False)
+        self.cancel_sql_btn.setEnabled(True)
+        self.execution_progress.setVisible(True)
+        self.execution_started_at = time.monotonic()
+        self.execution_phase = "Starting"
+        self.execution_outcome = "Finished"
+        self.execution_trace = trace
+        trace.begin("round_trip")
+        self.update_execution_status()
+        self.execution_timer.start()
+        self.sql_worker.start()
+
+    def get_sql_layer(self):
+        """Return the active layer if its data source can run SQL, otherwise None"""
+        layer = self.iface.activeLayer()
+        if not isinstance(layer, QgsVectorLayer) or layer.dataProvider() is None:
+            return None
+        if layer.dataProvider().name() not in LAYER_SQL_PROVIDERS:
+            return None
+        return layer
 
-    def execute_db_query(self, layer, sql):
-        """Execute SQL query on database layer and return results"""
+    def execute_layer_sql(self, layer):
+        """Execute the extracted SQL on the data source of layer
+
+        The statement runs on a LayerQueryWorker through execute_db_query,
+        with pooled connections and the File layers options of the SQL tab.
+        """
+        sql = self.extracted_sql
+        if len(split_statements(sql)) > 1:
+            QMessageBox.warning(
+                None,
+                "Several Statements",
+                "Statements run on a layer one at a time.\n"
+                "Please keep one statement and try again."
+            )
+            return
+        
+        # Snapshot the layer source and options, the worker never reads widget state
         provider = layer.dataProvider()
         provider_type = provider.name()
-        
+        source = provider.dataSourceUri()
+        dialect = self.ogr_dialect_combo.currentData()
+        wal = self.sqlite_wal_checkbox.isChecked()
+        extent = None
+        connection_key = None
         if provider_type == 'postgres':
-            # PostgreSQL/PostGIS
-            uri = QgsDataSourceUri(provider.dataSourceUri())
-            try:
-                import psycopg2
-                conn = psycopg2.connect(
-                    host=uri.host(),
-                    port=uri.port() if uri.port() else '5432',
-                    database=uri.database(),
-                    user=uri.username(),
-                    password=uri.password()
-                )
-                cursor = conn.cursor()
-                
-                # Check if it's a DDL statement (CREATE, ALTER, DROP) or DML that doesn't return rows
-                sql_upper = sql.strip().upper()
-                is_ddl = any(sql_upper.startswith(cmd) for cmd in ['CREATE', 'ALTER', 'DROP', 'INSERT', 'UPDATE', 'DELETE'])
-                
-                cursor.execute(sql)
-                
-                # Try to fetch results only for SELECT queries
-                results = None
-                if not is_ddl:
-                    try:
-                        results = cursor.fetchall()
-                    except:
-                        results = None
+            uri = QgsDataSourceUri(source)
+            # The layer may live in the database the plugin connects to
+            connection_key = (uri.host(), uri.port() or '5432', uri.database(), uri.username())
+        else:
+            extent = self.get_layer_map_extent(layer)
+        
+        self.clear_result_grid()
+        self.execution_plan = None
+        trace = Trace("sql", sql=sql, database=layer.name(), provider=provider_type)
+        self.sql_worker = LayerQueryWorker(
+            lambda watch: self.execute_db_query(provider_type, source, sql, dialect, extent, wal, watch),
+            sql
+        )
+        self.sql_worker.execution_finished.connect(
+            lambda result: self.on_layer_query_executed(result, connection_key)
+        )
+        self.start_sql_worker(trace)
+        
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat", 
+            f"Executing SQL on layer: {layer.name()}", 
+            level=Qgis.Info, 
+            duration=3
+        )
+
+    def on_layer_query_executed(self, result, connection_key):
+        """Show the result of a statement run on the data source of a layer"""
+        trace = self.end_round_trip()
+        if not self.dock_widget:
+            return
+        sql = self.sql_worker.sql
+        
+        if connection_key is not None:
+            # Cached schema text and results are stale after a write
+            if is_schema_changing_sql(sql):
+                self.schema_cache.invalidate(connection_key)
+            if not is_read_only_sql(sql):
+                self.result_cache.invalidate(connection_key)
+        
+        if result is not None:
+            with trace.span("render"):
+                self.show_query_result(result)
+            trace.set(rows=result.row_count)
+            self.result_sql = sql
+            return
+        
+        # For DDL statements, provide helpful feedback
+        view_name = self.get_created_view_name(sql)
+        if view_name:
+            message = f"View '{view_name}' created successfully!"
+        else:
+            message = "SQL executed successfully (no rows returned)"
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat", 
+            message, 
+            level=Qgis.Success, 
+            duration=4
+        )
+
+    def on_result_cache_ttl_changed(self, value):
+        """Apply and save how long query results are cached"""
+        QgsSettings().setValue("OllamaChat/result_cache_ttl", value)
+        self.result_cache.ttl = value
+        if not value:
+            self.result_cache.invalidate()
+
+    def create_guard_spin(self, key, default):
+        """Create a threshold spin box of the query guard, persisted under key"""
+        spin = QDoubleSpinBox()
+        spin.setDecimals(0)
+        spin.setRange(0, 1e15)
+        spin.setSingleStep(100000)
+        spin.setSpecialValueText("Off")
+        spin.setGroupSeparatorShown(True)
+        spin.setValue(QgsSettings().value(key, default, type=float))
+        spin.valueChanged.connect(lambda value: QgsSettings().setValue(key, value))
+        return spin
+
+    def guard_query(self, sql, allow_preview=True, trace=None):
+        """Check the EXPLAIN estimates of a statement before it is executed
+
+        Returns the SQL to run, which is a LIMIT preview if the user asked for
+        one, or None if the statement should not run. The plan check is timed
+        as the guard span of trace, the time spent in the dialog is not.
+        """
+        if not self.guard_group.isChecked() or not is_explainable_sql(sql):
+            return sql
+        
+        trace = trace if trace is not None else Trace("guard")
+        try:
+            with trace.span("guard"):
+                plan = explain_query(self.db_connection, sql)
+                level, reasons = check_plan(
+                    plan,
+                    self.guard_warn_cost_spin.value(),
+                    self.guard_block_cost_spin.value(),
+                    self.guard_seq_scan_spin.value()
+                )
+        except Exception as e:
+            # Errors in the statement itself are reported when it runs
+            self.iface.messageBar().pushMessage(
+                "Ollama Chat", 
+                f"Could not check the query plan: {str(e)}", 
+                level=Qgis.Warning, 
+                duration=4
+            )
+            return sql
+        
+        self.execution_plan = plan.summary()
+        if level == "ok":
+            return sql
+        
+        can_preview = allow_preview and is_read_only_sql(sql)
+        text = "\n".join(f"- {reason}" for reason in reasons)
+        if level == "block":
+            title = "Query Blocked"
+            text = f"The query was not executed:\n\n{text}"
+            if can_preview:
+                text += f"\n\nYou can still preview its first {PREVIEW_LIMIT} rows."
+        else:
+            title = "Expensive Query"
+            text = f"The query looks expensive ({plan.summary()}):\n\n{text}\n\nRun it anyway?"
+        
+        box = QMessageBox(QMessageBox.Warning, title, text)
+        run_btn = box.addButton("Run Anyway", QMessageBox.AcceptRole) if level == "warn" else None
+        preview_btn = None
+        if can_preview:
+            preview_btn = box.addButton(f"Preview {PREVIEW_LIMIT} Rows", QMessageBox.ActionRole)
+        box.addButton(QMessageBox.Cancel)
+        box.exec_()
+        
+        clicked = box.clickedButton()
+        if run_btn is not None and clicked == run_btn:
+            return sql
+        if preview_btn is not None and clicked == preview_btn:
+            self.execution_plan = f"preview of the first {PREVIEW_LIMIT} rows"
+            return preview_sql(sql)
+        return None
+
+    def on_sql_executed(self, result):
+        """Show the result of a statement run by the SQL worker"""
+        trace = self.end_round_trip()
+        
+        # The connection was closed while the result was on its way
+        if self.result_connection is None or not self.dock_widget:
+            if result is not None:
+                result.close()
+            return
+        
+        sql = self.sql_worker.sql
+        
+        # Cached schema text is stale after DDL
+        if is_schema_changing_sql(sql):
+            self.schema_cache.invalidate(self.get_connection_key())
+        
+        if is_read_only_sql(sql):
+            # Only results that arrived complete are cached, larger ones stay
+            # on their server-side cursor
+            if result is not None and result.row_count == len(result.first_batch):
+                self.result_cache.put(
+                    self.get_connection_key(), sql, result.description, result.first_batch
+                )
+        else:
+            # A write may change what cached queries return
+            self.result_cache.invalidate(self.get_connection_key())
+        
+        if result is not None:
+            with trace.span("render"):
+                self.show_query_result(result)
+            trace.set(rows=result.row_count)
+            self.result_sql = sql
+            return
+        
+        # Check if it's a DDL statement for better messaging
+        sql_upper = sql.strip().upper()
+        is_ddl = any(sql_upper.startswith(cmd) for cmd in ['CREATE', 'ALTER', 'DROP'])
+        
+        # Different message for DDL vs DML
+        if is_ddl:
+            ddl_type = "DDL statement"
+            if sql_upper.startswith('CREATE VIEW'):
+                ddl_type = "View created"
+            elif sql_upper.startswith('CREATE TABLE'):
+                ddl_type = "Table created"
+            elif sql_upper.startswith('ALTER'):
+                ddl_type = "Table altered"
+            elif sql_upper.startswith('DROP'):
+                ddl_type = "Object dropped"
+            
+            success_msg = f"{ddl_type} successfully!"
+            self.iface.messageBar().pushMessage(
+                "Ollama Chat", 
+                success_msg, 
+                level=Qgis.Success, 
+                duration=4
+            )
+            
+            # Add to output
+            self.output_edit.append("\n\n" + "="*50 + f"\n{success_msg}\n" + "="*50)
+            self.tab_widget.setCurrentIndex(0)
+        else:
+            self.iface.messageBar().pushMessage(
+                "Ollama Chat", 
+                "SQL executed successfully (no rows returned)", 
+                level=Qgis.Success, 
+                duration=3
+            )
+
+    def on_sql_batch_executed(self, results):
+        """Report every statement of a batch run by the SQL worker"""
+        trace = self.end_round_trip()
+        if self.result_connection is None or not self.dock_widget:
+            return
+        
+        ran = [result for result in results if not result.skipped]
+        if any(is_schema_changing_sql(result.sql) for result in ran):
+            self.schema_cache.invalidate(self.get_connection_key())
+        if any(not is_read_only_sql(result.sql) for result in ran):
+            self.result_cache.invalidate(self.get_connection_key())
+        
+        result_text = "SQL Batch Results:\n\n"
+        for number, result in enumerate(results, 1):
+            statement = " ".join(result.sql.split())
+            if len(statement) > 60:
+                statement = statement[:57] + "..."
+            result_text += f"{number}. {statement}\n    {result.describe()}\n"
+        self.output_edit.append("\n\n" + "="*50 + "\n" + result_text)
+        
+        errors = [number for number, result in enumerate(results, 1) if result.error]
+        if not errors:
+            message = f"{len(results)} statements executed successfully"
+            level = Qgis.Success
+        elif self.sql_worker.batch_mode == "transaction":
+            # Without savepoints any error rolls back every statement
+            if len(errors) == 1:
+                message = f"Statement {errors[0]} failed, the whole batch was rolled back"
+            else:
+                # The server did not say which of the statements sent together failed
+                message = "Batch failed, all statements were rolled back"
+            level = Qgis.Critical
+            self.execution_outcome = "Failed"
+        else:
+            message = f"{len(errors)} of {len(results)} statements failed and were rolled back"
+            level = Qgis.Warning
+        self.iface.messageBar().pushMessage("Ollama Chat", message, level=level, duration=5)
+        
+        # The rows of the last statement that returned any go to the Results tab
+        last = next((result for result in reversed(results) if result.rows is not None), None)
+        if last is not None and not last.rolled_back:
+            with trace.span("render"):
+                self.show_query_result(MaterializedResult(last.description, last.rows))
+            trace.set(rows=len(last.rows))
+            self.result_sql = last.sql
+        else:
+            self.tab_widget.setCurrentIndex(0)
+
+    def on_sql_execution_failed(self, error_msg):
+        """Report a statement that failed or ran into the statement timeout"""
+        self.execution_outcome = "Failed"
+        self.end_round_trip()
+        if not self.dock_widget:
+            return
+        error_msg = f"SQL Execution Error: {error_msg}"
+        QMessageBox.critical(None, "SQL Error", error_msg)
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat", 
+            error_msg, 
+            level=Qgis.Critical, 
+            duration=5
+        )
+
+    def on_sql_execution_cancelled(self):
+        """Report a statement cancelled with the Cancel button"""
+        self.execution_outcome = "Cancelled"
+        self.end_round_trip()
+        if not self.dock_widget:
+            return
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat", 
+            "SQL execution cancelled", 
+            level=Qgis.Warning, 
+            duration=3
+        )
+
+    def on_sql_progress(self, phase):
+        """Show the phase the running statement is in"""
+        self.execution_phase = phase
+        self.update_execution_status()
+
+    def update_execution_status(self):
+        """Show the phase and elapsed time of the running statement"""
+        if self.execution_started_at is None or not self.dock_widget:
+            return
+        elapsed = time.monotonic() - self.execution_started_at
+        self.execution_status_label.setText(
+            f"{self.execution_phase}... {elapsed:.1f} s" + self.get_plan_note()
+        )
+
+    def get_plan_note(self):
+        """Plan estimates of the running statement for the status line"""
+        return f" ({self.execution_plan})" if self.execution_plan else ""
+
+    def on_sql_worker_done(self):
+        """Release the SQL worker and report how long the statement ran"""
+        worker = self.sql_worker
+        self.sql_worker = None
+        if worker is not None:
+            worker.deleteLater()
+        
+        trace = self.end_round_trip()
+        if trace is not None:
+            trace.set(outcome=self.execution_outcome.lower())
+            self.record_trace(trace)
+            self.execution_trace = None
+        if not self.dock_widget:
+            return
+        
+        self.execution_timer.stop()
+        if self.execution_started_at is not None:
+            elapsed = time.monotonic() - self.execution_started_at
+            self.execution_status_label.setText(
+                f"{self.execution_outcome} after {elapsed:.2f} s" + self.get_plan_note()
+            )
+            self.execution_started_at = None
+        self.execution_progress.setVisible(False)
+        self.cancel_sql_btn.setEnabled(False)
+        self.execute_sql_btn.setEnabled(bool(self.extracted_sql))
+
+    def end_round_trip(self):
+        """End the round trip span of the running execution and return its trace"""
+        trace = self.execution_trace
+        if trace is None:
+            # Executions started before the trace existed record nothing
+            return Trace("sql")
+        trace.end("round_trip")
+        return trace
+
+    def record_trace(self, trace):
+        """Append a finished trace to the history log and the History tab"""
+        if trace.recorded:
+            return
+        trace.recorded = True
+        record = trace.record()
+        self.history_log.append(record)
+        if self.dock_widget:
+            self.add_history_row(record)
+
+    def add_history_row(self, record):
+        """Show a history record as the first row of the History tab"""
+        if record.get("kind") == "prompt":
+            kind = "Prompt"
+            details = f"{record.get('model', '')}: {record.get('prompt', '')}"
+        else:
+            kind = "SQL"
+            details = record.get("sql", "")
+        details = " ".join(str(details).split())
+        outcome = record.get("outcome")
+        if outcome and outcome != "finished":
+            kind += f" ({outcome})"
+        
+        self.history_table.insertRow(0)
+        values = [record.get("time", "").replace("T", " "), kind, details,
+                  f"{record.get('total', 0):.2f}", format_stages(record)]
+        for column, value in enumerate(values):
+            item = QTableWidgetItem(value)
+            item.setToolTip(value)
+            self.history_table.setItem(0, column, item)
+        
+        # Only the latest entries are shown, the log file keeps all of them
+        while self.history_table.rowCount() > self.history_log.entries.maxlen:
+            self.history_table.removeRow(self.history_table.rowCount() - 1)
+
+    def cancel_sql_execution(self):
+        """Cancel the running statement on the server"""
+        if self.sql_worker is None:
+            return
+        self.execution_phase = "Cancelling"
+        self.update_execution_status()
+        self.cancel_sql_btn.setEnabled(False)
+        self.sql_worker.cancel()
+
+    def stop_sql_execution(self):
+        """Cancel a running statement and wait for its worker to exit"""
+        if self.sql_worker is not None:
+            self.stop_worker(self.sql_worker, self.sql_worker.cancel)
+
+    def show_query_result(self, result):
+        """Report a query result and show its rows in the Results tab"""
+        self.set_result_grid(result)
+        # A streamed result only knows its total once every row was read
+        if result.row_count is not None:
+            row_count = str(result.row_count)
+        else:
+            row_count = f"{len(result.first_batch)}+"
+        
+        if not result.first_batch:
+            self.iface.messageBar().pushMessage(
+                "Ollama Chat", 
+                "SQL executed successfully (no rows returned)", 
+                level=Qgis.Success, 
+                duration=3
+            )
+            return
+        
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat", 
+            f"SQL executed successfully! {row_count} rows returned.", 
+            level=Qgis.Success, 
+            duration=4
+        )
+        
+        # Summarize in the output tab, the rows themselves are in the grid
+        result_text = "SQL Execution Results:\n\n"
+        result_text += f"Rows returned: {row_count}\n"
+        result_text += f"Columns: {', '.join(result.columns)}\n\n"
+        result_text += "Browse the rows in the Results tab."
+        
+        self.output_edit.append("\n\n" + "="*50 + "\n" + result_text)
+        self.tab_widget.setCurrentIndex(2)  # Switch to Results tab
+
+    def set_result_grid(self, result):
+        """Show a result in the Results tab, replacing the previous one"""
+        self.clear_result_grid()
+        self.result_model = LazyResultModel(result)
+        self.results_view.setModel(self.result_model)
+        self.add_layer_btn.setEnabled(True)
+        self.export_btn.setEnabled(True)
+        # The total of a streamed result becomes known as the grid scrolls to its end
+        self.result_model.rowsInserted.connect(self.update_results_label)
+        self.update_results_label()
+
+    def update_results_label(self, *args):
+        """Show the size of the current result above the grid"""
+        if self.result_model is None:
+            return
+        total = self.result_model.total_rows()
+        if total is None:
+            total = self.counted_rows
+        if total is not None:
+            total_text = f"{total} rows"
+        else:
+            total_text = f"{self.result_model.rowCount()}+ rows"
+        self.results_label.setText(f"{total_text}, {len(self.result_model.columns)} columns")
+        if self.count_worker is None:
+            self.count_rows_btn.setEnabled(total is None and bool(self.db_connection))
+
+    def count_result_rows(self):
+        """Count the rows of the current result, or cancel the running count
+
+        A streamed result only knows its total once every row was read, so
+        the query runs again as SELECT count(*) on a connection of its own.
+        """
+        if self.count_worker is not None:
+            self.count_worker.cancel()
+            return
+        if self.result_model is None or not self.result_sql or not self.db_connection:
+            return
+        
+        import psycopg2
+        params = (self.db_host, self.db_port, self.db_name, self.db_user, self.db_password)
+        
+        def connect():
+            return psycopg2.connect(
+                host=params[0],
+                port=params[1],
+                database=params[2],
+                user=params[3],
+                password=params[4]
+            )
+        
+        self.count_worker = RowCountWorker(
+            connect, self.result_sql, statement_timeout=self.statement_timeout_spin.value()
+        )
+        self.count_worker.counted.connect(self.on_result_rows_counted)
+        self.count_worker.count_failed.connect(self.on_result_count_failed)
+        self.count_worker.finished.connect(self.on_count_worker_done)
+        self.count_rows_btn.setText("Cancel Count")
+        self.count_worker.start()
+
+    def on_result_rows_counted(self, sql, count):
+        """Show the counted total if the result is still the one counted"""
+        if not self.dock_widget or self.result_model is None or sql != self.result_sql:
+            return
+        self.counted_rows = count
+        self.update_results_label()
+
+    def on_result_count_failed(self, error_msg):
+        """Report a count that failed"""
+        if not self.dock_widget:
+            return
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat",
+            f"Could not count the rows: {error_msg}",
+            level=Qgis.Warning,
+            duration=5
+        )
+
+    def on_count_worker_done(self):
+        """Release the count worker"""
+        worker = self.count_worker
+        self.count_worker = None
+        if worker is not None:
+            worker.deleteLater()
+        if not self.dock_widget:
+            return
+        self.count_rows_btn.setText("Count Rows")
+        self.update_results_label()
+        if self.result_model is None:
+            self.count_rows_btn.setEnabled(False)
+
+    def clear_result_grid(self):
+        """Remove the current result from the Results tab and close its cursor"""
+        if self.result_model is None:
+            return
+        if self.count_worker is not None:
+            self.count_worker.cancel()
+        self.counted_rows = None
+        if self.dock_widget:
+            self.results_view.setModel(None)
+            self.results_label.setText("Execute a query to browse its results here.")
+            self.add_layer_btn.setEnabled(False)
+            self.count_rows_btn.setEnabled(False)
+            if self.export_worker is None:
+                self.export_btn.setEnabled(False)
+        self.result_sql = None
+        self.result_model.close()
+        self.result_model.deleteLater()
+        self.result_model = None
+
+    def add_result_as_layer(self):
+        """Add the current query result to the map
+
+        Read-only PostgreSQL queries become a postgres provider query layer,
+        so QGIS fetches features by extent on its own and no row passes
+        through Python. Other results are already in memory and are loaded
+        into a memory layer.
+        """
+        if self.result_model is None or not self.result_sql:
+            return
+        
+        self.result_layer_count += 1
+        layer_name = f"Query result {self.result_layer_count}"
+        
+        try:
+            if self.db_connection and is_read_only_sql(self.result_sql):
+                key_column = unique_key_column(self.db_connection, self.result_sql)
+                if key_column is None:
+                    # The rows are numbered instead, a number changes with the
+                    # row order so selections may hit other rows after a refresh
+                    self.iface.messageBar().pushMessage(
+                        "Ollama Chat",
+                        "The query has no unique integer column such as a primary key, its rows "
+                        "are numbered as they are fetched. Add an ORDER BY or a key column to keep "
+                        "selections stable.",
+                        level=Qgis.Warning,
+                        duration=8
+                    )
+                columns = describe_query(self.db_connection, self.result_sql)
+                uri = QgsDataSourceUri()
+                uri.setConnection(
+                    self.db_host, self.db_port, self.db_name, self.db_user, self.db_password
+                )
+                set_query_data_source(uri, self.result_sql, columns, key_column)
+                layer = QgsVectorLayer(uri.uri(False), layer_name, "postgres")
+            else:
+                result = self.result_model.result
+                layer = create_memory_layer(layer_name, result.columns, result.iter_rows())
+            
+            if not layer.isValid():
+                raise Exception("QGIS could not load the query as a layer")
+        except Exception as e:
+            QMessageBox.critical(None, "Add Layer Error", f"Could not add the result as a layer: {str(e)}")
+            return
+        
+        QgsProject.instance().addMapLayer(layer)
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat", 
+            f"Layer '{layer_name}' added to the map", 
+            level=Qgis.Success, 
+            duration=3
+        )
+
+    def export_result(self):
+        """Export the current result to a file, or cancel the running export
+
+        Read-only PostgreSQL queries are run again and streamed to disk with
+        COPY, or with GDAL for GeoPackage, so memory use stays constant
+        however many rows they return. Other results are written from their
+        rows in batches.
+        """
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+            self.export_status_label.setText("Cancelling export...")
+            return
+        if self.result_model is None or not self.result_sql:
+            return
+        
+        path, name_filter = QFileDialog.getSaveFileName(
+            None,
+            "Export Result",
+            "",
+            ";;".join(format_filter for _, format_filter in EXPORT_FORMATS)
+        )
+        if not path:
+            return
+        export_format = export_format_for_filter(name_filter, path)
+        sql = self.result_sql
+        
+        if self.db_connection and is_read_only_sql(sql):
+            params = (self.db_host, self.db_port, self.db_name, self.db_user, self.db_password)
+            if export_format == "gpkg":
+                connection_string = pg_connection_string(*params)
                 
-                conn.commit()
+                def export(progress, is_cancelled, watch):
+                    size = translate_query_to_gpkg(
+                        connection_string, sql, path, progress=progress, is_cancelled=is_cancelled
+                    )
+                    return f"{size / (1024 * 1024):.1f} MB"
+            else:
+                import psycopg2
+                try:
+                    columns = describe_query(self.db_connection, sql)
+                except Exception as e:
+                    QMessageBox.critical(None, "Export Error", f"Could not export the result: {str(e)}")
+                    return
                 
-                # For DDL statements, provide helpful feedback
-                if is_ddl and sql_upper.startswith('CREATE VIEW'):
-                    view_name = "view"
-                    # Try to extract view name
-                    try:
-                        import re
-                        match = re.search(r'CREATE\s+(?:OR\s+REPLACE\s+)?VIEW\s+(\w+)', sql, re.IGNORECASE)
-                        if match:
-                            view_name = match.group(1)
-                    except:
-                        pass
-                    
-                    self.iface.messageBar().pushMessage(
-                        "Ollama Chat", 
-                        f"View '{view_name}' created successfully in PostgreSQL database!", 
-                        level=Qgis.Success, 
-                        duration=5
+                def export(progress, is_cancelled, watch):
+                    # A connection of its own, the export may run for a while
+                    connection = psycopg2.connect(
+                        host=params[0],
+                        port=params[1],
+                        database=params[2],
+                        user=params[3],
+                        password=params[4]
                     )
+                    watch(connection)
+                    try:
+                        size = copy_query_to_file(
+                            connection, sql, path, export_format, columns, progress, is_cancelled
+                        )
+                    finally:
+                        connection.close()
+                    return f"{size / (1024 * 1024):.1f} MB"
+        else:
+            result = self.result_model.result
+            columns = result.columns
+            rows = result.iter_rows()
+            
+            def export(progress, is_cancelled, watch):
+                count = write_rows(path, export_format, columns, rows, progress, is_cancelled)
+                return f"{count} rows"
+        
+        self.export_worker = ExportWorker(export, path)
+        self.export_worker.progress.connect(self.export_status_label.setText)
+        self.export_worker.exported.connect(self.on_result_exported)
+        self.export_worker.export_failed.connect(self.on_export_failed)
+        self.export_worker.export_cancelled.connect(self.on_export_cancelled)
+        self.export_worker.finished.connect(self.on_export_worker_done)
+        self.export_btn.setText("Cancel Export")
+        self.export_status_label.setText(f"Exporting to {os.path.basename(path)}...")
+        self.export_worker.start()
+
+    def on_result_exported(self, path, summary):
+        """Report a finished export"""
+        if not self.dock_widget:
+            return
+        self.export_status_label.setText(f"Exported {summary} to {os.path.basename(path)}")
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat", 
+            f"Result exported to {path} ({summary})", 
+            level=Qgis.Success, 
+            duration=4
+        )
+
+    def on_export_failed(self, error_msg):
+        """Report an export that failed"""
+        if not self.dock_widget:
+            return
+        self.export_status_label.setText("Export failed")
+        QMessageBox.critical(None, "Export Error", f"Could not export the result: {error_msg}")
+
+    def on_export_cancelled(self):
+        """Report an export cancelled by the user"""
+        if not self.dock_widget:
+            return
+        self.export_status_label.setText("Export cancelled")
+
+    def on_export_worker_done(self):
+        """Release the export worker"""
+        worker = self.export_worker
+        self.export_worker = None
+        if worker is not None:
+            worker.deleteLater()
+        if not self.dock_widget:
+            return
+        self.export_btn.setText("Export...")
+        self.export_btn.setEnabled(self.result_model is not None)
+
+    def get_result_connection(self):
+        """Return the connection that runs executed SQL, opening it on first use
+
+        Executed statements and the server-side cursors of their results get
+        a connection of their own, so a long query never blocks the schema
+        queries on the main connection and can be cancelled on its own.
+        """
+        import psycopg2
+        if self.result_connection is None or self.result_connection.closed:
+            self.result_connection = psycopg2.connect(
+                host=self.db_host,
+                port=self.db_port,
+                database=self.db_name,
+                user=self.db_user,
+                password=self.db_password
+            )
+        return self.result_connection
+
+    def get_layer_map_extent(self, layer):
+        """Return the map view extent in the CRS of layer, None unless file queries are filtered by it"""
+        if not QgsSettings().value("OllamaChat/ogr_map_extent", False, type=bool):
+            return None
+        canvas = self.iface.mapCanvas()
+        transform = QgsCoordinateTransform(
+            canvas.mapSettings().destinationCrs(), layer.crs(), QgsProject.instance()
+        )
+        return transform.transformBoundingBox(canvas.extent())
+
+    def execute_sqlite_statement(self, path, table, sql, extent, wal=False, watch=None):
+        """Run sql on a SQLite-based file through a pooled connection
+
+        SELECTs use a read-only connection and, with an extent, read table
+        through its R-tree. Writes use a separate connection, in WAL mode
+        with wal. The connection is passed to watch before the statement
+        runs, so it can be interrupted. Returns (rows, cursor description).
+        """
+        read_only = is_read_only_sql(sql)
+        if read_only:
+            key = source_key('sqlite', path) + ("read",)
+            connect = lambda: connect_sqlite(path, read_only=True)
+        else:
+            key = source_key('sqlite', path) + ("write", wal)
+            connect = lambda: connect_sqlite(path, wal=wal)
+        
+        bounds = None
+        if read_only and table and extent is not None:
+            bounds = (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+        
+        with self.connection_pool.connection(key, connect) as conn:
+            if watch is not None:
+                watch(conn)
+            with rtree_extent(conn, table, bounds):
+                return execute_statement(conn, sql)
+
+    def execute_db_query(self, provider_type, source, sql, dialect=DEFAULT_OGR_DIALECT, extent=None,
+                         wal=False, watch=None):
+        """Execute SQL on the data source of a layer and return (rows, cursor description)
+
+        provider_type and source are the provider name and data source URI
+        of the layer. For OGR files, dialect is the ExecuteSQL dialect
+        (OGRSQL or SQLITE). For files, extent is a QgsRectangle in the layer
+        CRS the features are filtered by, and wal switches SQLite-based files
+        to WAL when a statement writes. Database connections are passed to
+        watch before the statement runs, so it can be interrupted. Runs on a
+        LayerQueryWorker, so it touches no widgets.
+        """
+        if provider_type == 'postgres':
+            # PostgreSQL/PostGIS
+            uri = QgsDataSourceUri(source)
+            try:
+                import psycopg2
                 
-                cursor.close()
-                conn.close()
+                def connect():
+                    return psycopg2.connect(
+                        host=uri.host(),
+                        port=uri.port() if uri.port() else '5432',
+                        database=uri.database(),
+                        user=uri.username(),
+                        password=uri.password()
+                    )
                 
-                return results
+                # Reuse an open connection to the same database
+                with self.connection_pool.connection(source_key(provider_type, uri), connect) as conn:
+                    if watch is not None:
+                        watch(conn)
+                    return execute_statement(conn, sql)
             except ImportError:
                 raise Exception("psycopg2 not installed. Install it to execute PostgreSQL queries.")
             except Exception as e:
@@ -846,59 +2109,14 @@ class OllamaChat:
                 
         elif provider_type == 'spatialite':
             # SpatiaLite/SQLite
-            uri = QgsDataSourceUri(provider.dataSourceUri())
-            db_path = uri.database()
-            
+            uri = QgsDataSourceUri(source)
             try:
-                conn = sqlite3.connect(db_path)
-                cursor = conn.cursor()
-                
-                # Check if it's a DDL statement
-                sql_upper = sql.strip().upper()
-                is_ddl = any(sql_upper.startswith(cmd) for cmd in ['CREATE', 'ALTER', 'DROP', 'INSERT', 'UPDATE', 'DELETE'])
-                
-                cursor.execute(sql)
-                
-                # Try to fetch results only for SELECT queries
-                results = None
-                if not is_ddl:
-                    try:
-                        results = cursor.fetchall()
-                    except:
-                        results = None
-                
-                conn.commit()
-                
-                # For DDL statements, provide helpful feedback
-                if is_ddl and sql_upper.startswith('CREATE VIEW'):
-                    view_name = "view"
-                    # Try to extract view name
-                    try:
-                        import re
-                        match = re.search(r'CREATE\s+(?:OR\s+REPLACE\s+)?VIEW\s+(\w+)', sql, re.IGNORECASE)
-                        if match:
-                            view_name = match.group(1)
-                    except:
-                        pass
-                    
-                    self.iface.messageBar().pushMessage(
-                        "Ollama Chat", 
-                        f"View '{view_name}' created successfully in SQLite/GeoPackage!", 
-                        level=Qgis.Success, 
-                        duration=5
-                    )
-                
-                cursor.close()
-                conn.close()
-                
-                return results
+                return self.execute_sqlite_statement(uri.database(), uri.table(), sql, extent, wal, watch)
             except Exception as e:
                 raise Exception(f"SQLite/SpatiaLite Error: {str(e)}")
             
         elif provider_type == 'ogr':
             # OGR provider (GeoPackage, Shapefile, GeoJSON, etc.)
-            source = provider.dataSourceUri()
-            
             # Extract the file path from the data source URI
             # Format can be: "/path/to/file.gpkg|layername=layer"
             if '|' in source:
@@ -910,53 +2128,17 @@ class OllamaChat:
             if file_path.lower().endswith(('.gpkg', '.sqlite', '.db')):
                 try:
                     # Use sqlite3 to execute SQL on GeoPackage/SQLite
-                    conn = sqlite3.connect(file_path)
-                    cursor = conn.cursor()
-                    
-                    # Check if it's a DDL statement
-                    sql_upper = sql.strip().upper()
-                    is_ddl = any(sql_upper.startswith(cmd) for cmd in ['CREATE', 'ALTER', 'DROP', 'INSERT', 'UPDATE', 'DELETE'])
-                    
-                    cursor.execute(sql)
-                    
-                    # Try to fetch results only for SELECT queries
-                    results = None
-                    if not is_ddl:
-                        try:
-                            results = cursor.fetchall()
-                        except:
-                            results = None
-                    
-                    conn.commit()
-                    
-                    # For DDL statements, provide helpful feedback
-                    if is_ddl and sql_upper.startswith('CREATE VIEW'):
-                        view_name = "view"
-                        # Try to extract view name
-                        try:
-                            import re
-                            match = re.search(r'CREATE\s+(?:OR\s+REPLACE\s+)?VIEW\s+(\w+)', sql, re.IGNORECASE)
-                            if match:
-                                view_name = match.group(1)
-                        except:
-                            pass
-                        
-                        self.iface.messageBar().pushMessage(
-                            "Ollama Chat", 
-                            f"View '{view_name}' created successfully in GeoPackage!", 
-                            level=Qgis.Success, 
-                            duration=5
-                        )
-                    
-                    conn.close()
-                    
-                    return results
+                    layer_name = None
+                    for part in source.split('|')[1:]:
+                        if part.startswith('layername='):
+                            layer_name = part[len('layername='):]
+                    return self.execute_sqlite_statement(file_path, layer_name, sql, extent, wal, watch)
                 except Exception as e:
                     raise Exception(f"Error executing SQL on GeoPackage/SQLite: {str(e)}")
             else:
                 # For other OGR formats (Shapefile, GeoJSON, etc.), use GDAL ExecuteSQL
                 try:
-                    from osgeo import ogr, gdal
+                    from osgeo import ogr
                     
                     # Clean SQL for OGR - remove trailing semicolon as OGR doesn't expect it
                     sql_cleaned = sql.strip()
@@ -978,32 +2160,35 @@ class OllamaChat:
                                 f"or edit the SQL to use a SELECT statement instead."
                             )
                     
-                    # Open the data source
-                    ds = ogr.Open(file_path, 1)  # 1 = update mode
-                    if ds is None:
-                        raise Exception(f"Could not open data source: {file_path}")
-                    
-                    # Execute SQL (without semicolon)
-                    result_layer = ds.ExecuteSQL(sql_cleaned, dialect='OGRSQL')
+                    dialect = ogr_dialect(dialect)
+                    read_only = is_read_only_sql(sql_cleaned)
                     
-                    if result_layer is None:
-                        ds.Destroy()
-                        # Return empty result for successful DDL commands
-                        return None
+                    if read_only:
+                        # Built before the datasource is opened, which then uses it
+                        if extent is not None:
+                            ensure_spatial_index(file_path)
+                        key = source_key(provider_type, file_path) + ("read",)
+                    else:
+                        key = source_key(provider_type, file_path) + ("update",)
                     
-                    # Fetch results
-                    results = []
-                    for feature in result_layer:
-                        # Get all field values
-                        row = []
-                        for i in range(feature.GetFieldCount()):
-                            row.append(feature.GetField(i))
-                        results.append(tuple(row))
+                    # Reuse the parsed datasource while the file is unchanged
+                    with self.connection_pool.connection(
+                        key,
+                        lambda: open_datasource(file_path, update=not read_only),
+                        ping=datasource_checker(file_path),
+                        close=close_datasource,
+                        check_interval=0
+                    ) as ds:
+                        # Execute SQL (without semicolon)
+                        results, description = execute_ogr_sql(
+                            ds, sql_cleaned, dialect, extent_filter(extent)
+                        )
                     
-                    ds.ReleaseResultSet(result_layer)
-                    ds.Destroy()
+                    if not read_only:
+                        # Cached read-only datasources may now be stale
+                        self.connection_pool.close_idle(source_key(provider_type, file_path) + ("read",))
                     
-                    return results if results else None
+                    return results, description
                     
                 except ImportError:
                     raise Exception("GDAL/OGR not available. Cannot execute SQL on this file format.")
@@ -1032,7 +2217,7 @@ class OllamaChat:
                                     f"Available fields: {', '.join(field_names)}\n\n"
                                     f"Your SQL:\n{sql_cleaned}"
                                 )
-                        except:
+                        except Exception:
                             pass
                         
                         raise Exception(
@@ -1049,51 +2234,16 @@ class OllamaChat:
         else:
             raise Exception(f"Provider type '{provider_type}' not yet supported for SQL execution")
 
+    def get_created_view_name(self, sql):
+        """Return the view name of a CREATE VIEW statement, None for other SQL"""
+        if not re.match(r'\s*CREATE\s+(?:OR\s+REPLACE\s+)?VIEW\b', sql, re.IGNORECASE):
+            return None
+        match = re.search(r'CREATE\s+(?:OR\s+REPLACE\s+)?VIEW\s+(\w+)', sql, re.IGNORECASE)
+        return match.group(1) if match else "view"
+
     def check_ollama_model(self, model_name):
         """Check if the specified model is available in Ollama"""
-        try:
-            response = requests.get(
-                "http://localhost:11434/api/tags",
-                timeout=5
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            available_models = [model['name'] for model in data.get('models', [])]
-            
-            # Check if the model name matches any available model
-            # Ollama models can have tags like "llava:latest"
-            for available_model in available_models:
-                if model_name in available_model or available_model.startswith(model_name + ":"):
-                    return True, None
-            
-            # Model not found
-            if available_models:
-                models_list = "\n  - ".join(available_models)
-                error_msg = (
-                    f"Model '{model_name}' is not available in Ollama.\n\n"
-                    f"Available models:\n  - {models_list}\n\n"
-                    f"To pull a model, run in terminal:\n"
-                    f"  ollama pull {model_name}"
-                )
-            else:
-                error_msg = (
-                    f"Model '{model_name}' is not available in Ollama.\n\n"
-                    f"No models found. To pull a model, run in terminal:\n"
-                    f"  ollama pull {model_name}"
-                )
-            
-            return False, error_msg
-            
-        except requests.exceptions.ConnectionError:
-            error_msg = (
-                "Cannot connect to Ollama.\n\n"
-                "Make sure Ollama is running on http://localhost:11434"
-            )
-            return False, error_msg
-        except Exception as e:
-            error_msg = f"Error checking Ollama models: {str(e)}"
-            return False, error_msg
+        return self.ollama_client.check_model(model_name)
 
     def attach_image(self):
         """Attach an image file for sending to Ollama"""
@@ -1125,8 +2275,170 @@ class OllamaChat:
                     duration=3
                 )
 
+    def get_keep_alive(self):
+        """Return the keep_alive value sent with every Ollama request"""
+        keep_alive = self.keep_alive_edit.text().strip() or "30m"
+        # Ollama expects plain numbers (seconds, or -1 for forever) as integers
+        if re.fullmatch(r'-?\d+', keep_alive):
+            return int(keep_alive)
+        return keep_alive
+
+    def get_generation_options(self):
+        """Return the Ollama options sent with every request, as a hashable tuple"""
+        options = self.get_model_profiles().get(self.get_profile_name(), {})
+        return tuple(sorted(options.items()))
+
+    def get_num_ctx(self):
+        """Return the context window of the selected profile"""
+        return dict(self.get_generation_options()).get("num_ctx", OLLAMA_DEFAULT_NUM_CTX)
+
+    def get_profile_name(self):
+        """Return the name of the selected generation profile"""
+        return self.profile_combo.currentText() or DEFAULT_PROFILE
+
+    def get_model_profiles(self):
+        """Return the generation profiles of the current model"""
+        return model_profiles(
+            self.generation_profiles,
+            self.model_name_edit.text().strip(),
+            QgsSettings().value("OllamaChat/num_ctx", 0, type=int)
+        )
+
+    def refresh_profiles(self):
+        """Fill the profile list for the current model and select its last profile"""
+        profiles = self.get_model_profiles()
+        active = self.active_profiles.get(self.model_name_edit.text().strip(), DEFAULT_PROFILE)
+        self.profile_combo.blockSignals(True)
+        self.profile_combo.clear()
+        self.profile_combo.addItems(list(profiles))
+        self.profile_combo.setCurrentIndex(max(0, self.profile_combo.findText(active)))
+        self.profile_combo.blockSignals(False)
+        self.profile_options_edit.setText(format_options(profiles.get(self.get_profile_name(), {})))
+
+    def store_profiles(self, profiles):
+        """Save the profiles of the current model and its selected profile"""
+        model_name = self.model_name_edit.text().strip()
+        if not model_name:
+            return
+        self.generation_profiles[model_name] = profiles
+        self.active_profiles[model_name] = self.get_profile_name()
+        QgsSettings().setValue("OllamaChat/generation_profiles", dump_profiles(self.generation_profiles))
+        QgsSettings().setValue("OllamaChat/active_profiles", dump_profiles(self.active_profiles))
+
+    def update_stop_at_sql_checkbox(self, *args):
+        """Stopping at the SQL block only applies to explained answers"""
+        self.stop_at_sql_checkbox.setEnabled(self.response_mode_combo.currentData() != "sql_only")
+
+    def on_model_name_changed(self):
+        """Show the profiles of the new model and warm it up"""
+        self.refresh_profiles()
+        self.on_model_settings_changed()
+
+    def on_profile_changed(self, index):
+        """Show the options of the selected profile and remember the choice"""
+        if index < 0:
+            return
+        profiles = self.get_model_profiles()
+        self.profile_options_edit.setText(format_options(profiles.get(self.get_profile_name(), {})))
+        self.store_profiles(profiles)
+        self.on_model_settings_changed()
+
+    def on_profile_options_edited(self):
+        """Store edited options in the selected profile"""
+        profiles = self.get_model_profiles()
+        try:
+            options = parse_options(self.profile_options_edit.text())
+        except Exception as e:
+            self.iface.messageBar().pushMessage("Ollama Chat", str(e), level=Qgis.Warning, duration=5)
+            self.profile_options_edit.setText(format_options(profiles.get(self.get_profile_name(), {})))
+            return
+        if options == profiles.get(self.get_profile_name()):
+            return
+        profiles[self.get_profile_name()] = options
+        self.store_profiles(profiles)
+        self.on_model_settings_changed()
+
+    def save_profile_as(self):
+        """Save the options shown as a new named profile of the current model"""
+        try:
+            options = parse_options(self.profile_options_edit.text())
+        except Exception as e:
+            QMessageBox.warning(None, "Invalid Options", str(e))
+            return
+        name, ok = QInputDialog.getText(None, "Save Profile", "Profile name:")
+        name = name.strip()
+        if not ok or not name:
+            return
+        profiles = self.get_model_profiles()
+        profiles[name] = options
+        self.active_profiles[self.model_name_edit.text().strip()] = name
+        self.store_profiles(profiles)
+        self.refresh_profiles()
+        self.on_model_settings_changed()
+
+    def on_model_settings_changed(self):
+        """Warm up the model again when its name or keep_alive changes"""
+        QgsSettings().setValue("OllamaChat/keep_alive", self.keep_alive_edit.text().strip())
+        model_name = self.model_name_edit.text().strip()
+        if model_name and (model_name, self.get_keep_alive(), self.get_generation_options()) != self.warmed_model:
+            self.warm_up_model()
+
+    def warm_up_model(self):
+        """Preload the configured model in Ollama on a background thread"""
+        model_name = self.model_name_edit.text().strip()
+        if not model_name:
+            return
+
+        # Only one warm-up at a time, re-run once the current one is done
+        if self.warmup_worker is not None:
+            self.warmup_pending = True
+            return
+
+        keep_alive = self.get_keep_alive()
+        options = self.get_generation_options()
+        self.warmed_model = (model_name, keep_alive, options)
+        self.model_status_label.setText(f"● Loading {model_name}...")
+        self.model_status_label.setStyleSheet("color: orange;")
+
+        self.warmup_worker = ModelWarmupWorker(self.ollama_client, model_name, keep_alive, dict(options))
+        self.warmup_worker.warmed.connect(self.on_model_warmed)
+        self.warmup_worker.warmup_failed.connect(self.on_model_warmup_failed)
+        self.warmup_worker.finished.connect(self.on_warmup_done)
+        self.warmup_worker.start()
+
+    def on_model_warmed(self, model_name, elapsed, load_duration):
+        """Show that the model is resident in Ollama"""
+        if load_duration >= 0.05:
+            detail = f"loaded in {load_duration:.1f} s"
+        else:
+            detail = f"already resident, {elapsed:.2f} s round trip"
+        self.model_status_label.setText(f"● {model_name} ready ({detail})")
+        self.model_status_label.setStyleSheet("color: green;")
+
+    def on_model_warmup_failed(self, model_name, error_msg):
+        """Show why the model could not be preloaded"""
+        self.warmed_model = None
+        self.model_status_label.setText(f"● {model_name} not loaded: {error_msg}")
+        self.model_status_label.setStyleSheet("color: red;")
+
+    def on_warmup_done(self):
+        """Release the warm-up worker and run a queued warm-up if any"""
+        if self.warmup_worker is not None:
+            self.warmup_worker.deleteLater()
+            self.warmup_worker = None
+        if self.warmup_pending and self.dock_widget:
+            self.warmup_pending = False
+            self.warm_up_model()
+
     def send_to_ollama(self):
-        """Send prompt and optional image to Ollama API"""
+        """Send prompt and optional image to Ollama API
+
+        The model check, schema assembly and streaming request run on an
+        OllamaGenerateWorker so the QGIS window stays responsive.
+        """
+        if self.ollama_worker is not None:
+            return
+
         prompt = self.prompt_edit.toPlainText().strip()
         if not prompt:
             QMessageBox.warning(None, "Empty Prompt", "Please enter a prompt first.")
@@ -1141,209 +2453,280 @@ class OllamaChat:
                 "Please enter an Ollama model name (e.g., llava, llama2, mistral)."
             )
             return
-        
-        # Check if the model is available
+
+        # SQL only answers are a JSON object capped at num_predict tokens
+        response_mode = self.response_mode_combo.currentData()
+        options = dict(self.get_generation_options())
+        request_prompt = prompt
+        response_format = None
+        response_reserve = None
+        if response_mode == "sql_only":
+            options.setdefault("num_predict", SQL_ONLY_NUM_PREDICT)
+            options["stop"] = SQL_ONLY_STOP
+            request_prompt = sql_only_prompt(prompt)
+            response_format = SQL_RESPONSE_SCHEMA
+            response_reserve = options["num_predict"]
+
+        # Ollama keeps the context of earlier turns ahead of the new prompt and
+        # cuts the start, the schema, once both exceed num_ctx. Start a new
+        # conversation before that happens, so the schema is sent again.
+        if self.conversation_context and self.conversation_checkbox.isChecked():
+            context_tokens = len(self.conversation_context)
+            if schema_budget(self.get_num_ctx(), request_prompt, response_reserve, context_tokens) == 0:
+                self.reset_conversation()
+                self.iface.messageBar().pushMessage(
+                    "Ollama Chat",
+                    "The conversation filled the context window (num_ctx), starting a new one",
+                    level=Qgis.Info,
+                    duration=4
+                )
+
+        # Snapshot the schema selection so the worker never reads widget state
+        schema_provider = None
+        if self.include_db_schema:
+            selected_tables = list(self.selected_tables)
+            use_retrieval = self.retrieval_checkbox.isChecked() and not selected_tables
+            embedding_model = self.embedding_model_edit.text().strip() or "nomic-embed-text"
+            top_k = self.retrieval_top_k_spin.value()
+            budget = schema_budget(self.get_num_ctx(), request_prompt, response_reserve)
+            if use_retrieval:
+                # Re-index in the background if the catalog changed since the last build
+                self.build_schema_index()
+
+            def schema_provider(report):
+                if not self.db_connection:
+                    return ""
+                if budget == 0:
+                    report("The prompt alone fills the context window (num_ctx)", Qgis.Warning)
+                if use_retrieval and retrieval_available():
+                    try:
+                        return self.build_relevant_schema_text(prompt, embedding_model, top_k, budget, report)
+                    except Exception as e:
+                        report(f"Table ranking failed, including all tables: {str(e)}", Qgis.Warning)
+                return self.build_postgres_schema_text(selected_tables, budget, report)
+
+        # Disable send button during request
+        self.send_btn.setEnabled(False)
+        self.stream_renderer.reset()
+        self.output_edit.setText("Connecting to Ollama...")
+
+        trace = Trace("prompt", model=model_name, prompt=prompt, image=bool(self.image_data),
+                      response_mode=response_mode, profile=self.get_profile_name(), options=options)
+        self.ollama_worker = OllamaGenerateWorker(
+            self.ollama_client,
+            model_name,
+            request_prompt,
+            image_data=self.image_data,
+            model_checker=self.check_ollama_model,
+            schema_provider=schema_provider,
+            keep_alive=self.get_keep_alive(),
+            options=options,
+            context=self.conversation_context if self.conversation_checkbox.isChecked() else None,
+            context_key=self.conversation_key,
+            trace=trace,
+            # A SQL only answer is JSON, a fence inside its sql string is not a block
+            sql_extractor=IncrementalSqlExtractor() if response_format is None else None,
+            stop_at_sql=response_format is None and self.stop_at_sql_checkbox.isChecked(),
+            response_format=response_format
+        )
+        self.ollama_worker.status_message.connect(self.on_generation_status)
+        self.ollama_worker.model_unavailable.connect(self.on_model_unavailable)
+        self.ollama_worker.first_token.connect(self.on_first_token)
+        self.ollama_worker.token_received.connect(self.on_token_received)
+        self.ollama_worker.sql_ready.connect(self.on_sql_ready)
+        self.ollama_worker.generation_finished.connect(self.on_generation_finished)
+        self.ollama_worker.generation_interrupted.connect(self.on_generation_interrupted)
+        self.ollama_worker.generation_failed.connect(self.on_generation_failed)
+        self.ollama_worker.finished.connect(self.on_worker_done)
+        self.ollama_worker.start()
+
+    def on_generation_status(self, message, level):
+        """Show a progress message from the generation worker"""
         self.iface.messageBar().pushMessage(
             "Ollama Chat", 
-            f"Checking if model '{model_name}' is available...", 
-            level=Qgis.Info, 
-            duration=2
+            message, 
+            level=level, 
+            duration=3 if level == Qgis.Info else 5
         )
-        
-        is_available, error_msg = self.check_ollama_model(model_name)
-        if not is_available:
-            QMessageBox.critical(
-                None, 
-                "Model Not Available", 
-                error_msg
-            )
-            self.iface.messageBar().pushMessage(
-                "Ollama Chat", 
-                f"Model '{model_name}' is not available", 
-                level=Qgis.Critical, 
-                duration=5
-            )
-            return
 
-        # Disable send button during request
-        self.send_btn.setEnabled(False)
-        
-        # Show progress message in QGIS message bar
+    def on_model_unavailable(self, error_msg):
+        """Report a model that is not pulled in Ollama"""
+        self.ollama_worker.trace.set(outcome="model unavailable")
+        self.output_edit.setText("")
+        QMessageBox.critical(
+            None, 
+            "Model Not Available", 
+            error_msg
+        )
         self.iface.messageBar().pushMessage(
             "Ollama Chat", 
-            "Preparing request...", 
-            level=Qgis.Info, 
-            duration=2
+            f"Model '{self.ollama_worker.model_name}' is not available", 
+            level=Qgis.Critical, 
+            duration=5
         )
-        
-        self.output_edit.setText("Connecting to Ollama...")
-        
-        try:
-            # Add database schema context if enabled
-            full_prompt = prompt
-            if self.include_db_schema:
-                schema_context = self.get_database_schema_context()
-                if schema_context:
-                    full_prompt = schema_context + prompt
-                    self.iface.messageBar().pushMessage(
-                        "Ollama Chat", 
-                        "Including database schema in request...", 
-                        level=Qgis.Info, 
-                        duration=2
-                    )
-                else:
-                    self.iface.messageBar().pushMessage(
-                        "Ollama Chat", 
-                        "No layers available for schema", 
-                        level=Qgis.Warning, 
-                        duration=3
-                    )
-            
-            # Build the payload
-            payload = {
-                "model": model_name,
-                "prompt": full_prompt,
-                "stream": True
-            }
-            
-            # Add image if attached
-            if self.image_data:
-                payload["images"] = [self.image_data]
-                self.iface.messageBar().pushMessage(
-                    "Ollama Chat", 
-                    "Sending request with image to Ollama...", 
-                    level=Qgis.Info, 
-                    duration=3
-                )
-            else:
-                self.iface.messageBar().pushMessage(
-                    "Ollama Chat", 
-                    "Sending request to Ollama...", 
-                    level=Qgis.Info, 
-                    duration=3
-                )
 
-            # Make the API request
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json=payload,
-                stream=True,
-                timeout=1200
-            )
-            
-            # Check if request was successful
-            response.raise_for_status()
-            
-            # Show message that we're receiving response
-            self.iface.messageBar().pushMessage(
-                "Ollama Chat", 
-                "Receiving response from Ollama...", 
-                level=Qgis.Info, 
-                duration=3
-            )
+    def on_first_token(self, seconds):
+        """Show the time to first token of the running generation"""
+        model_name = self.ollama_worker.model_name if self.ollama_worker else ""
+        self.model_status_label.setText(
+            f"● {model_name}: first token after {seconds:.2f} s"
+        )
+        self.model_status_label.setStyleSheet("color: green;")
 
-            full_text = ""
-            self.output_edit.setText("")
-            
-            # Process streaming response
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        # Parse JSON response
-                        chunk_data = json.loads(line.decode("utf-8"))
-                        
-                        # Extract the response text
-                        if "response" in chunk_data:
-                            response_text = chunk_data["response"]
-                            full_text += response_text
-                            self.output_edit.setPlainText(full_text)
-                        
-                        # Check if done
-                        if chunk_data.get("done", False):
-                            break
-                            
-                    except json.JSONDecodeError as e:
-                        # Skip malformed JSON lines
-                        continue
-            
-            # Check if we got any response
-            if not full_text:
-                self.output_edit.setText("No response received from Ollama. The model might not be available.")
-                self.iface.messageBar().pushMessage(
-                    "Ollama Chat", 
-                    "No response received from Ollama", 
-                    level=Qgis.Warning, 
-                    duration=4
-                )
-            else:
-                # Extract SQL from response
-                self.extracted_sql = self.extract_sql_from_text(full_text)
-                
-                if self.extracted_sql:
-                    self.sql_edit.setPlainText(self.extracted_sql)
-                    self.execute_sql_btn.setEnabled(True)
-                    self.copy_sql_btn.setEnabled(True)
-                    self.iface.messageBar().pushMessage(
-                        "Ollama Chat", 
-                        "Response completed! SQL code detected and extracted.", 
-                        level=Qgis.Success, 
-                        duration=3
-                    )
-                    # Highlight the SQL tab
-                    self.tab_widget.setTabText(1, "SQL Code ✓")
-                else:
-                    self.sql_edit.setPlainText("No SQL code detected in response.")
-                    self.execute_sql_btn.setEnabled(False)
-                    self.copy_sql_btn.setEnabled(False)
-                    self.iface.messageBar().pushMessage(
-                        "Ollama Chat", 
-                        "Response completed successfully!", 
-                        level=Qgis.Success, 
-                        duration=3
-                    )
-                    self.tab_widget.setTabText(1, "SQL Code")
+    def on_token_received(self, text):
+        """Queue a streamed token for the throttled Response tab renderer"""
+        self.stream_renderer.append(text)
 
-        except requests.exceptions.ConnectionError:
-            error_msg = "Cannot connect to Ollama. Make sure Ollama is running on http://localhost:11434"
-            self.output_edit.setText(error_msg)
-            self.iface.messageBar().pushMessage(
-                "Ollama Chat", 
-                error_msg, 
-                level=Qgis.Critical, 
-                duration=5
-            )
-        
-        except requests.exceptions.Timeout:
-            error_msg = "Request timed out. The model might be taking too long to respond."
-            self.output_edit.setText(error_msg)
+    def on_sql_ready(self, sql):
+        """Offer the SQL block for execution while the response is still streaming"""
+        self.extracted_sql = sql
+        self.sql_edit.setPlainText(sql)
+        self.execute_sql_btn.setEnabled(self.sql_worker is None)
+        self.copy_sql_btn.setEnabled(True)
+        self.tab_widget.setTabText(1, "SQL Code ✓")
+        if self.ollama_worker is not None:
+            self.ollama_worker.trace.set(sql_ready_after=round(self.ollama_worker.trace.elapsed(), 4))
+
+    def on_generation_finished(self, full_text, final_chunk):
+        """Handle a completed response and extract SQL from it"""
+        # Render whatever is still buffered from the last frame
+        self.stream_renderer.finish()
+
+        # Keep the context so the next prompt can continue from it
+        if self.conversation_checkbox.isChecked() and final_chunk.get("context"):
+            self.conversation_context = final_chunk["context"]
+            self.conversation_key = self.ollama_worker.context_key
+            self.new_conversation_btn.setEnabled(True)
+
+        # Check if we got any response
+        if not full_text:
+            self.output_edit.setText("No response received from Ollama. The model might not be available.")
             self.iface.messageBar().pushMessage(
                 "Ollama Chat", 
-                error_msg, 
-                level=Qgis.Critical, 
-                duration=5
+                "No response received from Ollama", 
+                level=Qgis.Warning, 
+                duration=4
             )
+            return
+
+        # Extract SQL from response
+        parsed = parse_sql_response(full_text) if self.ollama_worker.response_format else None
+        if parsed is not None:
+            # Show the JSON answer as readable text
+            self.output_edit.setText(format_sql_response(parsed))
+            self.extracted_sql = parsed["sql"]
+        else:
+            self.extracted_sql = extract_sql_from_text(full_text)
+        self.ollama_worker.trace.set(sql_found=bool(self.extracted_sql))
         
-        except requests.exceptions.HTTPError as e:
-            error_msg = f"HTTP Error: {e.response.status_code} - {e.response.reason}"
-            self.output_edit.setText(error_msg)
+        if self.extracted_sql:
+            if self.sql_edit.toPlainText() != self.extracted_sql:
+                self.sql_edit.setPlainText(self.extracted_sql)
+            self.execute_sql_btn.setEnabled(self.sql_worker is None)
+            self.copy_sql_btn.setEnabled(True)
             self.iface.messageBar().pushMessage(
                 "Ollama Chat", 
-                error_msg, 
-                level=Qgis.Critical, 
-                duration=5
+                "Response completed! SQL code detected and extracted.", 
+                level=Qgis.Success, 
+                duration=3
             )
-        
-        except Exception as e:
-            error_msg = f"Unexpected error: {str(e)}"
-            self.output_edit.setText(error_msg)
+            # Highlight the SQL tab
+            self.tab_widget.setTabText(1, "SQL Code ✓")
+        else:
+            self.sql_edit.setPlainText("No SQL code detected in response.")
+            self.execute_sql_btn.setEnabled(False)
+            self.copy_sql_btn.setEnabled(False)
             self.iface.messageBar().pushMessage(
                 "Ollama Chat", 
-                error_msg, 
-                level=Qgis.Critical, 
-                duration=5
+                "Response completed successfully!", 
+                level=Qgis.Success, 
+                duration=3
             )
-        
-        finally:
-            # Re-enable send button
+            self.tab_widget.setTabText(1, "SQL Code")
+
+    def on_generation_interrupted(self, text, reason):
+        """Handle a response that ended before its done chunk
+
+        The answer is incomplete, so its context is not kept for the next
+        prompt, which continues from the last complete answer instead.
+        """
+        if not self.dock_widget:
+            return
+        self.stream_renderer.finish()
+
+        if reason == "sql":
+            # The SQL block was already offered by on_sql_ready
+            message = "SQL code detected, the rest of the answer was not generated"
+            level = Qgis.Success
+        elif reason == "stopped":
+            message = "Response stopped before it was complete"
+            level = Qgis.Info
+        else:
+            message = "The response from Ollama ended before it was complete"
+            level = Qgis.Warning
+
+        # Only a SQL block that was complete, and offered by on_sql_ready,
+        # is kept; SQL cut off mid-statement is never extracted
+        self.ollama_worker.trace.set(sql_found="sql_ready_after" in self.ollama_worker.trace.fields)
+
+        self.iface.messageBar().pushMessage("Ollama Chat", message, level=level, duration=4)
+
+    def on_generation_failed(self, error_msg):
+        """Show an error raised by the generation worker"""
+        if self.ollama_worker is not None:
+            self.ollama_worker.trace.set(outcome="failed")
+        self.stream_renderer.reset()
+        self.output_edit.setText(error_msg)
+        self.iface.messageBar().pushMessage(
+            "Ollama Chat", 
+            error_msg, 
+            level=Qgis.Critical, 
+            duration=5
+        )
+
+    def on_worker_done(self):
+        """Release the generation worker and re-enable the send button"""
+        if self.ollama_worker is not None:
+            trace = self.ollama_worker.trace
+            if self.stream_renderer:
+                trace.add_span("render", self.stream_renderer.render_time)
+            if "outcome" not in trace.fields:
+                stopped = self.ollama_worker.isInterruptionRequested()
+                trace.set(outcome="stopped" if stopped else "finished")
+            self.record_trace(trace)
+            self.ollama_worker.deleteLater()
+            self.ollama_worker = None
+        if self.dock_widget:
             self.send_btn.setEnabled(True)
 
+    def stop_generation(self):
+        """Stop a running generation and wait for its worker to exit"""
+        if self.ollama_worker is not None:
+            self.stop_worker(self.ollama_worker, self.ollama_worker.stop)
+
+    def stop_worker(self, worker, cancel):
+        """Cancel a worker and block until its thread has exited
+
+        cancel unblocks the call the worker is waiting in, by closing its
+        response or cancelling its statement on the server. Calls that can
+        not be interrupted run with bounded timeouts, and the wait gives up
+        after WORKER_STOP_TIMEOUT_MS so unloading never hangs QGIS; a worker
+        still running then is logged and left to finish. The thread is never
+        terminated, that could leave the interpreter, the HTTP session or a
+        pooled connection in a broken state.
+        """
+        if cancel is not None:
+            cancel()
+        if worker.wait(WORKER_STOP_TIMEOUT_MS):
+            return
+        # Still blocked in a call that could not be interrupted. Keep the
+        # thread object alive until it returns on its own, a QThread deleted
+        # while running takes QGIS down with it.
+        DETACHED_WORKERS.append(worker)
+        worker.finished.connect(lambda: DETACHED_WORKERS.remove(worker))
+        QgsMessageLog.logMessage(
+            f"{type(worker).__name__} did not stop within {WORKER_STOP_TIMEOUT_MS / 1000:.0f} s "
+            "and is left to finish in the background",
+            "Ollama Chat",
+            Qgis.Warning
+        )
@@ -0,0 +1,146 @@
+import os
+
+
+# Dialects GDAL ExecuteSQL understands; SQLITE adds SpatiaLite functions such
+# as ST_Intersects or ST_Buffer on top of any OGR layer
+OGR_DIALECTS = ("OGRSQL", "SQLITE")
+DEFAULT_OGR_DIALECT = "OGRSQL"
+
+SPATIAL_INDEX_EXTENSIONS = (".qix", ".sbn")
+
+# Files next to a .shp that hold its attributes, index, projection and encoding
+SHAPEFILE_SIDECAR_EXTENSIONS = (".dbf", ".shx", ".prj", ".cpg", ".qix", ".sbn", ".sbx")
+
+
+def file_signature(path):
+    """Return (modification time, size) of a file, None if it is missing"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def datasource_files(path):
+    """Return the files a datasource is read from, a shapefile with its sidecars"""
+    base, extension = os.path.splitext(path)
+    if extension.lower() != ".shp":
+        return [path]
+    files = [path]
+    for sidecar in SHAPEFILE_SIDECAR_EXTENSIONS:
+        files.append(base + sidecar)
+        files.append(base + sidecar.upper())
+    return files
+
+
+def datasource_signature(path):
+    """Return the signatures of every file of a datasource"""
+    return tuple(file_signature(file) for file in datasource_files(path))
+
+
+def ogr_dialect(value):
+    """Return the ExecuteSQL dialect for a setting, OGRSQL if it is not a known one"""
+    dialect = str(value or "").upper()
+    return dialect if dialect in OGR_DIALECTS else DEFAULT_OGR_DIALECT
+
+
+def open_datasource(path, update=False):
+    """Open an OGR datasource, read-only unless update is set"""
+    from osgeo import ogr
+
+    datasource = ogr.Open(path, 1 if update else 0)
+    if datasource is None:
+        raise Exception(f"Could not open data source: {path}")
+    return datasource
+
+
+def datasource_checker(path):
+    """Return a ping for a cached datasource of path
+
+    The datasource is only reused while none of its files has changed since
+    it was opened, as OGR would otherwise keep serving the old features.
+    """
+    signature = datasource_signature(path)
+
+    def ping(datasource):
+        return datasource_signature(path) == signature and datasource.GetLayerCount() >= 0
+    return ping
+
+
+def close_datasource(datasource):
+    """Release an OGR datasource"""
+    try:
+        datasource.Destroy()
+    except Exception:
+        pass
+
+
+def has_spatial_index(path):
+    """Return True if a shapefile has a .qix or .sbn spatial index next to it"""
+    base = os.path.splitext(path)[0]
+    return any(
+        os.path.exists(base + extension) or os.path.exists(base + extension.upper())
+        for extension in SPATIAL_INDEX_EXTENSIONS
+    )
+
+
+def ensure_spatial_index(path):
+    """Build a .qix spatial index for a shapefile that has none
+
+    The shapefile driver uses .qix and .sbn indexes for spatial filters on
+    its own, so extent filtered queries read only the matching features.
+    Returns True if the file has an index afterwards. Files in read-only
+    directories and other formats are left alone.
+    """
+    if not path.lower().endswith(".shp"):
+        return False
+    if has_spatial_index(path):
+        return True
+    if not os.access(os.path.dirname(os.path.abspath(path)), os.W_OK):
+        return False
+
+    try:
+        datasource = open_datasource(path, update=True)
+    except Exception:
+        return False
+    try:
+        for index in range(datasource.GetLayerCount()):
+            layer_name = datasource.GetLayer(index).GetName().replace('"', '""')
+            datasource.ExecuteSQL(f'CREATE SPATIAL INDEX ON "{layer_name}"')
+    except Exception:
+        return False
+    finally:
+        close_datasource(datasource)
+    return has_spatial_index(path)
+
+
+def extent_filter(extent):
+    """Return an OGR polygon for a QgsRectangle, to pass as spatial filter"""
+    if extent is None:
+        return None
+    from osgeo import ogr
+
+    return ogr.CreateGeometryFromWkt(extent.asWktPolygon())
+
+
+def execute_ogr_sql(datasource, sql, dialect=DEFAULT_OGR_DIALECT, spatial_filter=None):
+    """Run SQL on an OGR datasource, returning (rows, description)
+
+    rows are tuples and description lists one (name,) tuple per field, as a
+    DB-API cursor does. spatial_filter limits the result to features that
+    intersect it. Returns (None, None) for statements that produce no result
+    layer.
+    """
+    result_layer = datasource.ExecuteSQL(sql, spatial_filter, dialect)
+    if result_layer is None:
+        return None, None
+    try:
+        definition = result_layer.GetLayerDefn()
+        field_count = definition.GetFieldCount()
+        description = [(definition.GetFieldDefn(i).GetName(),) for i in range(field_count)]
+        results = []
+        for feature in result_layer:
+            results.append(tuple(feature.GetField(i) for i in range(field_count)))
+        return results, description
+    finally:
+        datasource.ReleaseResultSet(result_layer)
@@ -0,0 +1,264 @@
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+OLLAMA_URL = "http://localhost:11434"
+
+# Seconds to wait for a connection to Ollama and, for warm-up and embedding
+# requests, for each read. A worker blocked in one of these calls can only
+# be waited for, so they must not block for long.
+CONNECT_TIMEOUT = 5
+WARM_UP_TIMEOUT = (CONNECT_TIMEOUT, 30)
+EMBED_TIMEOUT = (CONNECT_TIMEOUT, 30)
+
+
+class OllamaClient:
+    """Shared HTTP client for every call the plugin makes to Ollama
+
+    A single requests.Session keeps connections to the Ollama server alive
+    between requests, and the /api/tags model list is cached for models_ttl
+    seconds. Stale entries are served immediately while a background thread
+    refreshes them, so the pre-flight model check normally costs nothing.
+    """
+
+    def __init__(self, base_url=OLLAMA_URL, models_ttl=300):
+        self.base_url = base_url.rstrip("/")
+        self.models_ttl = models_ttl
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = threading.Lock()
+        self.models = None
+        self.models_fetched_at = 0.0
+        self.refresh_thread = None
+
+    def url(self, path):
+        """Return the absolute URL of an API endpoint"""
+        return f"{self.base_url}{path}"
+
+    def fetch_models(self):
+        """Fetch the model list from /api/tags and store it in the cache"""
+        response = self.session.get(self.url("/api/tags"), timeout=CONNECT_TIMEOUT)
+        response.raise_for_status()
+
+        data = response.json()
+        models = [model['name'] for model in data.get('models', [])]
+
+        with self.lock:
+            self.models = models
+            self.models_fetched_at = time.monotonic()
+        return models
+
+    def list_models(self):
+        """Return the cached model list, fetching it only when there is none yet"""
+        with self.lock:
+            models = self.models
+            age = time.monotonic() - self.models_fetched_at
+
+        if models is None:
+            return self.fetch_models()
+
+        if age > self.models_ttl:
+            # Serve the stale list now and refresh it for the next caller
+            self.refresh_models_async()
+        return models
+
+    def refresh_models_async(self):
+        """Refresh the model list on a background thread"""
+        with self.lock:
+            if self.refresh_thread is not None and self.refresh_thread.is_alive():
+                return
+            self.refresh_thread = threading.Thread(
+                target=self.refresh_models_quietly,
+                name="OllamaModelRefresh",
+                daemon=True
+            )
+            self.refresh_thread.start()
+
+    def refresh_models_quietly(self):
+        """Refresh the model list, keeping the old one if Ollama is unreachable"""
+        try:
+            self.fetch_models()
+        except Exception:
+            pass
+
+    def invalidate_models(self):
+        """Forget the cached model list"""
+        with self.lock:
+            self.models = None
+            self.models_fetched_at = 0.0
+
+    def check_model(self, model_name):
+        """Check if the specified model is available in Ollama"""
+        try:
+            available_models = self.list_models()
+            if not self.find_model(model_name, available_models):
+                # The model may have been pulled since the list was cached
+                available_models = self.fetch_models()
+
+            if self.find_model(model_name, available_models):
+                return True, None
+
+            # Model not found
+            if available_models:
+                models_list = "\n  - ".join(available_models)
+                error_msg = (
+                    f"Model '{model_name}' is not available in Ollama.\n\n"
+                    f"Available models:\n  - {models_list}\n\n"
+                    f"To pull a model, run in terminal:\n"
+                    f"  ollama pull {model_name}"
+                )
+            else:
+                error_msg = (
+                    f"Model '{model_name}' is not available in Ollama.\n\n"
+                    f"No models found. To pull a model, run in terminal:\n"
+                    f"  ollama pull {model_name}"
+                )
+
+            return False, error_msg
+
+        except requests.exceptions.ConnectionError:
+            self.invalidate_models()
+            error_msg = (
+                "Cannot connect to Ollama.\n\n"
+                f"Make sure Ollama is running on {self.base_url}"
+            )
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"Error checking Ollama models: {str(e)}"
+            return False, error_msg
+
+    def find_model(self, model_name, available_models):
+        """Return True if model_name matches one of the available models"""
+        # Ollama models can have tags like "llava:latest"
+        for available_model in available_models:
+            if model_name in available_model or available_model.startswith(model_name + ":"):
+                return True
+        return False
+
+    def generate(self, payload, stream=True, timeout=(CONNECT_TIMEOUT, 1200)):
+        """POST a request to /api/generate over the pooled session
+
+        The read timeout bounds the wait for the first chunk, once the
+        response streams a read is unblocked by closing it.
+        """
+        return self.session.post(
+            self.url("/api/generate"),
+            json=payload,
+            stream=stream,
+            timeout=timeout
+        )
+
+    def stream_chunks(self, response):
+        """Yield the JSON chunks of a streamed response up to the final one
+
+        Malformed lines are skipped, the last chunk yielded has done set.
+        """
+        for line in response.iter_lines():
+            if not line:
+                continue
+            try:
+                chunk = json.loads(line.decode("utf-8"))
+            except json.JSONDecodeError:
+                # Skip malformed JSON lines
+                continue
+            yield chunk
+            if chunk.get("done", False):
+                return
+
+    def read_generation(self, response, on_token=None, sql_extractor=None, on_sql=None,
+                        stop_at_sql=False, is_interrupted=None):
+        """Read a streamed /api/generate response to its end
+
+        on_token is called with each piece of text as it arrives. A
+        sql_extractor is fed the text and on_sql called with the SQL block
+        once it is complete; with stop_at_sql reading ends there. Returns the
+        text, the final chunk ({} if the stream was cut short) and whether it
+        stopped at the SQL block.
+        """
+        parts = []
+        for chunk in self.stream_chunks(response):
+            if is_interrupted and is_interrupted():
+                break
+
+            text = chunk.get("response")
+            if text:
+                parts.append(text)
+                if on_token:
+                    on_token(text)
+
+                sql = sql_extractor.feed(text) if sql_extractor else None
+                if sql is not None:
+                    if on_sql:
+                        on_sql(sql)
+                    if stop_at_sql:
+                        return "".join(parts), {}, True
+
+            if chunk.get("done", False):
+                return "".join(parts), chunk, False
+        return "".join(parts), {}, False
+
+    def warm_up(self, model_name, keep_alive, options=None, timeout=WARM_UP_TIMEOUT):
+        """Load a model into memory with an empty-prompt generate request
+
+        Returns the wall-clock time the request took and the load_duration
+        reported by Ollama, both in seconds. A load that outlasts the read
+        timeout raises requests.exceptions.ReadTimeout but carries on in
+        Ollama.
+        """
+        payload = {
+            "model": model_name,
+            "prompt": "",
+            "keep_alive": keep_alive,
+            "stream": False
+        }
+        # Ollama reloads a model whose options differ, so warm it up with
+        # the same options the prompts will use
+        if options:
+            payload["options"] = options
+
+        start = time.perf_counter()
+        response = self.session.post(self.url("/api/generate"), json=payload, timeout=timeout)
+        response.raise_for_status()
+        elapsed = time.perf_counter() - start
+
+        data = response.json()
+        load_duration = data.get("load_duration", 0) / 1e9
+        return elapsed, load_duration
+
+    def embed(self, model_name, inputs, timeout=EMBED_TIMEOUT):
+        """Return one embedding vector per input text
+
+        Uses the batched /api/embed endpoint and falls back to the older
+        single-prompt /api/embeddings endpoint on servers that lack it.
+        """
+        response = self.session.post(
+            self.url("/api/embed"),
+            json={"model": model_name, "input": list(inputs)},
+            timeout=timeout
+        )
+        if response.status_code != 404:
+            response.raise_for_status()
+            return response.json()["embeddings"]
+
+        vectors = []
+        for text in inputs:
+            response = self.session.post(
+                self.url("/api/embeddings"),
+                json={"model": model_name, "prompt": text},
+                timeout=timeout
+            )
+            response.raise_for_status()
+            vectors.append(response.json()["embedding"])
+        return vectors
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
@@ -0,0 +1,553 @@
+from qgis.PyQt.QtCore import QThread, pyqtSignal
+from qgis.core import Qgis
+import requests
+import hashlib
+import time
+
+from .instrumentation import Trace, ollama_metrics
+from .sql_execution import (StreamingResult, MaterializedResult, count_query, execute_batch,
+                            execute_statement, is_query_cancelled, set_statement_timeout)
+
+
+class OllamaGenerateWorker(QThread):
+    """Run the model check, schema assembly and streaming request off the GUI thread
+
+    All results are reported back through signals so the plugin can update its
+    widgets from the GUI thread while QGIS stays responsive. Only a stream
+    that ends with its done chunk is reported as finished; one that stopped
+    at the SQL block, was stopped or was cut off is reported as interrupted,
+    with the reason "sql", "stopped" or "cut off".
+    """
+
+    status_message = pyqtSignal(str, object)
+    model_unavailable = pyqtSignal(str)
+    first_token = pyqtSignal(float)
+    token_received = pyqtSignal(str)
+    sql_ready = pyqtSignal(str)
+    generation_finished = pyqtSignal(str, object)
+    generation_interrupted = pyqtSignal(str, str)
+    generation_failed = pyqtSignal(str)
+
+    def __init__(self, client, model_name, prompt, image_data=None, model_checker=None,
+                 schema_provider=None, keep_alive=None, options=None, context=None,
+                 context_key=None, trace=None, sql_extractor=None, stop_at_sql=False,
+                 response_format=None, parent=None):
+        super().__init__(parent)
+        self.client = client
+        # Trace the stages of this prompt are timed into
+        self.trace = trace if trace is not None else Trace("prompt")
+        # Reports the SQL block as soon as it is complete, and optionally
+        # ends the generation there
+        self.sql_extractor = sql_extractor
+        self.stop_at_sql = stop_at_sql
+        # "json" or a JSON schema the answer must follow, sent as format
+        self.response_format = response_format
+        self.model_name = model_name
+        self.keep_alive = keep_alive
+        self.options = options
+        # Token context returned by the previous response of the conversation,
+        # only reused when context_key matches the model and schema of this run
+        self.context = context
+        self.context_key = context_key
+        self.prompt = prompt
+        self.image_data = image_data
+        self.model_checker = model_checker
+        self.schema_provider = schema_provider
+        self.response = None
+
+    def stop(self):
+        """Ask the worker to stop and unblock any pending read on the response"""
+        self.requestInterruption()
+        response = self.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def run(self):
+        """Worker entry point, executed on the background thread"""
+        try:
+            # Check if the model is available
+            if self.model_checker:
+                self.status_message.emit(
+                    f"Checking if model '{self.model_name}' is available...",
+                    Qgis.Info
+                )
+                with self.trace.span("model_check"):
+                    is_available, error_msg = self.model_checker(self.model_name)
+                if not is_available:
+                    self.model_unavailable.emit(error_msg)
+                    return
+
+            if self.isInterruptionRequested():
+                return
+
+            self.status_message.emit("Preparing request...", Qgis.Info)
+
+            # Add database schema context if enabled
+            full_prompt = self.prompt
+            schema_context = ""
+            if self.schema_provider:
+                try:
+                    with self.trace.span("schema"):
+                        schema_context = self.schema_provider(self.status_message.emit)
+                except Exception as e:
+                    self.status_message.emit(
+                        f"Failed to fetch database schema: {str(e)}",
+                        Qgis.Warning
+                    )
+                    schema_context = ""
+
+            # The previous context already holds this schema if the key still matches
+            context_key = (
+                self.model_name,
+                hashlib.sha1(schema_context.encode("utf-8")).hexdigest()
+            )
+            reuse_context = bool(self.context) and context_key == self.context_key
+            self.context_key = context_key
+
+            if reuse_context:
+                self.status_message.emit(
+                    "Continuing conversation, schema already evaluated by the model...",
+                    Qgis.Info
+                )
+            elif self.schema_provider:
+                if schema_context:
+                    full_prompt = schema_context + self.prompt
+                    self.status_message.emit("Including database schema in request...", Qgis.Info)
+                else:
+                    self.status_message.emit("No layers available for schema", Qgis.Warning)
+
+            # Build the payload
+            payload = {
+                "model": self.model_name,
+                "prompt": full_prompt,
+                "stream": True
+            }
+            if self.keep_alive:
+                payload["keep_alive"] = self.keep_alive
+            if self.options:
+                payload["options"] = self.options
+            if self.response_format:
+                payload["format"] = self.response_format
+            if reuse_context:
+                payload["context"] = self.context
+
+            # Add image if attached
+            if self.image_data:
+                payload["images"] = [self.image_data]
+                self.status_message.emit("Sending request with image to Ollama...", Qgis.Info)
+            else:
+                self.status_message.emit("Sending request to Ollama...", Qgis.Info)
+
+            # Make the API request over the pooled session
+            request_start = time.perf_counter()
+            self.response = self.client.generate(payload)
+
+            # Check if request was successful
+            self.response.raise_for_status()
+
+            self.status_message.emit("Receiving response from Ollama...", Qgis.Info)
+
+            first_token_seen = []
+
+            def on_token(text):
+                if not first_token_seen:
+                    first_token_seen.append(True)
+                    seconds = time.perf_counter() - request_start
+                    self.trace.add_span("first_token", seconds)
+                    self.first_token.emit(seconds)
+                self.token_received.emit(text)
+
+            # Process streaming response
+            text, final_chunk, stopped_at_sql = self.client.read_generation(
+                self.response,
+                on_token=on_token,
+                sql_extractor=self.sql_extractor,
+                on_sql=self.sql_ready.emit,
+                stop_at_sql=self.stop_at_sql,
+                is_interrupted=self.isInterruptionRequested
+            )
+            self.trace.add_span("generation", time.perf_counter() - request_start)
+            if final_chunk.get("done", False):
+                self.trace.set(ollama=ollama_metrics(final_chunk))
+                self.generation_finished.emit(text, final_chunk)
+            elif stopped_at_sql:
+                # The explanation after the SQL was not generated
+                self.trace.set(stopped_at_sql=True, outcome="stopped at SQL")
+                self.generation_interrupted.emit(text, "sql")
+            elif self.isInterruptionRequested():
+                self.trace.set(outcome="stopped")
+                self.generation_interrupted.emit(text, "stopped")
+            else:
+                self.trace.set(outcome="cut off")
+                self.generation_interrupted.emit(text, "cut off")
+
+        except requests.exceptions.ConnectionError:
+            if not self.isInterruptionRequested():
+                self.generation_failed.emit(
+                    f"Cannot connect to Ollama. Make sure Ollama is running on {self.client.base_url}"
+                )
+
+        except requests.exceptions.Timeout:
+            self.generation_failed.emit(
+                "Request timed out. The model might be taking too long to respond."
+            )
+
+        except requests.exceptions.HTTPError as e:
+            self.generation_failed.emit(
+                f"HTTP Error: {e.response.status_code} - {e.response.reason}"
+            )
+
+        except Exception as e:
+            if not self.isInterruptionRequested():
+                self.generation_failed.emit(f"Unexpected error: {str(e)}")
+
+        finally:
+            if self.response is not None:
+                self.response.close()
+                self.response = None
+
+
+class ModelWarmupWorker(QThread):
+    """Load a model in Ollama in the background so the first prompt starts warm"""
+
+    warmed = pyqtSignal(str, float, float)
+    warmup_failed = pyqtSignal(str, str)
+
+    def __init__(self, client, model_name, keep_alive, options=None, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.model_name = model_name
+        self.keep_alive = keep_alive
+        self.options = options
+
+    def run(self):
+        """Worker entry point, executed on the background thread"""
+        try:
+            elapsed, load_duration = self.client.warm_up(
+                self.model_name,
+                self.keep_alive,
+                self.options
+            )
+            self.warmed.emit(self.model_name, elapsed, load_duration)
+        except requests.exceptions.ReadTimeout:
+            self.warmup_failed.emit(self.model_name, "still loading, Ollama finishes it in the background")
+        except requests.exceptions.ConnectionError:
+            self.warmup_failed.emit(self.model_name, "Ollama is not running")
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 404:
+                self.warmup_failed.emit(self.model_name, "model not pulled")
+            else:
+                self.warmup_failed.emit(
+                    self.model_name,
+                    f"HTTP Error: {e.response.status_code} - {e.response.reason}"
+                )
+        except Exception as e:
+            self.warmup_failed.emit(self.model_name, str(e))
+
+
+class SchemaIndexWorker(QThread):
+    """Embed the tables of a catalog snapshot for relevance-ranked retrieval"""
+
+    progress = pyqtSignal(int, int)
+    indexed = pyqtSignal(int)
+    index_failed = pyqtSignal(str)
+
+    def __init__(self, retriever, connection_key, catalog, model_name, parent=None):
+        super().__init__(parent)
+        self.retriever = retriever
+        self.connection_key = connection_key
+        self.catalog = catalog
+        self.model_name = model_name
+
+    def cancel(self):
+        """Stop after the batch being embedded, the index is left unchanged"""
+        self.requestInterruption()
+
+    def report_progress(self, done, total):
+        """Forward embedding progress, aborting the build once cancelled"""
+        if self.isInterruptionRequested():
+            raise Exception("Schema indexing cancelled")
+        self.progress.emit(done, total)
+
+    def run(self):
+        """Worker entry point, executed on the background thread"""
+        try:
+            self.retriever.build(
+                self.connection_key,
+                self.catalog,
+                self.model_name,
+                progress=self.report_progress
+            )
+            self.indexed.emit(len(self.catalog))
+        except requests.exceptions.ConnectionError:
+            self.index_failed.emit("Ollama is not running")
+        except requests.exceptions.HTTPError as e:
+            self.index_failed.emit(
+                f"HTTP Error: {e.response.status_code} - {e.response.reason}"
+            )
+        except Exception as e:
+            if not self.isInterruptionRequested():
+                self.index_failed.emit(str(e))
+
+
+class SqlExecutionWorker(QThread):
+    """Run a SQL statement off the GUI thread so it can be cancelled
+
+    Read-only statements are opened as a StreamingResult, others are executed
+    and committed, and a list of statements runs as a batch. Every statement
+    runs with a transaction-local statement_timeout; cancel() interrupts it
+    on the server.
+    """
+
+    progress = pyqtSignal(str)
+    execution_finished = pyqtSignal(object)
+    batch_finished = pyqtSignal(object)
+    execution_failed = pyqtSignal(str)
+    execution_cancelled = pyqtSignal()
+
+    def __init__(self, connection, sql, statement_timeout=0, stream=False, batch_size=2000,
+                 statements=None, batch_mode="transaction", parent=None):
+        super().__init__(parent)
+        self.connection = connection
+        self.sql = sql
+        self.statements = statements
+        self.batch_mode = batch_mode
+        self.statement_timeout = statement_timeout
+        self.stream = stream
+        self.batch_size = batch_size
+        self.cancelled = False
+
+    def cancel(self):
+        """Ask the server to cancel the running statement"""
+        self.cancelled = True
+        try:
+            self.connection.cancel()
+        except Exception:
+            pass
+
+    def run(self):
+        """Worker entry point, executed on the background thread"""
+        try:
+            set_statement_timeout(self.connection, self.statement_timeout)
+            if self.cancelled:
+                self.connection.rollback()
+                self.execution_cancelled.emit()
+                return
+
+            if self.statements:
+                results = execute_batch(
+                    self.connection,
+                    self.statements,
+                    self.batch_mode,
+                    progress=self.progress.emit,
+                    is_cancelled=lambda: self.cancelled
+                )
+                self.batch_finished.emit(results)
+                return
+
+            if self.stream:
+                self.progress.emit("Planning query")
+                result = StreamingResult(
+                    self.connection,
+                    self.sql,
+                    self.batch_size,
+                    progress=self.progress.emit
+                )
+            else:
+                self.progress.emit("Running statement")
+                rows, description = execute_statement(self.connection, self.sql)
+                result = MaterializedResult(description, rows) if rows else None
+
+            # A committed statement cannot be cancelled any more, but a
+            # result that is still being read can be dropped
+            if self.cancelled and self.stream:
+                result.close()
+                self.execution_cancelled.emit()
+                return
+            self.execution_finished.emit(result)
+        except Exception as e:
+            try:
+                self.connection.rollback()
+            except Exception:
+                pass
+            if self.cancelled:
+                self.execution_cancelled.emit()
+            elif is_query_cancelled(e):
+                self.execution_failed.emit(
+                    f"Query cancelled after reaching the statement timeout of {self.statement_timeout} s"
+                )
+            else:
+                self.execution_failed.emit(f"PostgreSQL Error: {str(e)}")
+
+
+class LayerQueryWorker(QThread):
+    """Run a SQL statement on the data source of a layer off the GUI thread
+
+    execute is called as execute(watch) on the background thread and returns
+    (rows, cursor description); the rows are reported as a MaterializedResult,
+    or None for statements that return no rows. A database connection passed
+    to watch has its running statement interrupted by cancel(), OGR files
+    can not be interrupted and their result is dropped once it is read.
+    """
+
+    progress = pyqtSignal(str)
+    execution_finished = pyqtSignal(object)
+    execution_failed = pyqtSignal(str)
+    execution_cancelled = pyqtSignal()
+
+    def __init__(self, execute, sql, parent=None):
+        super().__init__(parent)
+        self.execute = execute
+        self.sql = sql
+        self.connection = None
+        self.cancelled = False
+
+    def watch(self, connection):
+        """Interrupt the statement running on connection when the worker is cancelled"""
+        self.connection = connection
+        if self.cancelled:
+            self.cancel()
+
+    def cancel(self):
+        """Interrupt the running statement, or drop its result"""
+        self.cancelled = True
+        connection = self.connection
+        if connection is not None:
+            try:
+                # sqlite3 connections are interrupted, psycopg2 ones cancelled on the server
+                interrupt = getattr(connection, 'interrupt', None) or connection.cancel
+                interrupt()
+            except Exception:
+                pass
+
+    def run(self):
+        """Worker entry point, executed on the background thread"""
+        try:
+            self.progress.emit("Running statement")
+            try:
+                rows, description = self.execute(self.watch)
+            finally:
+                # The pooled connection serves other statements from now on
+                self.connection = None
+            if self.cancelled:
+                self.execution_cancelled.emit()
+                return
+            result = MaterializedResult(description, rows) if rows is not None else None
+            self.execution_finished.emit(result)
+        except Exception as e:
+            if self.cancelled:
+                self.execution_cancelled.emit()
+            else:
+                self.execution_failed.emit(str(e))
+
+
+class RowCountWorker(QThread):
+    """Count the rows of a query with SELECT count(*) off the GUI thread
+
+    connect is called on the background thread and returns a connection of
+    the worker's own, which is closed when the count is done.
+    """
+
+    counted = pyqtSignal(str, int)
+    count_failed = pyqtSignal(str)
+
+    def __init__(self, connect, sql, statement_timeout=0, parent=None):
+        super().__init__(parent)
+        self.connect = connect
+        self.sql = sql
+        self.statement_timeout = statement_timeout
+        self.connection = None
+        self.cancelled = False
+
+    def cancel(self):
+        """Ask the server to cancel the count"""
+        self.cancelled = True
+        connection = self.connection
+        if connection is not None:
+            try:
+                connection.cancel()
+            except Exception:
+                pass
+
+    def run(self):
+        """Worker entry point, executed on the background thread"""
+        try:
+            self.connection = self.connect()
+            if self.cancelled:
+                return
+            set_statement_timeout(self.connection, self.statement_timeout)
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(count_query(self.sql))
+                count = cursor.fetchone()[0]
+            finally:
+                cursor.close()
+            self.connection.rollback()
+            self.counted.emit(self.sql, count)
+        except Exception as e:
+            if self.cancelled:
+                return
+            if is_query_cancelled(e):
+                self.count_failed.emit(
+                    f"Count cancelled after reaching the statement timeout of {self.statement_timeout} s"
+                )
+            else:
+                self.count_failed.emit(f"PostgreSQL Error: {str(e)}")
+        finally:
+            if self.connection is not None:
+                try:
+                    self.connection.close()
+                except Exception:
+                    pass
+
+
+class ExportWorker(QThread):
+    """Write a query result to a file off the GUI thread
+
+    export is called as export(progress, is_cancelled, watch) on the
+    background thread and returns a short summary of what was written. An
+    export that queries a connection passes it to watch, so cancel() can
+    interrupt the statement on the server.
+    """
+
+    progress = pyqtSignal(str)
+    exported = pyqtSignal(str, str)
+    export_failed = pyqtSignal(str)
+    export_cancelled = pyqtSignal()
+
+    def __init__(self, export, path, parent=None):
+        super().__init__(parent)
+        self.export = export
+        self.path = path
+        self.connection = None
+        self.cancelled = False
+
+    def watch(self, connection):
+        """Cancel the statement running on connection when the export is cancelled"""
+        self.connection = connection
+        if self.cancelled:
+            self.cancel()
+
+    def cancel(self):
+        """Stop the export at the next chunk, cancelling a running query"""
+        self.cancelled = True
+        connection = self.connection
+        if connection is not None:
+            try:
+                connection.cancel()
+            except Exception:
+                pass
+
+    def run(self):
+        """Worker entry point, executed on the background thread"""
+        try:
+            summary = self.export(self.progress.emit, lambda: self.cancelled, self.watch)
+            self.exported.emit(self.path, summary)
+        except Exception as e:
+            if self.cancelled:
+                self.export_cancelled.emit()
+            else:
+                self.export_failed.emit(str(e))
@@ -0,0 +1,162 @@
+import json
+import re
+
+from .sql_execution import METADATA_TIMEOUT, set_statement_timeout, strip_leading_noise
+
+
+# Statements PostgreSQL can EXPLAIN without running them
+EXPLAINABLE_PATTERN = re.compile(
+    r'^(SELECT|WITH|VALUES|TABLE|INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE
+)
+
+PREVIEW_LIMIT = 100
+
+# Plan nodes that can return a row more than once or rows of no relation
+ROW_ADDING_NODES = ("Append", "Merge Append", "Recursive Union", "Function Scan",
+                    "Table Function Scan", "ProjectSet", "CTE Scan", "WorkTable Scan")
+JOIN_NODES = ("Nested Loop", "Hash Join", "Merge Join")
+FILTERING_JOIN_TYPES = ("Semi", "Anti", "Right Semi", "Right Anti")
+
+RELATION_SIZE_QUERY = """
+    SELECT t.schema_name, t.relation_name, c.reltuples::bigint
+    FROM unnest(%s::text[], %s::text[]) AS t(schema_name, relation_name)
+    LEFT JOIN pg_catalog.pg_class c
+        ON c.oid = to_regclass(format('%%I.%%I', t.schema_name, t.relation_name))
+"""
+
+
+def is_explainable_sql(sql):
+    """Return True for a statement that EXPLAIN accepts"""
+    return bool(EXPLAINABLE_PATTERN.match(strip_leading_noise(sql)))
+
+
+def preview_sql(sql, limit=PREVIEW_LIMIT):
+    """Wrap a read-only query so it returns at most limit rows"""
+    body = sql.strip().rstrip(';')
+    return f"SELECT * FROM ({body}\n) AS preview LIMIT {int(limit)}"
+
+
+class QueryPlan:
+    """Estimates of a query plan: total cost, rows and sequential scans"""
+
+    def __init__(self, total_cost, plan_rows, seq_scans):
+        self.total_cost = total_cost
+        self.plan_rows = plan_rows
+        # (schema, relation, estimated rows in the relation) per Seq Scan node
+        self.seq_scans = seq_scans
+
+    def summary(self):
+        """One line description of the estimates"""
+        text = f"estimated cost {self.total_cost:,.0f}, about {self.plan_rows:,} rows"
+        if self.seq_scans:
+            text += f", {len(self.seq_scans)} sequential scan(s)"
+        return text
+
+    def large_seq_scans(self, min_rows):
+        """Sequential scans of relations with at least min_rows rows"""
+        return [scan for scan in self.seq_scans if scan[2] is not None and scan[2] >= min_rows]
+
+
+def walk_plan(node):
+    """Yield a plan node and all the nodes below it"""
+    yield node
+    for child in node.get("Plans", []):
+        for descendant in walk_plan(child):
+            yield descendant
+
+
+def row_source_relations(node):
+    """Return the relations whose rows a plan returns, None if it may repeat or add rows
+
+    Joins, set operations, set-returning functions and CTE scans can return
+    a row of a relation more than once or return rows of no relation, so
+    they give None. Semi and anti joins (EXISTS, IN) only filter their
+    outer side, and subplans only compute values, so neither counts.
+    """
+    node_type = node.get("Node Type")
+    if node_type in ROW_ADDING_NODES:
+        return None
+    children = [
+        child for child in node.get("Plans", [])
+        if child.get("Parent Relationship") not in ("SubPlan", "InitPlan")
+    ]
+    if node_type in JOIN_NODES:
+        join_type = node.get("Join Type")
+        if join_type not in FILTERING_JOIN_TYPES:
+            return None
+        # A right semi or anti join returns the rows of its inner side
+        kept = 1 if join_type.startswith("Right") else 0
+        children = children[kept:kept + 1]
+
+    relations = [node["Relation Name"]] if node.get("Relation Name") else []
+    for child in children:
+        child_relations = row_source_relations(child)
+        if child_relations is None:
+            return None
+        relations.extend(child_relations)
+    return relations
+
+
+def explain_query(connection, sql, timeout=METADATA_TIMEOUT):
+    """Plan a statement with EXPLAIN (FORMAT JSON) without executing it
+
+    Relation sizes of sequentially scanned tables come from pg_class, as
+    the plan only has the rows expected after filtering. Planning is
+    cancelled after timeout seconds.
+    """
+    body = sql.strip().rstrip(';')
+    cursor = connection.cursor()
+    try:
+        set_statement_timeout(connection, timeout)
+        cursor.execute(f"EXPLAIN (FORMAT JSON, VERBOSE) {body}")
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]["Plan"]
+
+        scanned = []
+        for node in walk_plan(root):
+            if node.get("Node Type") == "Seq Scan" and node.get("Relation Name"):
+                scanned.append((node.get("Schema", "public"), node["Relation Name"]))
+
+        seq_scans = []
+        if scanned:
+            cursor.execute(
+                RELATION_SIZE_QUERY,
+                ([schema for schema, _ in scanned], [name for _, name in scanned])
+            )
+            seq_scans = [tuple(row) for row in cursor.fetchall()]
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return QueryPlan(float(root.get("Total Cost", 0)), int(root.get("Plan Rows", 0)), seq_scans)
+
+
+def check_plan(plan, warn_cost, block_cost, seq_scan_rows):
+    """Compare a plan with the guard thresholds, 0 disables a threshold
+
+    Returns "block", "warn" or "ok" and the reasons as a list of strings.
+    """
+    reasons = []
+    level = "ok"
+    if block_cost and plan.total_cost >= block_cost:
+        level = "block"
+        reasons.append(
+            f"Estimated cost {plan.total_cost:,.0f} is above the limit of {block_cost:,.0f}"
+        )
+    elif warn_cost and plan.total_cost >= warn_cost:
+        level = "warn"
+        reasons.append(
+            f"Estimated cost {plan.total_cost:,.0f} is above the warning level of {warn_cost:,.0f}"
+        )
+
+    if seq_scan_rows:
+        for schema, relation, rows in plan.large_seq_scans(seq_scan_rows):
+            if level == "ok":
+                level = "warn"
+            reasons.append(f"Sequential scan of {schema}.{relation} (about {rows:,} rows)")
+    return level, reasons
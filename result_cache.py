@@ -0,0 +1,116 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from .sql_execution import MaterializedResult, mask_literals
+
+
+# Quoted literals and identifiers are kept as they are, whitespace and
+# comments elsewhere do not change what a statement returns
+SQL_TOKEN_PATTERN = re.compile(
+    r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|\$((?:[A-Za-z_]\w*)?)\$.*?\$\2\$)"""
+    r"""|((?:\s+|--[^\n]*|/\*.*?\*/)+)""",
+    re.DOTALL
+)
+
+# Functions whose result changes from one call to the next, a query that
+# calls one must run again instead of being answered from the cache
+VOLATILE_FUNCTION_PATTERN = re.compile(
+    r"""\b(now|random|setseed|nextval|currval|lastval|setval|clock_timestamp|"""
+    r"""statement_timestamp|transaction_timestamp|timeofday|gen_random_uuid|"""
+    r"""uuid_generate_v[1-4]|txid_current|pg_current_xact_id|pg_sleep)\s*\("""
+    r"""|\b(current_timestamp|current_time|current_date|localtime|localtimestamp)\b""",
+    re.IGNORECASE
+)
+
+
+def is_cacheable_sql(sql):
+    """Return False if sql calls a known volatile function such as now() or random()
+
+    Names inside string literals, quoted identifiers and comments do not count.
+    """
+    return not VOLATILE_FUNCTION_PATTERN.search(mask_literals(sql))
+
+
+def normalize_sql(sql):
+    """Return sql with comments removed and whitespace collapsed outside literals"""
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        return " "
+    return SQL_TOKEN_PATTERN.sub(replace, sql or "").strip().rstrip(';').strip()
+
+
+def estimate_rows_size(rows):
+    """Approximate the memory used by a list of row tuples, in bytes"""
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row:
+            size += sys.getsizeof(value)
+    return size
+
+
+class ResultCache:
+    """LRU cache of read-only query results per connection
+
+    Entries are keyed by the connection and the normalized SQL, expire after
+    ttl seconds and are evicted least recently used first once they take
+    more than max_bytes. Any statement that writes through the plugin drops
+    the entries of its connection, since it may change what they return.
+    Queries that call volatile functions are never cached.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, connection_key, sql):
+        """Return a MaterializedResult of a cached query, or None"""
+        if self.ttl <= 0 or not is_cacheable_sql(sql):
+            return None
+        key = (connection_key, normalize_sql(sql))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            description, rows, size, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self.drop(key)
+                return None
+            self.entries.move_to_end(key)
+        return MaterializedResult(description, rows)
+
+    def put(self, connection_key, sql, description, rows):
+        """Cache the rows of a query, unless they alone exceed max_bytes"""
+        if self.ttl <= 0 or not is_cacheable_sql(sql):
+            return
+        rows = list(rows)
+        size = estimate_rows_size(rows)
+        if size > self.max_bytes:
+            return
+        key = (connection_key, normalize_sql(sql))
+        with self.lock:
+            if key in self.entries:
+                self.drop(key)
+            self.entries[key] = (description, rows, size, time.monotonic())
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self.drop(next(iter(self.entries)))
+
+    def invalidate(self, connection_key=None):
+        """Drop the cached results of one connection, or all of them"""
+        with self.lock:
+            for key in list(self.entries):
+                if connection_key is None or key[0] == connection_key:
+                    self.drop(key)
+
+    def drop(self, key):
+        """Remove an entry, the lock must be held"""
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry[2]
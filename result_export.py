@@ -0,0 +1,326 @@
+import csv
+import json
+import os
+
+from qgis.core import (QgsVectorFileWriter, QgsFeature, QgsField, QgsFields, QgsWkbTypes,
+                       QgsCoordinateReferenceSystem, QgsCoordinateTransformContext)
+
+from .result_layer import GEOMETRY_COLUMN_NAMES, GEOMETRY_TYPE_NAMES, field_type, parse_geometry
+from .schema_catalog import quote_ident
+
+
+EXPORT_FORMATS = [
+    ("csv", "CSV (*.csv)"),
+    ("geojsonseq", "GeoJSON sequence (*.geojsons *.geojsonl)"),
+    ("gpkg", "GeoPackage (*.gpkg)"),
+]
+
+# Rows read per batch when exporting rows that are not streamed by COPY
+EXPORT_BATCH_SIZE = 5000
+
+# Files SQLite may leave next to a GeoPackage that was being written
+SQLITE_SIDECAR_SUFFIXES = ("-journal", "-wal", "-shm")
+
+# COPY in CSV format with quote and delimiter characters that never occur in
+# JSON text, so each value is written verbatim on a line of its own
+COPY_VERBATIM_OPTIONS = "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+
+
+class ExportCancelled(Exception):
+    """Raised to stop an export that was cancelled"""
+
+
+def export_format_for_filter(name_filter, path):
+    """Return the export format of a file dialog filter, or from the file extension"""
+    for export_format, format_filter in EXPORT_FORMATS:
+        if name_filter == format_filter:
+            return export_format
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".gpkg":
+        return "gpkg"
+    if extension in (".geojsons", ".geojsonl", ".geojsonseq"):
+        return "geojsonseq"
+    return "csv"
+
+
+def pg_connection_string(host, port, database, user, password):
+    """Return an OGR PG: connection string for the connection parameters"""
+    parts = []
+    for key, value in (("host", host), ("port", port), ("dbname", database),
+                       ("user", user), ("password", password)):
+        if value:
+            escaped = str(value).replace("\\", "\\\\").replace("'", "\\'")
+            parts.append(f"{key}='{escaped}'")
+    return "PG:" + " ".join(parts)
+
+
+def remove_partial_file(path):
+    """Delete what a failed or cancelled export left at path"""
+    for suffix in ("",) + SQLITE_SIDECAR_SUFFIXES:
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+
+
+class ProgressFile:
+    """Binary file wrapper that reports the bytes written and can be cancelled"""
+
+    def __init__(self, file, progress=None, is_cancelled=None, report_every=8 * 1024 * 1024):
+        self.file = file
+        self.progress = progress
+        self.is_cancelled = is_cancelled
+        self.report_every = report_every
+        self.written = 0
+        self.reported = 0
+
+    def write(self, data):
+        if self.is_cancelled and self.is_cancelled():
+            raise ExportCancelled()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.file.write(data)
+        self.written += len(data)
+        if self.progress and self.written - self.reported >= self.report_every:
+            self.reported = self.written
+            self.progress(f"{self.written / (1024 * 1024):.0f} MB written")
+        return len(data)
+
+
+def geojson_feature_query(sql, columns):
+    """Wrap a query so it returns one GeoJSON Feature per row as text
+
+    The first geometry or geography column becomes the feature geometry,
+    transformed to WGS 84 as GeoJSON requires, and every other column a
+    property.
+    """
+    body = sql.strip().rstrip(';')
+    geometry_column, geometry_type = next(
+        ((name, type_name) for name, type_name in columns if type_name in GEOMETRY_TYPE_NAMES),
+        (None, None)
+    )
+    if geometry_column is None:
+        geometry = "NULL"
+        properties = "to_jsonb(q.*)"
+    else:
+        column = "q." + quote_ident(geometry_column)
+        if geometry_type == 'geography':
+            # ST_Transform only takes geometry
+            column += "::geometry"
+        geometry = (
+            f"ST_AsGeoJSON(CASE WHEN ST_SRID({column}) IN (0, 4326) THEN {column} "
+            f"ELSE ST_Transform({column}, 4326) END)::json"
+        )
+        properties = "to_jsonb(q.*) - '" + geometry_column.replace("'", "''") + "'"
+    return (
+        f"SELECT json_build_object('type', 'Feature', 'geometry', {geometry}, "
+        f"'properties', {properties})::text FROM ({body}\n) AS q"
+    )
+
+
+def copy_query_to_file(connection, sql, path, export_format, columns=None,
+                       progress=None, is_cancelled=None):
+    """Stream the rows of a query to a CSV or GeoJSON sequence file with COPY
+
+    Rows go from the server straight to disk as COPY sends them, so memory
+    use does not depend on the size of the result. Returns the bytes written,
+    a failed or cancelled export leaves no file behind.
+    """
+    body = sql.strip().rstrip(';')
+    if export_format == "csv":
+        copy_sql = f"COPY ({body}\n) TO STDOUT WITH (FORMAT csv, HEADER true)"
+    else:
+        copy_sql = f"COPY ({geojson_feature_query(body, columns or [])}) TO STDOUT WITH ({COPY_VERBATIM_OPTIONS})"
+
+    cursor = connection.cursor()
+    try:
+        with open(path, "wb") as file:
+            target = ProgressFile(file, progress, is_cancelled)
+            cursor.copy_expert(copy_sql, target)
+        connection.commit()
+        return target.written
+    except Exception:
+        connection.rollback()
+        remove_partial_file(path)
+        raise
+    finally:
+        cursor.close()
+
+
+def translate_query_to_gpkg(connection_string, sql, path, layer_name="result",
+                            progress=None, is_cancelled=None):
+    """Write the rows of a PostgreSQL query to a GeoPackage with GDAL
+
+    The OGR PostgreSQL driver reads the query through a cursor in batches
+    and GDAL writes features as they arrive. GDAL errors are read from the
+    return values, so the exception mode of the QGIS process is left alone.
+    """
+    from osgeo import gdal
+
+    def callback(complete, message, data):
+        if is_cancelled and is_cancelled():
+            return 0
+        return 1
+
+    source = gdal.OpenEx(connection_string, gdal.OF_VECTOR)
+    if source is None:
+        raise Exception(f"GDAL could not connect to the database: {gdal.GetLastErrorMsg()}")
+    try:
+        gdal.ErrorReset()
+        result = gdal.VectorTranslate(
+            path,
+            source,
+            format="GPKG",
+            SQLStatement=sql.strip().rstrip(';'),
+            layerName=layer_name,
+            accessMode="overwrite",
+            callback=callback
+        )
+        if result is None:
+            if is_cancelled and is_cancelled():
+                raise ExportCancelled()
+            raise Exception(f"GDAL could not write the GeoPackage: {gdal.GetLastErrorMsg()}")
+        result = None
+    except Exception:
+        # GDAL keeps the files open until the datasets are released
+        source = None
+        remove_partial_file(path)
+        raise
+    finally:
+        source = None
+    if progress:
+        progress(f"{os.path.getsize(path) / (1024 * 1024):.0f} MB written")
+    return os.path.getsize(path)
+
+
+def iter_batches(rows, size=EXPORT_BATCH_SIZE):
+    """Group an iterable of rows into lists of at most size rows"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_rows(path, export_format, columns, rows, progress=None, is_cancelled=None):
+    """Write rows from any source to a file, one batch in memory at a time
+
+    Used for results that are not a PostgreSQL query, such as SQLite or OGR
+    sources. Returns the number of rows written, a failed or cancelled export
+    leaves no file behind.
+    """
+    try:
+        if export_format == "gpkg":
+            return write_rows_to_gpkg(path, columns, rows, progress, is_cancelled)
+        return write_rows_to_text(path, export_format, columns, rows, progress, is_cancelled)
+    except Exception:
+        remove_partial_file(path)
+        raise
+
+
+def write_rows_to_text(path, export_format, columns, rows, progress=None, is_cancelled=None):
+    """Write rows to a CSV or GeoJSON sequence file"""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file) if export_format == "csv" else None
+        if writer:
+            writer.writerow(columns)
+        for batch in iter_batches(rows):
+            if is_cancelled and is_cancelled():
+                raise ExportCancelled()
+            for row in batch:
+                if writer:
+                    writer.writerow(["" if value is None else value for value in row])
+                else:
+                    file.write(json.dumps(row_to_feature(columns, row), default=str) + "\n")
+            count += len(batch)
+            if progress:
+                progress(f"{count} rows written")
+    return count
+
+
+def row_to_feature(columns, row):
+    """Convert a result row to a GeoJSON Feature dict"""
+    geometry = None
+    properties = {}
+    for name, value in zip(columns, row):
+        if geometry is None and name.lower() in GEOMETRY_COLUMN_NAMES:
+            parsed, _ = parse_geometry(value)
+            if parsed is not None:
+                geometry = json.loads(parsed.asJson())
+                continue
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = bytes(value).hex()
+        properties[name] = value
+    return {"type": "Feature", "geometry": geometry, "properties": properties}
+
+
+def write_rows_to_gpkg(path, columns, rows, progress=None, is_cancelled=None):
+    """Write rows to a GeoPackage layer with QgsVectorFileWriter"""
+    batches = iter_batches(rows)
+    first = next(batches, [])
+
+    # Field types and the geometry column are taken from the first batch
+    geometry_index = None
+    geometry_type = QgsWkbTypes.NoGeometry
+    crs = QgsCoordinateReferenceSystem()
+    for index, name in enumerate(columns):
+        if name.lower() not in GEOMETRY_COLUMN_NAMES:
+            continue
+        sample = next((row[index] for row in first if row[index] is not None), None)
+        geometry, srid = parse_geometry(sample)
+        if geometry is not None:
+            geometry_index = index
+            geometry_type = QgsWkbTypes.multiType(geometry.wkbType())
+            if srid:
+                crs = QgsCoordinateReferenceSystem(f"EPSG:{srid}")
+            break
+
+    attribute_indexes = [index for index in range(len(columns)) if index != geometry_index]
+    fields = QgsFields()
+    for index in attribute_indexes:
+        fields.append(QgsField(columns[index], field_type(row[index] for row in first)))
+
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "GPKG"
+    options.layerName = "result"
+    writer = QgsVectorFileWriter.create(
+        path, fields, geometry_type, crs, QgsCoordinateTransformContext(), options
+    )
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise Exception(writer.errorMessage())
+
+    count = 0
+    try:
+        for batch in chain_batches(first, batches):
+            if is_cancelled and is_cancelled():
+                raise ExportCancelled()
+            for row in batch:
+                feature = QgsFeature(fields)
+                feature.setAttributes([
+                    value if not isinstance(value, (bytes, bytearray, memoryview)) else bytes(value).hex()
+                    for value in (row[index] for index in attribute_indexes)
+                ])
+                if geometry_index is not None:
+                    geometry, _ = parse_geometry(row[geometry_index])
+                    if geometry is not None:
+                        geometry.convertToMultiType()
+                        feature.setGeometry(geometry)
+                writer.addFeature(feature)
+            count += len(batch)
+            if progress:
+                progress(f"{count} rows written")
+    finally:
+        del writer
+    return count
+
+
+def chain_batches(first, batches):
+    """Yield the first batch again, then the remaining batches"""
+    if first:
+        yield first
+    for batch in batches:
+        yield batch
@@ -0,0 +1,257 @@
+import json
+import struct
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsVectorLayer, QgsFeature, QgsField, QgsGeometry, QgsWkbTypes,
+                       QgsCoordinateReferenceSystem)
+
+from .query_guard import row_source_relations
+from .sql_execution import METADATA_TIMEOUT, set_statement_timeout
+
+
+GEOMETRY_TYPE_NAMES = ('geometry', 'geography')
+
+# Single-column, non-partial unique indexes on NOT NULL integer columns of
+# the given tables, as (table oid, column number)
+UNIQUE_INTEGER_COLUMNS_QUERY = """
+    SELECT i.indrelid::bigint, i.indkey[0]
+    FROM pg_catalog.pg_index i
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+    WHERE i.indrelid = ANY(%s::oid[])
+      AND i.indisunique AND i.indnatts = 1
+      AND i.indpred IS NULL AND i.indexprs IS NULL
+      AND a.attnotnull
+      AND a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)
+"""
+
+# Feature id column added to a query layer whose query has no unique key
+ROW_NUMBER_COLUMN = "row_number"
+
+# Columns whose values are tried as geometry first when loading rows
+GEOMETRY_COLUMN_NAMES = ('geom', 'geometry', 'the_geom', 'wkb_geometry', 'shape', 'geog')
+
+# EWKB flag marking a 4 byte SRID after the geometry type
+EWKB_SRID_FLAG = 0x20000000
+
+# Envelope size in bytes of a GeoPackage geometry blob, by envelope indicator
+GPKG_ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+
+def describe_query(connection, sql, timeout=METADATA_TIMEOUT):
+    """Return the (column name, type name) pairs of a query without running it
+
+    The lookup is cancelled after timeout seconds.
+    """
+    body = sql.strip().rstrip(';')
+    cursor = connection.cursor()
+    try:
+        set_statement_timeout(connection, timeout)
+        cursor.execute(f"SELECT * FROM ({body}\n) AS q LIMIT 0")
+        columns = [(column[0], column[1]) for column in cursor.description]
+        cursor.execute(
+            "SELECT oid, typname FROM pg_catalog.pg_type WHERE oid = ANY(%s)",
+            (list(set(type_code for _, type_code in columns)),)
+        )
+        type_names = dict(cursor.fetchall())
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    return [(name, type_names.get(type_code, "")) for name, type_code in columns]
+
+
+def unique_key_column(connection, sql, timeout=METADATA_TIMEOUT):
+    """Return a column of a query that can serve as feature id, or None
+
+    Only an integer column read straight from a table where it is NOT NULL
+    and has a single-column unique index, such as a primary key, qualifies.
+    Computed columns have no source table and never do. The query plan must
+    also read that one table without adding rows: a join, UNION ALL or
+    set-returning function can repeat the column's values. The lookup is
+    cancelled after timeout seconds.
+    """
+    body = sql.strip().rstrip(';')
+    cursor = connection.cursor()
+    try:
+        set_statement_timeout(connection, timeout)
+        cursor.execute(f"SELECT * FROM ({body}\n) AS q LIMIT 0")
+        sources = [
+            (column[0], getattr(column, 'table_oid', None), getattr(column, 'table_column', None))
+            for column in cursor.description
+        ]
+        tables = list(set(table for _, table, _ in sources if table))
+        unique_columns = set()
+        if tables:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {body}")
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            relations = row_source_relations(plan[0]["Plan"])
+            if relations is None or len(relations) != 1:
+                tables = []
+        if tables:
+            cursor.execute(UNIQUE_INTEGER_COLUMNS_QUERY, (tables,))
+            unique_columns = set(cursor.fetchall())
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    # The provider addresses the key by name, a repeated name is ambiguous
+    names = [name for name, _, _ in sources]
+    return next(
+        (name for name, table, number in sources
+         if (table, number) in unique_columns and names.count(name) == 1),
+        None
+    )
+
+
+def set_query_data_source(uri, sql, columns, key_column):
+    """Point a postgres QgsDataSourceUri at a query instead of a table
+
+    The first geometry or geography column becomes the layer geometry and
+    key_column, a column unique_key_column found, the feature id. Without a
+    key_column the rows are numbered with row_number() OVER (), an id that
+    is only stable as long as the query returns its rows in the same order.
+    """
+    body = sql.strip().rstrip(';')
+    geometry_column = next(
+        (name for name, type_name in columns if type_name in GEOMETRY_TYPE_NAMES), ''
+    )
+    if key_column is None:
+        names = set(name for name, _ in columns)
+        key_column = ROW_NUMBER_COLUMN
+        while key_column in names:
+            key_column = f"_{key_column}"
+        body = f"SELECT row_number() OVER () AS {key_column}, q.* FROM ({body}\n) AS q"
+
+    uri.setDataSource('', f"({body}\n)", geometry_column, '', key_column)
+    # Skip the full scan the provider would otherwise run for geometry type and extent
+    uri.setUseEstimatedMetadata(True)
+    return uri
+
+
+def parse_geometry(value):
+    """Return (QgsGeometry, srid) for a WKB, EWKB, GeoPackage or WKT value
+
+    Returns (None, None) if the value is not a geometry.
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, QgsGeometry):
+        return value, None
+
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            data = bytes.fromhex(text)
+        except ValueError:
+            geometry = QgsGeometry.fromWkt(text)
+            return (geometry, None) if not geometry.isNull() else (None, None)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
+    else:
+        return None, None
+
+    srid = None
+    if data[:2] == b'GP' and len(data) >= 8:
+        # GeoPackage blob: magic, version, flags, srid and an optional envelope
+        flags = data[3]
+        little_endian = '<' if flags & 1 else '>'
+        srid = struct.unpack(little_endian + 'i', data[4:8])[0]
+        data = data[8 + GPKG_ENVELOPE_SIZES.get((flags >> 1) & 7, 0):]
+
+    if len(data) < 5 or data[0] not in (0, 1):
+        return None, None
+    byte_order = '<' if data[0] == 1 else '>'
+    wkb_type = struct.unpack(byte_order + 'I', data[1:5])[0]
+    if wkb_type & EWKB_SRID_FLAG:
+        # PostGIS EWKB: drop the SRID so QGIS reads it as plain WKB
+        srid = struct.unpack(byte_order + 'i', data[5:9])[0]
+        wkb_type &= ~EWKB_SRID_FLAG
+        data = data[:1] + struct.pack(byte_order + 'I', wkb_type) + data[9:]
+
+    geometry = QgsGeometry()
+    geometry.fromWkb(data)
+    if geometry.isNull():
+        return None, None
+    return geometry, srid
+
+
+def field_type(values):
+    """Pick the QVariant type of a field from its non-null values"""
+    types = set(type(value) for value in values if value is not None)
+    if types and types <= {bool}:
+        return QVariant.Bool
+    if types and types <= {int}:
+        return QVariant.LongLong
+    if types and types <= {int, float}:
+        return QVariant.Double
+    return QVariant.String
+
+
+def create_memory_layer(name, columns, rows, crs=None):
+    """Load result rows into a memory layer with a spatial index
+
+    Meant for results that are already in memory, such as rows read from a
+    layer or returned by a write; PostgreSQL queries are added as query
+    layers instead. The geometry column is the first column whose values parse as geometry,
+    preferring the usual geometry column names. Returns the layer.
+    """
+    rows = list(rows)
+
+    geometry_index = None
+    srid = None
+    candidates = sorted(
+        range(len(columns)),
+        key=lambda index: columns[index].lower() not in GEOMETRY_COLUMN_NAMES
+    )
+    for index in candidates:
+        sample = next((row[index] for row in rows if row[index] is not None), None)
+        geometry, sample_srid = parse_geometry(sample)
+        if geometry is not None:
+            geometry_index = index
+            geometry_type = QgsWkbTypes.displayString(geometry.wkbType())
+            srid = sample_srid
+            break
+
+    if geometry_index is None:
+        layer_uri = "None?index=yes"
+    else:
+        layer_uri = f"{geometry_type}?index=yes"
+        if crs is None and srid:
+            crs = QgsCoordinateReferenceSystem(f"EPSG:{srid}")
+    layer = QgsVectorLayer(layer_uri, name, "memory")
+    if crs is not None and geometry_index is not None:
+        layer.setCrs(crs)
+
+    attribute_indexes = [index for index in range(len(columns)) if index != geometry_index]
+    fields = []
+    for index in attribute_indexes:
+        kind = field_type(row[index] for row in rows)
+        fields.append(QgsField(columns[index], kind))
+    provider = layer.dataProvider()
+    provider.addAttributes(fields)
+    layer.updateFields()
+
+    features = []
+    for row in rows:
+        feature = QgsFeature(layer.fields())
+        attributes = []
+        for index, field in zip(attribute_indexes, fields):
+            value = row[index]
+            if value is not None and field.type() == QVariant.String and not isinstance(value, str):
+                value = str(value)
+            attributes.append(value)
+        feature.setAttributes(attributes)
+        if geometry_index is not None:
+            geometry, _ = parse_geometry(row[geometry_index])
+            if geometry is not None:
+                feature.setGeometry(geometry)
+        features.append(feature)
+    provider.addFeatures(features)
+    layer.updateExtents()
+    return layer
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+
+from qgis.PyQt.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+
+# Longer cell values are cut in the grid and shown in full as a tooltip
+MAX_CELL_LENGTH = 200
+
+
+class LazyResultModel(QAbstractTableModel):
+    """Table model over a query result that fetches rows as the view scrolls
+
+    The view grows page_size rows at a time through canFetchMore/fetchMore.
+    Only max_pages pages of rows are kept in memory; a page that was dropped
+    is read again from the server-side cursor when it scrolls back into view,
+    so memory stays constant no matter how many rows the result has.
+    """
+
+    def __init__(self, result, page_size=500, max_pages=20, parent=None):
+        super().__init__(parent)
+        self.result = result
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.pages = OrderedDict()
+        self.columns = result.columns
+
+        # The first batch is already on the client, show it right away
+        first_batch = result.first_batch
+        self.loaded_rows = len(first_batch)
+        for start in range(0, min(len(first_batch), page_size * max_pages), page_size):
+            self.pages[start // page_size] = first_batch[start:start + page_size]
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.loaded_rows
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def total_rows(self):
+        """Total number of rows of the result, None if not known yet"""
+        return self.result.row_count
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        if self.result.row_count is not None:
+            return self.loaded_rows < self.result.row_count
+        return not self.result.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+
+        rows = self.get_page(self.loaded_rows // self.page_size)
+        available = (self.loaded_rows // self.page_size) * self.page_size + len(rows)
+        count = available - self.loaded_rows
+        if count <= 0:
+            self.result.exhausted = True
+            return
+
+        self.beginInsertRows(QModelIndex(), self.loaded_rows, self.loaded_rows + count - 1)
+        self.loaded_rows += count
+        self.endInsertRows()
+
+    def get_page(self, page):
+        """Return the rows of a page, reading it from the result if needed"""
+        rows = self.pages.get(page)
+        if rows is not None:
+            self.pages.move_to_end(page)
+            return rows
+
+        rows = self.result.fetch_range(page * self.page_size, self.page_size)
+        self.pages[page] = rows
+        while len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+        return rows
+
+    def get_row(self, row):
+        """Return a row as a tuple, or None if it is out of range"""
+        rows = self.get_page(row // self.page_size)
+        offset = row % self.page_size
+        if offset < len(rows):
+            return rows[offset]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+
+        row = self.get_row(index.row())
+        if row is None or index.column() >= len(row):
+            return None
+
+        value = row[index.column()]
+        if value is None:
+            return "NULL" if role == Qt.DisplayRole else None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return f"<binary, {len(value)} bytes>"
+
+        text = str(value)
+        if role == Qt.ToolTipRole:
+            return text if len(text) > MAX_CELL_LENGTH else None
+        if len(text) > MAX_CELL_LENGTH:
+            return text[:MAX_CELL_LENGTH] + "…"
+        return text
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            if section < len(self.columns):
+                return self.columns[section]
+            return None
+        return str(section + 1)
+
+    def close(self):
+        """Release the rows and the cursor of the result"""
+        self.beginResetModel()
+        self.pages.clear()
+        self.loaded_rows = 0
+        self.endResetModel()
+        self.result.close()
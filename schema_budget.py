@@ -0,0 +1,210 @@
+import re
+
+from .schema_catalog import (quote_ident, is_geometry_type, load_catalog, relations_need_quotes,
+                             render_schema_text)
+
+
+# Ollama reserves part of num_ctx for the answer, keep the schema out of it
+DEFAULT_RESPONSE_RESERVE = 1024
+
+# Lower-priority tables keep at most this many columns before being dropped
+SUMMARY_COLUMNS = 6
+
+TYPE_ABBREVIATIONS = [
+    ("character varying", "varchar"),
+    ("timestamp without time zone", "timestamp"),
+    ("timestamp with time zone", "timestamptz"),
+    ("time without time zone", "time"),
+    ("time with time zone", "timetz"),
+    ("double precision", "float8"),
+    ("character", "char"),
+    ("integer", "int"),
+    ("boolean", "bool"),
+    ("real", "float4"),
+]
+
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+
+def estimate_tokens(text):
+    """Estimate the number of model tokens in text
+
+    Words are counted as one token per four characters and punctuation as
+    one token each, which slightly overestimates typical BPE tokenizers on
+    SQL identifiers. Overestimating is the safe side for a budget.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        tokens += (len(match.group(0)) + 3) // 4
+    return tokens
+
+
+def abbreviate_type(type_name):
+    """Shorten a PostgreSQL type name, keeping modifiers such as (255)"""
+    for long_name, short_name in TYPE_ABBREVIATIONS:
+        if type_name == long_name or type_name.startswith(long_name + "(") \
+                or type_name.startswith(long_name + "["):
+            return short_name + type_name[len(long_name):]
+    return type_name
+
+
+def compact_table_line(relation, max_columns=None):
+    """Render a relation as a single DDL-like line: name(col type, ...)"""
+    columns = relation.columns
+    omitted = 0
+    if max_columns is not None and len(columns) > max_columns:
+        # Geometry columns are what spatial prompts need most, keep them
+        geometry = [column for column in columns if is_geometry_type(column[1])]
+        others = [column for column in columns if not is_geometry_type(column[1])]
+        kept = others[:max(0, max_columns - len(geometry))] + geometry
+        kept_names = set(name for name, _ in kept)
+        omitted = len(columns) - len(kept)
+        columns = [column for column in columns if column[0] in kept_names]
+
+    parts = [f"{quote_ident(name)} {abbreviate_type(type_name)}" for name, type_name in columns]
+    if omitted:
+        parts.append(f"+{omitted} more")
+
+    prefix = "" if relation.kind in ('r', 'p') else relation.kind_label.lower() + " "
+    return f"{prefix}{relation.sql_name}({', '.join(parts)})"
+
+
+def schema_budget(num_ctx, prompt, response_reserve=None, context_tokens=0):
+    """Return how many tokens of num_ctx the schema may use for this prompt
+
+    The prompt estimate is rounded up to a multiple of 256 tokens so prompts
+    of similar length get the same budget, and thus the same schema text.
+    context_tokens is the length of a context reused from earlier turns,
+    which Ollama places ahead of the prompt.
+    """
+    if response_reserve is None:
+        response_reserve = min(DEFAULT_RESPONSE_RESERVE, num_ctx // 4)
+    prompt_tokens = (estimate_tokens(prompt) // 256 + 1) * 256
+    return max(0, num_ctx - response_reserve - prompt_tokens - context_tokens)
+
+
+def fit_relations(relations, budget):
+    """Fit relations, highest priority first, into a token budget
+
+    Tables are kept in full while they fit. Lower-priority tables are then
+    summarised to their first columns, and whatever still does not fit is
+    listed by name only, or counted if even the names do not fit.
+    Returns the lines and a dict with the number of full, summarised and
+    omitted tables and the estimated tokens.
+    """
+    lines = []
+    used = 0
+    stats = {"full": 0, "summarized": 0, "omitted": 0, "tokens": 0}
+
+    # Keep room for the note about tables that do not fit
+    table_budget = budget - estimate_tokens(f"-- {len(relations)} more tables not shown")
+
+    position = 0
+    while position < len(relations):
+        relation = relations[position]
+        line = compact_table_line(relation)
+        cost = estimate_tokens(line) + 1
+        if used + cost > table_budget:
+            line = compact_table_line(relation, SUMMARY_COLUMNS)
+            cost = estimate_tokens(line) + 1
+            if used + cost > table_budget:
+                break
+            stats["summarized"] += 1
+        else:
+            stats["full"] += 1
+        lines.append(line)
+        used += cost
+        position += 1
+
+    remaining = relations[position:]
+    if remaining:
+        stats["omitted"] = len(remaining)
+        names = []
+        note_cost = estimate_tokens(f"-- {len(remaining)} more tables not shown: , ...")
+        for relation in remaining:
+            cost = estimate_tokens(relation.sql_name) + 1
+            if used + note_cost + cost > budget:
+                break
+            names.append(relation.sql_name)
+            note_cost += cost
+        if names:
+            note = f"-- {len(remaining)} more tables not shown: {', '.join(names)}"
+            if len(names) < len(remaining):
+                note += ", ..."
+        else:
+            note = f"-- {len(remaining)} more tables not shown"
+        lines.append(note)
+        used += estimate_tokens(note)
+
+    stats["tokens"] = used
+    return lines, stats
+
+
+def render_compact_schema_text(relations, db_name, budget, title):
+    """Render relations one line per table, trimmed to a token budget
+
+    With budget None every table is rendered in full.
+    """
+    if not relations:
+        return "", None
+
+    needs_quotes = relations_need_quotes(relations)
+
+    header = ["", "", "--- POSTGRESQL DATABASE SCHEMA ---", f"Database: {db_name}"]
+    if needs_quotes:
+        header.append("Double-quoted names are case-sensitive and MUST be written with the quotes shown.")
+    header.append(f"{title} ({len(relations)}), one per line as name(column type, ...):")
+    footer = [
+        "--- END DATABASE SCHEMA ---",
+        "",
+        "Based on the schema above, please help with the following request:",
+        "",
+        "",
+    ]
+
+    if budget is None:
+        lines = [compact_table_line(relation) for relation in relations]
+        return "\n".join(header + lines + footer), None
+
+    fixed = estimate_tokens("\n".join(header + footer))
+    lines, stats = fit_relations(relations, max(0, budget - fixed))
+
+    note = None
+    if stats["summarized"] or stats["omitted"]:
+        note = (
+            f"Schema trimmed to fit the context window: {stats['full']} tables in full, "
+            f"{stats['summarized']} summarized, {stats['omitted']} not shown"
+        )
+    return "\n".join(header + lines + footer), note
+
+
+def render_relations(relations, db_name, title, schema_format="compact", budget=None):
+    """Render relations in schema_format within a token budget
+
+    A requested verbose format is used as long as it fits, otherwise the
+    compact one-line-per-table format is trimmed to the budget. Without a
+    budget nothing is trimmed.
+    Returns the text and a note if tables had to be summarized or left out.
+    """
+    if schema_format == "verbose":
+        text = render_schema_text(relations, db_name, title=title)
+        if budget is None or estimate_tokens(text) <= budget:
+            return text, None
+    return render_compact_schema_text(relations, db_name, budget, title)
+
+
+def build_schema_text(cache, key, connection, db_name, selected_tables, schema_format="compact",
+                      budget=None):
+    """Return (schema text, note) for the given tables, all tables if empty
+
+    The text comes from cache, a SchemaCache, unless the catalog of the
+    connection has changed. Database errors are raised to the caller.
+    """
+    def load():
+        catalog = cache.get_catalog(key, connection, lambda: load_catalog(connection))
+        title = "Selected tables" if selected_tables else "All available tables"
+        return render_relations(catalog.select(selected_tables), db_name, title, schema_format, budget)
+
+    return cache.get(key, selected_tables, connection, load, variant=(schema_format, budget))
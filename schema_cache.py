@@ -0,0 +1,136 @@
+import re
+import threading
+import time
+
+
+# Cheap fingerprint of the catalog: any CREATE, ALTER or DROP of a relation or
+# column rewrites rows in pg_class/pg_attribute and moves their xmin forward.
+# Only the columns of the relations the schema context lists are read, through
+# the pg_attribute index on attrelid, never the attributes of system catalogs,
+# indexes or TOAST tables, which make up most of pg_attribute.
+CATALOG_VERSION_QUERY = r"""
+    WITH relations AS (
+        SELECT c.oid, c.xmin
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+            AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+            AND n.nspname NOT LIKE 'pg\_toast%'
+            AND n.nspname NOT LIKE 'pg\_temp\_%'
+    )
+    SELECT
+        (SELECT count(*) FROM relations),
+        (SELECT max(xmin::text::bigint) FROM relations),
+        (SELECT max(a.xmin::text::bigint)
+         FROM relations r
+         JOIN pg_catalog.pg_attribute a ON a.attrelid = r.oid AND a.attnum > 0)
+"""
+
+DDL_PATTERN = re.compile(r'^\s*(CREATE|ALTER|DROP|COMMENT|RENAME)\b', re.IGNORECASE | re.MULTILINE)
+
+
+def is_schema_changing_sql(sql):
+    """Return True if the SQL contains a statement that can change the schema"""
+    return bool(DDL_PATTERN.search(sql or ""))
+
+
+def catalog_version(connection):
+    """Return a small tuple that changes whenever the catalog changes"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(CATALOG_VERSION_QUERY)
+        return tuple(cursor.fetchone())
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+class SchemaCache:
+    """Cache of catalog snapshots and rendered schema text per connection
+
+    The catalog snapshot of a connection is loaded once and rendered schema
+    text is kept per selected table set. Entries are dropped explicitly when
+    the plugin runs DDL, and implicitly when the catalog fingerprint changes.
+    The fingerprint is checked at most once every check_interval seconds, so
+    repeated prompts against the same tables do not query the catalog at all.
+    """
+
+    def __init__(self, check_interval=60):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.catalogs = {}
+        self.versions = {}
+        self.checked_at = {}
+
+    def tables_key(self, selected_tables):
+        """Return a hashable, order-independent key for a table selection"""
+        return tuple(sorted(selected_tables)) if selected_tables else ()
+
+    def get(self, connection_key, selected_tables, connection, builder, variant=None):
+        """Return the cached schema text, building it with builder() on a miss
+
+        variant distinguishes renderings of the same tables, such as the
+        schema format and token budget.
+        """
+        self.validate(connection_key, connection)
+
+        key = (connection_key, self.tables_key(selected_tables), variant)
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+
+        text = builder()
+        with self.lock:
+            self.entries[key] = text
+        return text
+
+    def get_catalog(self, connection_key, connection, loader):
+        """Return the cached catalog snapshot, loading it with loader() on a miss"""
+        self.validate(connection_key, connection)
+
+        with self.lock:
+            if connection_key in self.catalogs:
+                return self.catalogs[connection_key]
+
+        catalog = loader()
+        with self.lock:
+            self.catalogs[connection_key] = catalog
+        return catalog
+
+    def validate(self, connection_key, connection):
+        """Drop the entries of a connection if its catalog has changed"""
+        now = time.monotonic()
+        with self.lock:
+            checked_at = self.checked_at.get(connection_key)
+            if checked_at is not None and now - checked_at < self.check_interval:
+                return
+            # Claim the check so concurrent callers do not repeat it
+            self.checked_at[connection_key] = now
+
+        version = catalog_version(connection)
+        with self.lock:
+            if self.versions.get(connection_key) != version:
+                self.drop_entries(connection_key)
+                self.versions[connection_key] = version
+
+    def invalidate(self, connection_key=None):
+        """Forget cached schema text for one connection, or for all of them"""
+        with self.lock:
+            if connection_key is None:
+                self.entries.clear()
+                self.catalogs.clear()
+                self.versions.clear()
+                self.checked_at.clear()
+            else:
+                self.drop_entries(connection_key)
+                self.versions.pop(connection_key, None)
+                self.checked_at.pop(connection_key, None)
+
+    def drop_entries(self, connection_key):
+        """Remove all entries of a connection, the lock must be held"""
+        self.catalogs.pop(connection_key, None)
+        for key in [key for key in self.entries if key[0] == connection_key]:
+            del self.entries[key]
@@ -0,0 +1,172 @@
+import re
+
+
+# One round trip for every relation of every user schema, with its columns
+# aggregated server side. format_type() also renders PostGIS typmods such as
+# geometry(Point,4326), so geometry columns need no extra lookup.
+CATALOG_QUERY = r"""
+    SELECT
+        n.nspname,
+        c.relname,
+        c.relkind,
+        coalesce(array_agg(a.attname::text ORDER BY a.attnum)
+                 FILTER (WHERE a.attnum IS NOT NULL), '{}'),
+        coalesce(array_agg(pg_catalog.format_type(a.atttypid, a.atttypmod) ORDER BY a.attnum)
+                 FILTER (WHERE a.attnum IS NOT NULL), '{}')
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_catalog.pg_attribute a
+        ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+        AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+        AND n.nspname NOT LIKE 'pg\_toast%'
+        AND n.nspname NOT LIKE 'pg\_temp\_%'
+    GROUP BY n.nspname, c.relname, c.relkind
+    ORDER BY n.nspname <> 'public', n.nspname, c.relname
+"""
+
+RELATION_KINDS = {
+    'r': "Table",
+    'p': "Table",
+    'v': "View",
+    'm': "Materialized view",
+    'f': "Foreign table",
+}
+
+SIMPLE_IDENTIFIER = re.compile(r'^[a-z_][a-z0-9_$]*$')
+
+
+def quote_ident(name):
+    """Quote an identifier if PostgreSQL would otherwise fold or reject it"""
+    if SIMPLE_IDENTIFIER.match(name):
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+
+def is_geometry_type(type_name):
+    """Return True for PostGIS geometry and geography column types"""
+    return type_name.startswith(("geometry", "geography"))
+
+
+class RelationInfo:
+    """A table, view, materialized view or foreign table with its columns"""
+
+    def __init__(self, schema, name, kind, columns):
+        self.schema = schema
+        self.name = name
+        self.kind = kind
+        self.columns = columns
+
+    @property
+    def display_name(self):
+        """Name shown in the table list, schema-qualified outside public"""
+        if self.schema == "public":
+            return self.name
+        return f"{self.schema}.{self.name}"
+
+    @property
+    def sql_name(self):
+        """Name to use in SQL, quoted where needed"""
+        if self.schema == "public":
+            return quote_ident(self.name)
+        return f"{quote_ident(self.schema)}.{quote_ident(self.name)}"
+
+    @property
+    def kind_label(self):
+        """Human readable relation kind"""
+        return RELATION_KINDS.get(self.kind, "Table")
+
+    @property
+    def geometry_columns(self):
+        """Names of the geometry and geography columns"""
+        return [name for name, type_name in self.columns if is_geometry_type(type_name)]
+
+
+class CatalogSnapshot:
+    """All user relations of a database, keyed by display name"""
+
+    def __init__(self, relations):
+        self.relations = {relation.display_name: relation for relation in relations}
+
+    def __len__(self):
+        return len(self.relations)
+
+    def select(self, selected_tables=None):
+        """Return the selected relations in list order, or all of them"""
+        if not selected_tables:
+            return list(self.relations.values())
+        return [self.relations[name] for name in selected_tables if name in self.relations]
+
+
+def load_catalog(connection):
+    """Load every relation and its columns from pg_catalog in one query"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(CATALOG_QUERY)
+        rows = cursor.fetchall()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    relations = []
+    for schema, name, kind, column_names, column_types in rows:
+        relations.append(RelationInfo(schema, name, kind, list(zip(column_names, column_types))))
+    return CatalogSnapshot(relations)
+
+
+def relations_need_quotes(relations):
+    """Return True if any schema, relation or column name must be quoted"""
+    return any(
+        quote_ident(relation.schema) != relation.schema
+        or quote_ident(relation.name) != relation.name
+        or any(quote_ident(column) != column for column, _ in relation.columns)
+        for relation in relations
+    )
+
+
+def render_schema_text(relations, db_name, selected=False, title=None):
+    """Render relations as the schema block that is put in front of the prompt"""
+    if not relations:
+        return ""
+
+    # Track identifiers that need quotes so the model gets the syntax rules
+    needs_quotes = relations_need_quotes(relations)
+
+    lines = ["", "", "--- POSTGRESQL DATABASE SCHEMA ---", f"Database: {db_name}", ""]
+
+    # Add SQL syntax rules if there are case-sensitive identifiers
+    if needs_quotes:
+        lines += [
+            "IMPORTANT SQL SYNTAX RULES:",
+            "- Column and table names with uppercase letters MUST be enclosed in double quotes",
+            "- Example: WHERE \"POPULATION\" > 10000 (NOT WHERE POPULATION > 10000)",
+            "- Example: SELECT \"CityName\", \"POPULATION\" FROM \"MyTable\"",
+            "- Column names shown with quotes below REQUIRE quotes in SQL queries",
+            "- Column names without quotes can be used without quotes",
+            "",
+        ]
+
+    if title:
+        lines += [f"{title} ({len(relations)}):", ""]
+    elif selected:
+        lines += [f"Selected tables ({len(relations)}):", ""]
+    else:
+        lines += [f"All available tables ({len(relations)}):", ""]
+
+    for relation in relations:
+        lines.append(f"{relation.kind_label}: {relation.sql_name}")
+        lines.append("Columns:")
+        for column, type_name in relation.columns:
+            lines.append(f"  - {quote_ident(column)} ({type_name})")
+        lines.append("")
+
+    lines += [
+        "--- END DATABASE SCHEMA ---",
+        "",
+        "Based on the schema above, please help with the following request:",
+        "",
+        "",
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,199 @@
+import hashlib
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Columns beyond this are left out of the signature to stay well inside the
+# context window of small embedding models
+MAX_SIGNATURE_COLUMNS = 60
+EMBED_BATCH_SIZE = 64
+
+
+class IndexNotReady(Exception):
+    """Raised when the index does not cover the current catalog yet"""
+
+
+def retrieval_available():
+    """Return True if NumPy is installed, which the index needs"""
+    return np is not None
+
+
+def table_signature(relation):
+    """Return the text that is embedded for a relation: its name and columns"""
+    columns = ", ".join(
+        f"{column} {type_name}"
+        for column, type_name in relation.columns[:MAX_SIGNATURE_COLUMNS]
+    )
+    return f"{relation.kind_label} {relation.display_name}: {columns}"
+
+
+class SchemaIndex:
+    """Embedding vectors of table signatures, persisted as a .npz file
+
+    Vectors are stored L2-normalised so a dot product with a normalised query
+    gives the cosine similarity. Each vector is stored with the digest of the
+    signature it was computed from, so only new or changed tables are
+    embedded again when the catalog changes.
+    """
+
+    def __init__(self, path, model_name):
+        self.path = path
+        self.model_name = model_name
+        self.lock = threading.Lock()
+        self.names = []
+        self.digests = []
+        self.vectors = None
+        self.catalog = None
+        self.load()
+
+    def load(self):
+        """Load the index from disk, starting empty if it is missing or stale"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["model"]) != self.model_name:
+                    return
+                self.names = [str(name) for name in data["names"]]
+                self.digests = [str(digest) for digest in data["digests"]]
+                self.vectors = data["vectors"].astype(np.float32)
+        except Exception:
+            # A corrupt index is rebuilt from scratch
+            self.names = []
+            self.digests = []
+            self.vectors = None
+
+    def save(self):
+        """Write the index to disk atomically"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            model=np.array(self.model_name),
+            names=np.array(self.names, dtype=str),
+            digests=np.array(self.digests, dtype=str),
+            vectors=self.vectors if self.vectors is not None else np.zeros((0, 0), np.float32)
+        )
+        os.replace(tmp_path, self.path)
+
+    def update(self, catalog, client, progress=None):
+        """Bring the index in line with a catalog snapshot, embedding what changed"""
+        with self.lock:
+            if catalog is self.catalog:
+                return
+
+            known = {}
+            if self.vectors is not None and len(self.names):
+                for i, (name, digest) in enumerate(zip(self.names, self.digests)):
+                    known[(name, digest)] = i
+
+            names = []
+            digests = []
+            rows = []
+            missing = []
+            for relation in catalog.relations.values():
+                signature = table_signature(relation)
+                digest = hashlib.sha1(signature.encode("utf-8")).hexdigest()
+                names.append(relation.display_name)
+                digests.append(digest)
+                index = known.get((relation.display_name, digest))
+                rows.append(index)
+                if index is None:
+                    missing.append((len(rows) - 1, signature))
+
+            new_vectors = {}
+            for start in range(0, len(missing), EMBED_BATCH_SIZE):
+                batch = missing[start:start + EMBED_BATCH_SIZE]
+                embeddings = client.embed(self.model_name, [signature for _, signature in batch])
+                for (position, _), vector in zip(batch, embeddings):
+                    new_vectors[position] = self.normalize(np.asarray(vector, dtype=np.float32))
+                if progress:
+                    progress(min(start + EMBED_BATCH_SIZE, len(missing)), len(missing))
+
+            if names:
+                vectors = [
+                    self.vectors[index] if index is not None else new_vectors[position]
+                    for position, index in enumerate(rows)
+                ]
+                self.vectors = np.vstack(vectors)
+            else:
+                self.vectors = None
+
+            changed = bool(missing) or names != self.names
+            self.names = names
+            self.digests = digests
+            self.catalog = catalog
+            if changed:
+                self.save()
+
+    def is_current(self, catalog):
+        """Return True if the index covers catalog, False while it is being updated"""
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            return catalog is self.catalog
+        finally:
+            self.lock.release()
+
+    def search(self, query_vector, top_k):
+        """Return the names of the top_k tables most similar to the query"""
+        with self.lock:
+            if self.vectors is None or not self.names:
+                return []
+            query = self.normalize(np.asarray(query_vector, dtype=np.float32))
+            scores = self.vectors @ query
+            top_k = min(top_k, len(self.names))
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best])]
+            return [self.names[i] for i in best]
+
+    def normalize(self, vector):
+        """Scale a vector to unit length"""
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SchemaRetriever:
+    """Pick the tables most relevant to a prompt from a large catalog"""
+
+    def __init__(self, client, index_dir):
+        self.client = client
+        self.index_dir = index_dir
+        self.lock = threading.Lock()
+        self.indexes = {}
+
+    def get_index(self, connection_key, model_name):
+        """Return the index for a connection and embedding model, loading it from disk"""
+        key = (connection_key, model_name)
+        with self.lock:
+            if key not in self.indexes:
+                digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+                path = os.path.join(self.index_dir, f"{digest}.npz")
+                self.indexes[key] = SchemaIndex(path, model_name)
+            return self.indexes[key]
+
+    def build(self, connection_key, catalog, model_name, progress=None):
+        """Embed every table of the catalog that is not indexed yet"""
+        self.get_index(connection_key, model_name).update(catalog, self.client, progress)
+
+    def is_ready(self, connection_key, catalog, model_name):
+        """Return True if the index of the connection covers catalog"""
+        return self.get_index(connection_key, model_name).is_current(catalog)
+
+    def rank(self, connection_key, catalog, model_name, prompt, top_k):
+        """Return the display names of the top_k tables for the prompt
+
+        Only the prompt is embedded here. Raises IndexNotReady if the index
+        does not cover catalog yet; build() brings it up to date, which can
+        take many embedding calls and is left to a background worker.
+        """
+        index = self.get_index(connection_key, model_name)
+        if not index.is_current(catalog):
+            raise IndexNotReady("The tables are not indexed yet")
+        query_vector = self.client.embed(model_name, [prompt])[0]
+        return index.search(query_vector, top_k)
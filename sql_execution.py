@@ -0,0 +1,482 @@
+import re
+import time
+import uuid
+
+
+READ_ONLY_PATTERN = re.compile(r'^(SELECT|WITH|VALUES|TABLE)\b', re.IGNORECASE)
+WRITING_PATTERN = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|INTO)\b', re.IGNORECASE)
+# Row-locking clauses, FOR UPDATE and FOR NO KEY UPDATE already match UPDATE
+LOCKING_PATTERN = re.compile(r'\bFOR\s+(KEY\s+)?SHARE\b', re.IGNORECASE)
+LEADING_NOISE = re.compile(r'^(\s+|--[^\n]*\n?|/\*.*?\*/|\()+', re.DOTALL)
+NO_RESULT_COMMANDS = ('CREATE', 'ALTER', 'DROP', 'INSERT', 'UPDATE', 'DELETE')
+RETURNING_PATTERN = re.compile(r'\bRETURNING\b', re.IGNORECASE)
+DOLLAR_QUOTE_PATTERN = re.compile(r'\$(?:[A-Za-z_]\w*)?\$')
+
+BATCH_SAVEPOINT = "ollama_chat_statement"
+
+# SQLSTATE of a statement cancelled by the client or by statement_timeout
+QUERY_CANCELED = '57014'
+
+# Seconds a plan or column lookup made on the GUI thread may take, so a slow
+# view can not freeze QGIS
+METADATA_TIMEOUT = 10
+
+
+def strip_leading_noise(sql):
+    """Remove leading whitespace, comments and parentheses from a statement"""
+    return LEADING_NOISE.sub('', sql or "")
+
+
+def mask_literals(sql):
+    """Blank out quoted literals and identifiers, dollar-quoted bodies and comments
+
+    The quote characters stay and everything between them becomes spaces,
+    as do comments, so keywords can be matched without hitting text inside
+    them. The result has the length of sql, positions in it are positions
+    in sql.
+    """
+    sql = sql or ""
+    masked = list(sql)
+    length = len(sql)
+
+    def blank(start, end):
+        for position in range(start, min(end, length)):
+            if masked[position] != "\n":
+                masked[position] = " "
+
+    i = 0
+    while i < length:
+        char = sql[i]
+        if char in ("'", '"'):
+            # E'...' strings escape quotes with a backslash as well as by doubling
+            backslash = char == "'" and i > 0 and sql[i - 1] in "eE" \
+                and (i == 1 or not (sql[i - 2].isalnum() or sql[i - 2] == '_'))
+            start = i + 1
+            i += 1
+            while i < length:
+                if backslash and sql[i] == "\\":
+                    i += 2
+                    continue
+                if sql[i] == char:
+                    if i + 1 < length and sql[i + 1] == char:
+                        i += 2
+                        continue
+                    break
+                i += 1
+            blank(start, i)
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            end = length if end == -1 else end
+            blank(i, end)
+            i = end
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            end = length if end == -1 else end + 2
+            blank(i, end)
+            i = end - 1
+        elif char == '$':
+            match = DOLLAR_QUOTE_PATTERN.match(sql, i)
+            if match and (i == 0 or not (sql[i - 1].isalnum() or sql[i - 1] == '_')):
+                end = sql.find(match.group(0), match.end())
+                blank(match.end(), length if end == -1 else end)
+                i = length if end == -1 else end + len(match.group(0)) - 1
+        i += 1
+    return "".join(masked)
+
+
+def is_read_only_sql(sql):
+    """Return True for a single row-returning statement that does not write
+
+    SELECT ... INTO, data-modifying CTEs and row-locking SELECT ... FOR
+    UPDATE/SHARE are not considered read-only: they create a table or take
+    locks, and PostgreSQL refuses locking clauses on a scrollable cursor.
+    Keywords inside string literals, quoted identifiers and comments do not
+    count.
+    """
+    body = mask_literals(strip_leading_noise(sql)).rstrip().rstrip(';')
+    if not READ_ONLY_PATTERN.match(body) or ';' in body:
+        return False
+    return not WRITING_PATTERN.search(body) and not LOCKING_PATTERN.search(body)
+
+
+def split_statements(sql):
+    """Split SQL text into its statements at semicolons
+
+    Semicolons inside quoted literals and identifiers, dollar-quoted bodies
+    and comments do not end a statement. Statements that are empty or only
+    comments are dropped.
+    """
+    sql = sql or ""
+    statements = []
+    start = 0
+    for position, char in enumerate(mask_literals(sql)):
+        if char == ';':
+            statements.append(sql[start:position])
+            start = position + 1
+    statements.append(sql[start:])
+    return [statement.strip() for statement in statements if strip_leading_noise(statement).strip()]
+
+
+def returns_no_rows(sql):
+    """Return True for DML and DDL that cannot return rows"""
+    body = strip_leading_noise(sql).upper()
+    return body.startswith(NO_RESULT_COMMANDS) and not RETURNING_PATTERN.search(mask_literals(body))
+
+
+def count_query(sql):
+    """Wrap a row-returning statement so it returns its number of rows"""
+    body = sql.strip().rstrip(';')
+    return f"SELECT count(*) FROM ({body}\n) AS q"
+
+
+def is_query_cancelled(error):
+    """Return True if a database error comes from a cancelled statement"""
+    return getattr(error, 'pgcode', None) == QUERY_CANCELED
+
+
+def set_statement_timeout(connection, seconds):
+    """Limit the statements of the current transaction to seconds, 0 for no limit
+
+    The setting is local to the transaction, so it ends with the next commit
+    or rollback and never leaks into later statements on the connection.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT pg_catalog.set_config('statement_timeout', %s, true)",
+            (str(int(seconds * 1000)),)
+        )
+    finally:
+        cursor.close()
+
+
+def execute_statement(connection, sql):
+    """Run a statement and commit it, returning (rows, cursor description)
+
+    rows is None for statements that do not return rows. The transaction is
+    rolled back if the statement fails.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql)
+        
+        # Try to fetch results only for statements that can return rows
+        rows = None
+        if not sql.strip().upper().startswith(NO_RESULT_COMMANDS) and cursor.description:
+            rows = cursor.fetchall()
+        description = cursor.description
+        connection.commit()
+        return rows, description
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+class StreamingResult:
+    """Rows of a query read lazily through a PostgreSQL server-side cursor
+
+    The query is declared as a scrollable named cursor, so rows stay on the
+    server and are transferred batch_size at a time. Only the first batch is
+    read up front, so the first rows show without running the query to its
+    end; row_count stays None until the last row has been read. progress, if
+    given, is called with a short description of each phase.
+    """
+
+    def __init__(self, connection, sql, batch_size=2000, progress=None):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.name = f"ollama_chat_{uuid.uuid4().hex}"
+        self.row_count = None
+
+        self.cursor = connection.cursor(name=self.name, scrollable=True)
+        self.cursor.itersize = batch_size
+        try:
+            self.cursor.execute(sql.strip().rstrip(';'))
+
+            # The column description is only known after the first fetch
+            if progress:
+                progress("Fetching the first rows")
+            self.first_batch = self.cursor.fetchmany(batch_size)
+            # position is where sequential reads continue, cursor_row is
+            # where the server-side cursor actually is
+            self.position = len(self.first_batch)
+            self.cursor_row = self.position
+            self.exhausted = len(self.first_batch) < batch_size
+            if self.exhausted:
+                self.row_count = len(self.first_batch)
+        except Exception:
+            self.close(commit=False)
+            raise
+
+    @property
+    def columns(self):
+        """Column names of the result"""
+        return [column[0] for column in self.cursor.description or []]
+
+    @property
+    def description(self):
+        """DB-API cursor description of the result"""
+        return self.cursor.description
+
+    def fetch(self, size=None):
+        """Return the next rows after those already read, [] at the end"""
+        if self.exhausted:
+            return []
+        size = size or self.batch_size
+        if self.cursor_row != self.position:
+            self.cursor.scroll(self.position, mode='absolute')
+        rows = self.cursor.fetchmany(size)
+        self.position += len(rows)
+        self.cursor_row = self.position
+        if len(rows) < size:
+            self.exhausted = True
+            if self.row_count is None:
+                self.row_count = self.position
+        return rows
+
+    def fetch_range(self, start, size):
+        """Return up to size rows starting at row index start
+
+        Scrolls the server-side cursor, so rows can be read again in any
+        order after the client has dropped them.
+        """
+        if start < len(self.first_batch):
+            rows = self.first_batch[start:start + size]
+            if len(rows) == size or self.exhausted:
+                return rows
+        if self.cursor_row != start:
+            self.cursor.scroll(start, mode='absolute')
+        rows = self.cursor.fetchmany(size)
+        self.cursor_row = start + len(rows)
+        if len(rows) < size and self.row_count is None:
+            self.row_count = self.cursor_row
+        return rows
+
+    def iter_rows(self):
+        """Yield every row of the result, one batch in memory at a time"""
+        for row in self.first_batch:
+            yield row
+        while True:
+            rows = self.fetch()
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    def close(self, commit=True):
+        """Close the cursor and end its transaction"""
+        if self.cursor is None:
+            return
+        try:
+            self.cursor.close()
+        except Exception:
+            pass
+        self.cursor = None
+        try:
+            if commit:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+
+
+class MaterializedResult:
+    """Rows that are already in memory, with the same interface as StreamingResult"""
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = list(rows)
+        self.row_count = len(self.rows)
+        self.first_batch = self.rows
+        self.exhausted = True
+
+    @property
+    def columns(self):
+        """Column names of the result"""
+        return [column[0] for column in self.description or []]
+
+    def fetch(self, size=None):
+        """All rows are in first_batch, there is never anything left to fetch"""
+        return []
+
+    def fetch_range(self, start, size):
+        """Return up to size rows starting at row index start"""
+        return self.rows[start:start + size]
+
+    def iter_rows(self):
+        """Yield every row of the result"""
+        return iter(self.rows)
+
+    def close(self, commit=True):
+        """Nothing to release"""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class StatementResult:
+    """Outcome of one statement of a batch"""
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.rows = None
+        self.description = None
+        self.rowcount = None
+        self.elapsed = None
+        self.error = None
+        self.skipped = False
+        self.rolled_back = False
+        # Number of statements sent in the same round trip as this one
+        self.round_trip = 1
+
+    @property
+    def columns(self):
+        """Column names of the rows returned by the statement"""
+        return [column[0] for column in self.description or []]
+
+    def describe(self):
+        """One line summary of the outcome"""
+        if self.skipped:
+            return "skipped"
+        if self.error:
+            return f"error: {self.error}"
+        if self.rows is not None:
+            text = f"{len(self.rows)} rows"
+        elif self.rowcount is not None and self.rowcount >= 0:
+            text = f"{self.rowcount} rows affected"
+        else:
+            text = "done"
+        if self.elapsed is not None:
+            if self.round_trip > 1:
+                text += f", {self.elapsed * 1000:.1f} ms for {self.round_trip} statements sent together"
+            else:
+                text += f", {self.elapsed * 1000:.1f} ms"
+        if self.rolled_back:
+            text += " (rolled back)"
+        return text
+
+
+def group_statements(statements, group_writes=True):
+    """Group consecutive statements that return no rows into single round trips"""
+    groups = []
+    for index, sql in enumerate(statements):
+        if group_writes and groups and returns_no_rows(sql) and returns_no_rows(statements[groups[-1][-1]]):
+            groups[-1].append(index)
+        else:
+            groups.append([index])
+    return groups
+
+
+def failed_statement(error, statements, group):
+    """Return the index of the statement of a group that raised error, or None
+
+    PostgreSQL reports the character position of many errors, which tells
+    which statement of a multi-statement round trip failed.
+    """
+    if len(group) == 1:
+        return group[0]
+    diag = getattr(error, 'diag', None)
+    position = getattr(diag, 'statement_position', None)
+    if not position:
+        return None
+    offset = 0
+    for index in group:
+        end = offset + len(statements[index]) + 2
+        if int(position) - 1 < end:
+            return index
+        offset = end
+    return None
+
+
+def execute_batch(connection, statements, mode="transaction", progress=None, is_cancelled=None):
+    """Run statements one after the other and report each of them
+
+    In "transaction" mode all statements run in one transaction that is
+    rolled back at the first error, and consecutive statements that return
+    no rows are sent in one round trip. In "savepoints" mode every statement
+    runs under a savepoint, so a failed statement is rolled back on its own
+    and the batch goes on. Returns a StatementResult per statement.
+    """
+    results = [StatementResult(sql) for sql in statements]
+    cursor = connection.cursor()
+    try:
+        if mode == "savepoints":
+            for index, result in enumerate(results):
+                if progress:
+                    progress(f"Statement {index + 1} of {len(results)}")
+                started = time.monotonic()
+                try:
+                    # The savepoint travels in the same round trip as the statement
+                    cursor.execute(f"SAVEPOINT {BATCH_SAVEPOINT}; {result.sql}")
+                except Exception as e:
+                    result.elapsed = time.monotonic() - started
+                    if is_cancelled and is_cancelled():
+                        raise
+                    result.error = str(e).strip()
+                    cursor.execute(f"ROLLBACK TO SAVEPOINT {BATCH_SAVEPOINT}")
+                    continue
+                result.elapsed = time.monotonic() - started
+                read_statement_result(cursor, result)
+        else:
+            for group in group_statements(statements):
+                if progress:
+                    progress(f"Statement {group[0] + 1} of {len(results)}")
+                started = time.monotonic()
+                try:
+                    cursor.execute(";\n".join(statements[index] for index in group))
+                except Exception as e:
+                    elapsed = time.monotonic() - started
+                    if is_cancelled and is_cancelled():
+                        raise
+                    connection.rollback()
+                    failed = failed_statement(e, statements, group)
+                    error = str(e).strip()
+                    if failed is None:
+                        error += f" (in one of statements {group[0] + 1}-{group[-1] + 1}, sent together)"
+                    for index, result in enumerate(results):
+                        if index < group[0]:
+                            result.rolled_back = True
+                        elif index in group and (failed is None or index == failed):
+                            result.error = error
+                            result.elapsed = elapsed
+                            result.round_trip = len(group)
+                        elif failed is not None and index in group and index < failed:
+                            result.rolled_back = True
+                        else:
+                            result.skipped = True
+                    return results
+                elapsed = time.monotonic() - started
+                for index in group:
+                    results[index].elapsed = elapsed
+                    results[index].round_trip = len(group)
+                # Only the last statement of a round trip reports its row count
+                read_statement_result(cursor, results[group[-1]])
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    return results
+
+
+def read_statement_result(cursor, result):
+    """Store the rows or row count of the statement the cursor just ran"""
+    if cursor.description is not None:
+        result.description = cursor.description
+        result.rows = cursor.fetchall()
+    else:
+        result.rowcount = cursor.rowcount
@@ -0,0 +1,159 @@
+import json
+import re
+
+
+# Opening fence of a SQL code block, the content runs to the next ```
+SQL_FENCE_PATTERN = re.compile(r'```[Ss][Qq][Ll]')
+SQL_BLOCK_PATTERN = re.compile(r'```[Ss][Qq][Ll]\s*\n?(.*?)```', re.DOTALL)
+FALLBACK_PATTERN = re.compile(
+    r'((?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)\s+.+?;)', re.DOTALL | re.IGNORECASE
+)
+FENCE = "```"
+
+# JSON schema passed as Ollama's format option in SQL only mode
+SQL_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sql": {"type": "string"},
+        "tables_used": {"type": "array", "items": {"type": "string"}},
+        "notes": {"type": "string"},
+    },
+    "required": ["sql", "tables_used", "notes"],
+}
+
+# Tokens a SQL only answer may use, the JSON object rarely needs more
+SQL_ONLY_NUM_PREDICT = 512
+
+# Newlines in JSON strings are escaped, so a run of blank lines can only be
+# padding after the object
+SQL_ONLY_STOP = ["\n\n\n"]
+
+SQL_ONLY_INSTRUCTIONS = (
+    "\n\nAnswer only with a JSON object: \"sql\" holds the complete SQL statement(s) "
+    "without code fences, \"tables_used\" the tables the SQL reads or writes, and "
+    "\"notes\" at most one short sentence, or an empty string."
+)
+
+SQL_VALUE_PATTERN = re.compile(r'"sql"\s*:\s*"((?:[^"\\]|\\.)*)"', re.DOTALL)
+
+
+def extract_sql_from_text(text):
+    """Extract SQL code from response text
+
+    Returns the first non-empty ```sql block, otherwise every statement
+    that looks like SQL, or None.
+    """
+    # Matches ```sql or ```SQL followed by any whitespace, then content, then ```
+    for match in SQL_BLOCK_PATTERN.findall(text):
+        if match.strip():
+            return match.strip()
+
+    # Fallback: look for SELECT, INSERT, UPDATE, DELETE, CREATE statements
+    fallback_matches = FALLBACK_PATTERN.findall(text)
+    if fallback_matches:
+        return '\n\n'.join(fallback_matches)
+
+    return None
+
+
+class IncrementalSqlExtractor:
+    """Find the first ```sql block of a response while it is streamed
+
+    Tokens are fed as they arrive and only the text that can still belong
+    to a fence or to the open block is kept, so the cost per token does not
+    grow with the length of the response. The block found is the one
+    extract_sql_from_text returns for the complete text.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget everything fed so far"""
+        self.buffer = ""
+        self.in_block = False
+        # Offset in the open block up to which no closing fence was found
+        self.scanned = 0
+        self.sql = None
+
+    def feed(self, text):
+        """Add streamed text, returns the SQL once its closing fence arrives
+
+        The SQL is returned by the call that completes the block only, later
+        calls return None.
+        """
+        if self.sql is not None or not text:
+            return None
+        self.buffer += text
+
+        while True:
+            if not self.in_block:
+                match = SQL_FENCE_PATTERN.search(self.buffer)
+                if match is None:
+                    # Keep what may be the start of a fence split across tokens
+                    self.buffer = self.buffer[-(len("```sql") - 1):]
+                    return None
+                self.buffer = self.buffer[match.end():]
+                self.in_block = True
+                self.scanned = 0
+
+            close = self.buffer.find(FENCE, self.scanned)
+            if close == -1:
+                self.scanned = max(0, len(self.buffer) - (len(FENCE) - 1))
+                return None
+
+            block = self.buffer[:close].strip()
+            self.buffer = self.buffer[close + len(FENCE):]
+            self.in_block = False
+            if block:
+                self.sql = block
+                return block
+
+
+def sql_only_prompt(prompt):
+    """Append the SQL only answer instructions to a prompt"""
+    return prompt + SQL_ONLY_INSTRUCTIONS
+
+
+def parse_sql_response(text):
+    """Parse a SQL only answer into a dict with sql, tables_used and notes
+
+    An answer cut off by num_predict still yields its SQL when the sql
+    string itself is complete. Returns None if no SQL can be found.
+    """
+    try:
+        data = json.loads(text, strict=False)
+    except ValueError:
+        match = SQL_VALUE_PATTERN.search(text)
+        if match is None:
+            return None
+        try:
+            data = {"sql": json.loads('"' + match.group(1) + '"', strict=False)}
+        except ValueError:
+            return None
+    if not isinstance(data, dict) or not isinstance(data.get("sql"), str):
+        return None
+
+    sql = data["sql"].strip()
+    # Some models wrap the SQL in a code fence anyway
+    if FENCE in sql:
+        sql = extract_sql_from_text(sql) or ""
+    if not sql:
+        return None
+
+    tables_used = data.get("tables_used")
+    return {
+        "sql": sql,
+        "tables_used": [str(table) for table in tables_used] if isinstance(tables_used, list) else [],
+        "notes": str(data.get("notes") or "").strip(),
+    }
+
+
+def format_sql_response(response):
+    """Readable text of a parsed SQL only answer for the Response tab"""
+    text = f"```sql\n{response['sql']}\n```"
+    if response["tables_used"]:
+        text += "\n\nTables used: " + ", ".join(response["tables_used"])
+    if response["notes"]:
+        text += "\n\n" + response["notes"]
+    return text
@@ -0,0 +1,150 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# Names mod_spatialite is found under on Linux, Windows and macOS builds of QGIS
+SPATIALITE_LIBRARIES = ("mod_spatialite", "mod_spatialite.so", "mod_spatialite.dll",
+                        "mod_spatialite.dylib")
+
+# Map the file into memory and keep a large page cache, so repeated queries
+# on a big GeoPackage read from memory instead of through read() calls
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+
+
+def sqlite_uri(path, read_only=False):
+    """Return the file: URI of a database, with mode=ro for read-only access"""
+    uri = Path(os.path.abspath(path)).as_uri()
+    return uri + "?mode=ro" if read_only else uri
+
+
+def load_spatialite(connection):
+    """Load mod_spatialite into a connection, returns True if it is available"""
+    try:
+        connection.enable_load_extension(True)
+    except AttributeError:
+        # Python was built without extension loading
+        return False
+    try:
+        for library in SPATIALITE_LIBRARIES:
+            try:
+                connection.load_extension(library)
+                return True
+            except sqlite3.OperationalError:
+                continue
+        return False
+    finally:
+        connection.enable_load_extension(False)
+
+
+def is_geopackage(connection):
+    """Return True if the database is a GeoPackage"""
+    row = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'gpkg_contents'"
+    ).fetchone()
+    return row is not None
+
+
+def connect_sqlite(path, read_only=False, wal=False):
+    """Open a tuned connection to a SQLite, SpatiaLite or GeoPackage file
+
+    Read-only connections use a mode=ro URI, so they never take a write
+    lock. With wal, connections that write switch the database to WAL, so
+    readers are not blocked while a statement writes; the mode is stored in
+    the file, which keeps -wal and -shm files next to it from then on.
+    mod_spatialite is loaded when it is available. In a GeoPackage its
+    amphibious mode is enabled, so ST_* functions accept GeoPackage
+    geometries and the R-tree triggers of spatial tables work on writes.
+    """
+    if read_only and not os.path.exists(path):
+        raise Exception(f"Database file not found: {path}")
+
+    connection = sqlite3.connect(sqlite_uri(path, read_only), uri=True, check_same_thread=False)
+    try:
+        connection.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        connection.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        if not read_only and wal:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+
+        if load_spatialite(connection) and is_geopackage(connection):
+            connection.execute("SELECT EnableGpkgAmphibiousMode()")
+    except Exception:
+        connection.close()
+        raise
+    return connection
+
+
+def quote_name(name):
+    """Quote a SQLite identifier"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def table_exists(connection, name):
+    """Return True if the main database has a table called name"""
+    row = connection.execute(
+        "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def rtree_index(connection, table):
+    """Return (R-tree table, id column, bound columns) of the spatial index of a table
+
+    GeoPackages list their R-trees in gpkg_extensions, SpatiaLite flags them
+    in geometry_columns. The bound columns are min x, max x, min y, max y.
+    Returns None if the table has no R-tree.
+    """
+    lookups = (
+        ("SELECT table_name, column_name FROM main.gpkg_extensions "
+         "WHERE extension_name = 'gpkg_rtree_index' AND lower(table_name) = lower(?)",
+         "rtree_{}_{}", "id", ("minx", "maxx", "miny", "maxy")),
+        ("SELECT f_table_name, f_geometry_column FROM main.geometry_columns "
+         "WHERE spatial_index_enabled = 1 AND lower(f_table_name) = lower(?)",
+         "idx_{}_{}", "pkid", ("xmin", "xmax", "ymin", "ymax")),
+    )
+    for query, name_format, id_column, bound_columns in lookups:
+        try:
+            row = connection.execute(query, (table,)).fetchone()
+        except sqlite3.Error:
+            # Not a GeoPackage, or not a SpatiaLite database
+            continue
+        if row is not None:
+            rtree = name_format.format(row[0], row[1])
+            if table_exists(connection, rtree):
+                return rtree, id_column, bound_columns
+    return None
+
+
+@contextmanager
+def rtree_extent(connection, table, bounds):
+    """Limit queries on table to the rows whose R-tree box meets bounds
+
+    table is shadowed by a temporary view of the same name that selects its
+    rows through the R-tree; unqualified names resolve to the temp schema
+    first, so the SQL itself is not rewritten. bounds is (xmin, ymin, xmax,
+    ymax). Yields True if the view was created, False if the table has no
+    R-tree, and drops the view on exit.
+    """
+    index = rtree_index(connection, table) if bounds else None
+    if index is None:
+        yield False
+        return
+
+    rtree, id_column, (minx, maxx, miny, maxy) = index
+    xmin, ymin, xmax, ymax = (float(value) for value in bounds)
+    name = quote_name(table)
+    # Views can not have parameters, the bounds are plain floats
+    connection.execute(
+        f"CREATE TEMP VIEW {name} AS SELECT * FROM main.{name} WHERE rowid IN ("
+        f"SELECT {id_column} FROM main.{quote_name(rtree)} "
+        f"WHERE {maxx} >= {xmin!r} AND {minx} <= {xmax!r} "
+        f"AND {maxy} >= {ymin!r} AND {miny} <= {ymax!r})"
+    )
+    try:
+        yield True
+    finally:
+        connection.execute(f"DROP VIEW IF EXISTS temp.{name}")
@@ -0,0 +1,76 @@
+import time
+
+from qgis.PyQt.QtCore import QTimer
+from qgis.PyQt.QtGui import QTextCursor
+
+
+class StreamRenderer:
+    """Append streamed text to a QTextEdit at a capped frame rate
+
+    Tokens are buffered and flushed at most max_fps times per second. Each
+    flush only inserts the new text at the end of the document, so the total
+    rendering cost grows linearly with the length of the response instead of
+    re-laying out the whole document for every token.
+    """
+
+    def __init__(self, text_edit, max_fps=30):
+        self.text_edit = text_edit
+        self.pending = []
+        self.parts = []
+        # Seconds spent inserting text since the last reset
+        self.render_time = 0.0
+        self.timer = QTimer()
+        self.timer.setInterval(max(1, int(1000 / max_fps)))
+        self.timer.timeout.connect(self.flush)
+
+    def reset(self):
+        """Drop any buffered text and start a new response"""
+        self.timer.stop()
+        self.pending = []
+        self.parts = []
+        self.render_time = 0.0
+
+    def append(self, text):
+        """Queue text for the next flush"""
+        if not text:
+            return
+        if not self.parts:
+            # The first token replaces any status placeholder in the widget
+            self.text_edit.clear()
+        self.pending.append(text)
+        self.parts.append(text)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        """Insert the buffered text at the end of the document"""
+        if not self.pending:
+            # Nothing arrived since the last frame, go idle until the next token
+            self.timer.stop()
+            return
+
+        start = time.perf_counter()
+        chunk = "".join(self.pending)
+        self.pending = []
+
+        # Only follow the output if the user has not scrolled up
+        scroll_bar = self.text_edit.verticalScrollBar()
+        at_bottom = scroll_bar.value() >= scroll_bar.maximum() - 4
+
+        cursor = QTextCursor(self.text_edit.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(chunk)
+
+        if at_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
+        self.render_time += time.perf_counter() - start
+
+    def finish(self):
+        """Flush everything that is still buffered and return the full text"""
+        self.flush()
+        self.timer.stop()
+        return self.text()
+
+    def text(self):
+        """Return all text appended since the last reset"""
+        return "".join(self.parts)
@@ -0,0 +1,66 @@
+import pytest
+
+from ollama_chat.connection_pool import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+
+def close(connection):
+    connection.closed = True
+
+
+def borrow(pool, key="db"):
+    return pool.connection(key, FakeConnection, ping=lambda c: not c.closed, close=close)
+
+
+def test_connection_is_reused():
+    pool = ConnectionPool(max_size=1)
+    with borrow(pool) as first:
+        pass
+    with borrow(pool) as second:
+        pass
+    assert first is second
+
+
+def test_slot_is_released_after_an_exception():
+    pool = ConnectionPool(max_size=1, acquire_timeout=0)
+    with pytest.raises(ValueError):
+        with borrow(pool):
+            raise ValueError("boom")
+    with borrow(pool) as connection:
+        assert not connection.closed
+
+
+def test_slot_is_released_when_a_generator_is_closed():
+    pool = ConnectionPool(max_size=1, acquire_timeout=0)
+
+    def rows():
+        with borrow(pool):
+            yield 1
+            yield 2
+
+    generator = rows()
+    next(generator)
+    generator.close()
+    with borrow(pool):
+        pass
+
+
+def test_exhausted_pool_raises():
+    pool = ConnectionPool(max_size=1, acquire_timeout=0)
+    with borrow(pool):
+        with pytest.raises(Exception, match="pooled connections are in use"):
+            with borrow(pool):
+                pass
+
+
+def test_close_all_closes_idle_connections():
+    pool = ConnectionPool()
+    with borrow(pool) as connection:
+        pass
+    pool.close_all()
+    assert connection.closed
+    assert pool.open_counts["db"] == 0
@@ -0,0 +1,99 @@
+import pytest
+
+from ollama_chat.query_guard import (QueryPlan, check_plan, is_explainable_sql, preview_sql,
+                                     row_source_relations, walk_plan)
+
+
+@pytest.mark.parametrize("sql, explainable", [
+    ("SELECT 1", True),
+    ("  -- comment\nwith a as (select 1) select * from a", True),
+    ("UPDATE t SET x = 1", True),
+    ("VALUES (1)", True),
+    ("CREATE TABLE t (id int)", False),
+    ("VACUUM t", False),
+    ("SELECTION", False),
+])
+def test_is_explainable_sql(sql, explainable):
+    assert is_explainable_sql(sql) == explainable
+
+
+def test_preview_sql():
+    assert preview_sql("SELECT * FROM t;  ", 10) == "SELECT * FROM (SELECT * FROM t\n) AS preview LIMIT 10"
+
+
+def test_walk_plan():
+    plan = {"Node Type": "Hash Join", "Plans": [
+        {"Node Type": "Seq Scan"},
+        {"Node Type": "Hash", "Plans": [{"Node Type": "Index Scan"}]},
+    ]}
+    assert [node["Node Type"] for node in walk_plan(plan)] == [
+        "Hash Join", "Seq Scan", "Hash", "Index Scan"
+    ]
+
+
+def test_check_plan_ok():
+    plan = QueryPlan(100.0, 10, [("public", "small", 50)])
+    assert check_plan(plan, 1000, 10000, 1000) == ("ok", [])
+
+
+def test_check_plan_warns_on_cost_and_large_scans():
+    plan = QueryPlan(5000.0, 10, [("public", "big", 2000000), ("public", "small", 50)])
+    level, reasons = check_plan(plan, 1000, 10000, 1000000)
+    assert level == "warn"
+    assert reasons == [
+        "Estimated cost 5,000 is above the warning level of 1,000",
+        "Sequential scan of public.big (about 2,000,000 rows)",
+    ]
+
+
+def test_check_plan_blocks_above_the_limit():
+    level, reasons = check_plan(QueryPlan(20000.0, 10, []), 1000, 10000, 0)
+    assert level == "block"
+    assert reasons == ["Estimated cost 20,000 is above the limit of 10,000"]
+
+
+def test_check_plan_with_disabled_thresholds():
+    plan = QueryPlan(1e9, 10, [("public", "big", 10 ** 9), ("public", "unknown", None)])
+    assert check_plan(plan, 0, 0, 0) == ("ok", [])
+
+
+def scan(relation, node_type="Seq Scan", **fields):
+    return dict({"Node Type": node_type, "Relation Name": relation}, **fields)
+
+
+def test_row_source_relations_of_a_single_table():
+    plan = {"Node Type": "Limit", "Plans": [
+        {"Node Type": "Sort", "Plans": [scan("parcels", "Index Scan")]},
+    ]}
+    assert row_source_relations(plan) == ["parcels"]
+
+
+def test_row_source_relations_of_a_join():
+    # SELECT p.id, p.geom, o.name FROM parcels p JOIN owners o ON o.parcel_id = p.id
+    plan = {"Node Type": "Hash Join", "Join Type": "Inner", "Plans": [
+        scan("owners"),
+        {"Node Type": "Hash", "Plans": [scan("parcels")]},
+    ]}
+    assert row_source_relations(plan) is None
+
+
+@pytest.mark.parametrize("node_type", ["Append", "ProjectSet", "Function Scan", "CTE Scan"])
+def test_row_source_relations_with_nodes_that_add_rows(node_type):
+    plan = {"Node Type": node_type, "Plans": [scan("parcels"), scan("parcels_archive")]}
+    assert row_source_relations(plan) is None
+
+
+def test_row_source_relations_ignores_filtering_joins_and_subplans():
+    # WHERE EXISTS (SELECT 1 FROM owners ...) AND area > (SELECT avg(area) FROM parcels)
+    plan = {"Node Type": "Hash Join", "Join Type": "Semi", "Plans": [
+        scan("parcels", Plans=[{"Node Type": "Aggregate", "Parent Relationship": "InitPlan",
+                                "Plans": [scan("parcels")]}]),
+        {"Node Type": "Hash", "Plans": [scan("owners")]},
+    ]}
+    assert row_source_relations(plan) == ["parcels"]
+
+    right = {"Node Type": "Hash Join", "Join Type": "Right Semi", "Plans": [
+        scan("owners"),
+        {"Node Type": "Hash", "Plans": [scan("parcels")]},
+    ]}
+    assert row_source_relations(right) == ["parcels"]
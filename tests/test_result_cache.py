@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from ollama_chat.result_cache import ResultCache, is_cacheable_sql, normalize_sql
+
+
+DESCRIPTION = (("id",),)
+
+
+def test_normalize_sql():
+    assert normalize_sql("SELECT  *\n  FROM t -- all rows\n;") == "SELECT * FROM t"
+    assert normalize_sql("select /* x */ 1") == "select 1"
+    assert normalize_sql("SELECT 'a  b' ,  \"x  y\"") == "SELECT 'a  b' , \"x  y\""
+    assert normalize_sql(None) == ""
+
+
+def test_get_returns_cached_rows_for_equivalent_sql():
+    cache = ResultCache()
+    cache.put("db", "SELECT * FROM t;", DESCRIPTION, [(1,), (2,)])
+    result = cache.get("db", "SELECT *\n FROM t")
+    assert result.first_batch == [(1,), (2,)]
+    assert result.columns == ["id"]
+    assert cache.get("other", "SELECT * FROM t") is None
+
+
+def test_entries_expire(monkeypatch):
+    cache = ResultCache(ttl=10)
+    cache.put("db", "SELECT 1", DESCRIPTION, [(1,)])
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("db", "SELECT 1") is None
+    assert cache.total_bytes == 0
+
+
+def test_zero_ttl_disables_the_cache():
+    cache = ResultCache(ttl=0)
+    cache.put("db", "SELECT 1", DESCRIPTION, [(1,)])
+    assert cache.get("db", "SELECT 1") is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    rows = [(i,) for i in range(100)]
+    probe = ResultCache()
+    probe.put("db", "SELECT 1", DESCRIPTION, rows)
+    cache = ResultCache(max_bytes=probe.total_bytes * 2)
+    cache.put("db", "SELECT 1", DESCRIPTION, rows)
+    cache.put("db", "SELECT 2", DESCRIPTION, rows)
+    cache.get("db", "SELECT 1")
+    cache.put("db", "SELECT 3", DESCRIPTION, rows)
+    assert cache.get("db", "SELECT 2") is None
+    assert cache.get("db", "SELECT 1") is not None
+    assert cache.get("db", "SELECT 3") is not None
+
+
+def test_results_larger_than_the_cache_are_not_stored():
+    cache = ResultCache(max_bytes=100)
+    cache.put("db", "SELECT 1", DESCRIPTION, [(i,) for i in range(100)])
+    assert cache.get("db", "SELECT 1") is None
+
+
+def test_invalidate():
+    cache = ResultCache()
+    cache.put("a", "SELECT 1", DESCRIPTION, [(1,)])
+    cache.put("b", "SELECT 1", DESCRIPTION, [(1,)])
+    cache.invalidate("a")
+    assert cache.get("a", "SELECT 1") is None
+    assert cache.get("b", "SELECT 1") is not None
+    cache.invalidate()
+    assert cache.get("b", "SELECT 1") is None
+    assert cache.total_bytes == 0
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT now()",
+    "SELECT * FROM t WHERE created > NOW () - interval '1 day'",
+    "SELECT random() FROM t",
+    "SELECT nextval('t_id_seq')",
+    "SELECT clock_timestamp()",
+    "SELECT * FROM t WHERE day = current_date",
+    "SELECT CURRENT_TIMESTAMP",
+])
+def test_queries_calling_volatile_functions_are_not_cached(sql):
+    assert not is_cacheable_sql(sql)
+    cache = ResultCache()
+    cache.put("db", sql, DESCRIPTION, [(1,)])
+    assert cache.get("db", sql) is None
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM t",
+    "SELECT 'now()' AS label",
+    'SELECT "random" FROM t',
+    "SELECT known_random FROM t -- random()",
+    "SELECT now_playing FROM t",
+])
+def test_queries_without_volatile_functions_are_cacheable(sql):
+    assert is_cacheable_sql(sql)
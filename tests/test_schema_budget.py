@@ -0,0 +1,94 @@
+from ollama_chat.schema_budget import (abbreviate_type, compact_table_line, estimate_tokens,
+                                       fit_relations, render_compact_schema_text, render_relations,
+                                       schema_budget)
+from ollama_chat.schema_catalog import RelationInfo
+
+
+def relation(name, column_count=3, schema="public", kind="r"):
+    columns = [(f"column_{i}", "character varying(50)") for i in range(column_count)]
+    return RelationInfo(schema, name, kind, columns)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens(None) == 0
+    assert estimate_tokens("id") == 1
+    assert estimate_tokens("road_segments(id int)") == 4 + 1 + 1 + 1 + 1
+
+
+def test_abbreviate_type():
+    assert abbreviate_type("character varying(255)") == "varchar(255)"
+    assert abbreviate_type("timestamp with time zone") == "timestamptz"
+    assert abbreviate_type("integer[]") == "int[]"
+    assert abbreviate_type("geometry(Point,4326)") == "geometry(Point,4326)"
+
+
+def test_compact_table_line():
+    table = RelationInfo("gis", "Roads", "v", [("id", "integer"), ("geom", "geometry")])
+    assert compact_table_line(table) == 'view gis."Roads"(id int, geom geometry)'
+
+
+def test_compact_table_line_keeps_geometry_columns():
+    table = RelationInfo("public", "roads", "r", [(f"c{i}", "text") for i in range(8)] +
+                         [("geom", "geometry")])
+    assert compact_table_line(table, 3) == "roads(c0 text, c1 text, geom geometry, +6 more)"
+
+
+def test_schema_budget_rounds_the_prompt_up():
+    assert schema_budget(4096, "short prompt") == 4096 - 1024 - 256
+    assert schema_budget(4096, "short prompt") == schema_budget(4096, "another short prompt")
+    assert schema_budget(256, "prompt") == 0
+
+
+def test_schema_budget_subtracts_the_reused_context():
+    assert schema_budget(4096, "short prompt", context_tokens=1000) == 4096 - 1024 - 256 - 1000
+    assert schema_budget(4096, "short prompt", context_tokens=4000) == 0
+
+
+def test_fit_relations_keeps_everything_that_fits():
+    relations = [relation("a"), relation("b")]
+    lines, stats = fit_relations(relations, 10000)
+    assert lines == [compact_table_line(r) for r in relations]
+    assert stats["full"] == 2 and stats["summarized"] == 0 and stats["omitted"] == 0
+
+
+def test_fit_relations_summarizes_then_omits():
+    relations = [relation(f"table_{i}", column_count=20) for i in range(10)]
+    full_cost = estimate_tokens(compact_table_line(relations[0])) + 1
+    summary_cost = estimate_tokens(compact_table_line(relations[0], 6)) + 1
+    budget = full_cost * 2 + summary_cost + 30
+    lines, stats = fit_relations(relations, budget)
+    assert stats["full"] == 2
+    assert stats["summarized"] >= 1
+    assert stats["full"] + stats["summarized"] + stats["omitted"] == len(relations)
+    assert lines[-1].startswith(f"-- {stats['omitted']} more tables not shown")
+    assert stats["tokens"] <= budget
+
+
+def test_fit_relations_with_no_budget_counts_the_tables():
+    lines, stats = fit_relations([relation("a"), relation("b")], 0)
+    assert lines == ["-- 2 more tables not shown"]
+    assert stats["omitted"] == 2
+
+
+def test_render_compact_schema_text():
+    text, note = render_compact_schema_text([relation("roads")], "gisdb", 10000, "All available tables")
+    assert "Database: gisdb" in text
+    assert compact_table_line(relation("roads")) in text
+    assert note is None
+
+    relations = [relation(f"table_{i}", column_count=30) for i in range(50)]
+    text, note = render_compact_schema_text(relations, "gisdb", 300, "All available tables")
+    assert note.startswith("Schema trimmed to fit the context window")
+    assert render_compact_schema_text([], "gisdb", 300, "All available tables") == ("", None)
+
+
+def test_render_relations_keeps_the_requested_format_without_budget():
+    relations = [relation(f"table_{i}", column_count=30) for i in range(50)]
+    text, note = render_relations(relations, "gisdb", "All available tables", "compact")
+    assert text == render_compact_schema_text(relations, "gisdb", None, "All available tables")[0]
+    assert compact_table_line(relations[-1]) in text
+    assert note is None
+
+    verbose, _ = render_relations(relations, "gisdb", "All available tables", "verbose")
+    assert verbose != text
@@ -0,0 +1,34 @@
+import pytest
+
+from ollama_chat.schema_retrieval import IndexNotReady, SchemaRetriever
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, model_name, inputs):
+        self.calls += 1
+        return [[1.0, 0.0] for _ in inputs]
+
+
+def test_rank_does_not_build_a_missing_index(tmp_path):
+    client = FakeClient()
+    retriever = SchemaRetriever(client, str(tmp_path))
+    catalog = object()
+    assert not retriever.is_ready("db", catalog, "embed")
+    with pytest.raises(IndexNotReady):
+        retriever.rank("db", catalog, "embed", "roads near rivers", 5)
+    assert client.calls == 0
+
+
+def test_rank_does_not_wait_for_an_index_being_built(tmp_path):
+    retriever = SchemaRetriever(FakeClient(), str(tmp_path))
+    catalog = object()
+    index = retriever.get_index("db", "embed")
+    index.catalog = catalog
+    assert retriever.is_ready("db", catalog, "embed")
+    with index.lock:
+        assert not retriever.is_ready("db", catalog, "embed")
+        with pytest.raises(IndexNotReady):
+            retriever.rank("db", catalog, "embed", "roads near rivers", 5)
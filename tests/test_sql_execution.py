@@ -0,0 +1,146 @@
+import pytest
+
+from ollama_chat.sql_execution import (StatementResult, count_query, failed_statement, group_statements,
+                                       is_read_only_sql, mask_literals, returns_no_rows,
+                                       split_statements)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM t",
+    "select id from t;",
+    "  -- latest first\nSELECT * FROM t ORDER BY id DESC",
+    "(SELECT 1)",
+    "WITH a AS (SELECT 1) SELECT * FROM a",
+    "SELECT * FROM t WHERE action = 'DELETE'",
+    "SELECT * FROM t WHERE note = 'insert into x'",
+    "SELECT 1 -- insert into log",
+    "SELECT 1 /* UPDATE t SET x = 1 */",
+    "SELECT $$DELETE FROM t$$",
+    "SELECT $body$ INTO $body$",
+    'SELECT "update", "into" FROM t',
+    "SELECT E'it\\'s DELETE' FROM t",
+    "SELECT ';' AS semicolon",
+    "SELECT for_share FROM t",
+    "SELECT * FROM t WHERE note = 'for share'",
+])
+def test_read_only_statements(sql):
+    assert is_read_only_sql(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "INSERT INTO t VALUES (1)",
+    "DELETE FROM t",
+    "SELECT * INTO t2 FROM t",
+    "SELECT id, name INTO TEMP t2 FROM t WHERE id > 10",
+    "SELECT * FROM t FOR UPDATE",
+    "SELECT * FROM t WHERE id = 1 FOR NO KEY UPDATE NOWAIT",
+    "SELECT * FROM t FOR SHARE",
+    "select * from t for key share skip locked",
+    "SELECT * FROM a JOIN b USING (id) FOR UPDATE OF a",
+    "WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d",
+    "SELECT 1; DROP TABLE t",
+    "SELECT 'a'; DELETE FROM t",
+    "CREATE TABLE t AS SELECT 1",
+    "",
+])
+def test_writing_or_multiple_statements(sql):
+    assert not is_read_only_sql(sql)
+
+
+def test_mask_literals_keeps_positions():
+    sql = "SELECT 'a;b', \"x\" -- c;\nFROM t /* d */ WHERE y = $$e$$"
+    masked = mask_literals(sql)
+    assert len(masked) == len(sql)
+    assert masked == "SELECT '   ', \" \"" + " " * 6 + "\nFROM t" + " " * 9 + "WHERE y = $$ $$"
+
+
+def test_returns_no_rows_ignores_returning_in_literals():
+    assert returns_no_rows("INSERT INTO t VALUES ('RETURNING')")
+    assert not returns_no_rows("INSERT INTO t VALUES (1) RETURNING id")
+    assert not returns_no_rows("SELECT 1")
+
+
+def test_count_query_wraps_the_statement():
+    assert count_query("SELECT * FROM t;\n") == "SELECT count(*) FROM (SELECT * FROM t\n) AS q"
+
+
+class Diagnostics:
+    def __init__(self, statement_position):
+        self.statement_position = statement_position
+
+
+class DatabaseError(Exception):
+    def __init__(self, statement_position):
+        super().__init__("error")
+        self.diag = Diagnostics(statement_position)
+
+
+@pytest.mark.parametrize("sql, statements", [
+    ("SELECT 1; SELECT 2;", ["SELECT 1", "SELECT 2"]),
+    ("SELECT ';'; SELECT 2", ["SELECT ';'", "SELECT 2"]),
+    ('SELECT 1 AS "a;b"', ['SELECT 1 AS "a;b"']),
+    ("CREATE FUNCTION f() RETURNS int AS $$ SELECT 1; $$ LANGUAGE sql; SELECT f()",
+     ["CREATE FUNCTION f() RETURNS int AS $$ SELECT 1; $$ LANGUAGE sql", "SELECT f()"]),
+    ("SELECT 1; -- done;\n", ["SELECT 1"]),
+    ("SELECT 1 /* ; */", ["SELECT 1 /* ; */"]),
+    ("; ;", []),
+    ("", []),
+    (None, []),
+])
+def test_split_statements(sql, statements):
+    assert split_statements(sql) == statements
+
+
+def test_group_statements_sends_consecutive_writes_together():
+    statements = [
+        "INSERT INTO t VALUES (1)",
+        "UPDATE t SET x = 2",
+        "SELECT * FROM t",
+        "DELETE FROM t",
+        "DELETE FROM t RETURNING id",
+        "CREATE TABLE u (id int)",
+        "DROP TABLE u",
+    ]
+    assert group_statements(statements) == [[0, 1], [2], [3], [4], [5, 6]]
+
+
+def test_group_statements_without_grouping():
+    statements = ["INSERT INTO t VALUES (1)", "INSERT INTO t VALUES (2)"]
+    assert group_statements(statements, group_writes=False) == [[0], [1]]
+
+
+def test_failed_statement_of_a_single_statement_group():
+    assert failed_statement(Exception("error"), ["SELECT 1"], [0]) == 0
+
+
+def test_failed_statement_from_error_position():
+    statements = ["INSERT INTO t VALUES (1)", "INSERT INTO u VALUES (2)", "DROP TABLE v"]
+    # Statements are sent joined by ";\n", the second one starts at 27
+    second = len(statements[0]) + 2 + 1
+    assert failed_statement(DatabaseError(1), statements, [0, 1, 2]) == 0
+    assert failed_statement(DatabaseError(second), statements, [0, 1, 2]) == 1
+    assert failed_statement(DatabaseError(second + 30), statements, [0, 1, 2]) == 2
+
+
+def test_failed_statement_without_position():
+    statements = ["INSERT INTO t VALUES (1)", "INSERT INTO u VALUES (2)"]
+    assert failed_statement(Exception("error"), statements, [0, 1]) is None
+    assert failed_statement(DatabaseError(None), statements, [0, 1]) is None
+
+
+def test_statement_result_describe():
+    result = StatementResult("UPDATE t SET x = 1")
+    result.rowcount = 3
+    result.elapsed = 0.0125
+    assert result.describe() == "3 rows affected, 12.5 ms"
+    result.round_trip = 2
+    result.rolled_back = True
+    assert result.describe() == "3 rows affected, 12.5 ms for 2 statements sent together (rolled back)"
+
+    failed = StatementResult("SELECT x")
+    failed.error = "column x does not exist"
+    assert failed.describe() == "error: column x does not exist"
+
+    skipped = StatementResult("SELECT 1")
+    skipped.skipped = True
+    assert skipped.describe() == "skipped"
@@ -0,0 +1,81 @@
+import pytest
+
+from ollama_chat.sql_extraction import (IncrementalSqlExtractor, extract_sql_from_text,
+                                        format_sql_response, parse_sql_response)
+
+
+RESPONSE = (
+    "Here is the query:\n\n"
+    "```sql\nSELECT name\nFROM roads\nWHERE length > 100;\n```\n\n"
+    "It returns the long roads.\n\n"
+    "```sql\nSELECT 2;\n```"
+)
+
+
+def test_extract_first_sql_block():
+    assert extract_sql_from_text(RESPONSE) == "SELECT name\nFROM roads\nWHERE length > 100;"
+
+
+def test_extract_skips_empty_blocks():
+    assert extract_sql_from_text("```sql\n```\n```SQL\nSELECT 1;\n```") == "SELECT 1;"
+
+
+def test_extract_without_fence():
+    text = "Run SELECT * FROM a; and then DELETE FROM b; to clean up"
+    assert extract_sql_from_text(text) == "SELECT * FROM a;\n\nDELETE FROM b;"
+    assert extract_sql_from_text("No SQL here") is None
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64, len(RESPONSE)])
+def test_incremental_extractor_matches_full_text(chunk_size):
+    extractor = IncrementalSqlExtractor()
+    found = []
+    for start in range(0, len(RESPONSE), chunk_size):
+        sql = extractor.feed(RESPONSE[start:start + chunk_size])
+        if sql is not None:
+            found.append(sql)
+    assert found == [extract_sql_from_text(RESPONSE)]
+
+
+def test_incremental_extractor_waits_for_closing_fence():
+    extractor = IncrementalSqlExtractor()
+    assert extractor.feed("``") is None
+    assert extractor.feed("`sq") is None
+    assert extractor.feed("l\nSELECT 1") is None
+    assert extractor.feed(";\n``") is None
+    assert extractor.feed("`") == "SELECT 1;"
+    assert extractor.feed("```sql\nSELECT 2;\n```") is None
+
+
+def test_incremental_extractor_reset():
+    extractor = IncrementalSqlExtractor()
+    extractor.feed("```sql\nSELECT 1;\n```")
+    extractor.reset()
+    assert extractor.feed("```sql\nSELECT 2;\n```") == "SELECT 2;"
+
+
+def test_parse_sql_response():
+    response = parse_sql_response(
+        '{"sql": "SELECT *\\nFROM roads;", "tables_used": ["roads"], "notes": " All roads. "}'
+    )
+    assert response == {"sql": "SELECT *\nFROM roads;", "tables_used": ["roads"], "notes": "All roads."}
+    assert format_sql_response(response) == (
+        "```sql\nSELECT *\nFROM roads;\n```\n\nTables used: roads\n\nAll roads."
+    )
+
+
+def test_parse_sql_response_cut_off_after_sql():
+    response = parse_sql_response('{"sql": "SELECT 1;", "tables_used": ["ro')
+    assert response == {"sql": "SELECT 1;", "tables_used": [], "notes": ""}
+
+
+def test_parse_sql_response_with_fenced_sql():
+    response = parse_sql_response('{"sql": "```sql\\nSELECT 1;\\n```", "tables_used": "roads"}')
+    assert response["sql"] == "SELECT 1;"
+    assert response["tables_used"] == []
+
+
+@pytest.mark.parametrize("text", ["", "not json", '{"sql": ""}', '{"sql": 1}', "[1, 2]",
+                                  '{"sql": "SELECT'])
+def test_parse_sql_response_without_sql(text):
+    assert parse_sql_response(text) is None
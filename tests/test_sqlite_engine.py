@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+
+from ollama_chat.sqlite_engine import connect_sqlite, rtree_extent, rtree_index
+
+
+def journal_mode(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def geopackage(tmp_path):
+    """A minimal GeoPackage-like file with an R-tree on points.geom"""
+    path = str(tmp_path / "points.gpkg")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE gpkg_contents (table_name TEXT);
+        CREATE TABLE gpkg_extensions (table_name TEXT, column_name TEXT, extension_name TEXT);
+        INSERT INTO gpkg_extensions VALUES ('points', 'geom', 'gpkg_rtree_index');
+        CREATE TABLE points (fid INTEGER PRIMARY KEY, name TEXT);
+        CREATE VIRTUAL TABLE rtree_points_geom USING rtree(id, minx, maxx, miny, maxy);
+    """)
+    for fid, x in ((1, 0.0), (2, 5.0), (3, 50.0)):
+        connection.execute("INSERT INTO points VALUES (?, ?)", (fid, f"p{fid}"))
+        connection.execute("INSERT INTO rtree_points_geom VALUES (?, ?, ?, ?, ?)", (fid, x, x, x, x))
+    connection.commit()
+    connection.close()
+    return path
+
+
+def test_write_connection_keeps_journal_mode_by_default(geopackage):
+    connect_sqlite(geopackage).close()
+    assert journal_mode(geopackage) == "delete"
+
+
+def test_write_connection_switches_to_wal_when_asked(geopackage):
+    connect_sqlite(geopackage, wal=True).close()
+    assert journal_mode(geopackage) == "wal"
+
+
+def test_rtree_index_of_geopackage_table(geopackage):
+    connection = connect_sqlite(geopackage, read_only=True)
+    assert rtree_index(connection, "points") == (
+        "rtree_points_geom", "id", ("minx", "maxx", "miny", "maxy")
+    )
+    assert rtree_index(connection, "gpkg_contents") is None
+
+
+def test_rtree_extent_filters_and_drops_view(geopackage):
+    connection = connect_sqlite(geopackage, read_only=True)
+    with rtree_extent(connection, "points", (-1, -1, 10, 10)) as used:
+        names = [row[0] for row in connection.execute("SELECT name FROM points ORDER BY fid")]
+    assert used
+    assert names == ["p1", "p2"]
+    assert connection.execute("SELECT count(*) FROM points").fetchone()[0] == 3
+
+
+def test_rtree_extent_without_index_or_bounds(geopackage):
+    connection = connect_sqlite(geopackage, read_only=True)
+    with rtree_extent(connection, "gpkg_contents", (0, 0, 1, 1)) as used:
+        assert not used
+    with rtree_extent(connection, "points", None) as used:
+        assert not used